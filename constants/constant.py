@@ -16,6 +16,7 @@ order_status = (
 payment_status = (
     ("Paid", "Paid"),
     ("Unpaid", "Unpaid"),
+    ("Refunded", "Refunded"),
 )
 
 
@@ -32,6 +32,9 @@ class FoodPackage(models.Model):
     available_quantity = models.IntegerField(default=0)
     food_type = models.CharField(max_length=50, choices=food_types, default="Package")
     total_purchase = models.BigIntegerField(default=0)
+    prep_minutes = models.PositiveSmallIntegerField(
+        default=15, help_text=_("Estimated kitchen preparation time in minutes")
+    )
     date_created = models.DateTimeField(default=timezone.now)
     date_updated = models.DateTimeField(default=timezone.now)
 
@@ -113,6 +116,9 @@ class Food(models.Model):
     available_quantity = models.IntegerField(default=0)
     food_type = models.CharField(max_length=50, choices=food_types, default="Meal")
     total_purchase = models.BigIntegerField(default=0)
+    prep_minutes = models.PositiveSmallIntegerField(
+        default=15, help_text=_("Estimated kitchen preparation time in minutes")
+    )
     date_created = models.DateTimeField(default=timezone.now)
     date_updated = models.DateTimeField(default=timezone.now)
 
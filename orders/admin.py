@@ -1,22 +1,129 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-from orders.models import Order, OrderItem
+from orders.cancellation import cancel_orders
+from orders.lifecycle import InvalidTransition, bulk_transition
+from orders.models import (
+    ArchivedOrder,
+    ArchiveRun,
+    Order,
+    OrderItem,
+    OrderStatusHistory,
+    RiderRun,
+)
 
 # Register your models here.
 
 
+class OrderStatusHistoryInline(admin.TabularInline):
+    model = OrderStatusHistory
+    extra = 0
+    can_delete = False
+    readonly_fields = ["from_status", "to_status", "changed_by", "created_at"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+def _move_orders(to_status):
+    """build an admin action moving the selected orders to `to_status`"""
+
+    def action(modeladmin, request, queryset):
+        try:
+            moved, skipped = bulk_transition(
+                list(queryset.values_list("order_id", flat=True)),
+                to_status,
+                request.user,
+            )
+        except InvalidTransition as e:
+            modeladmin.message_user(request, e.message, messages.ERROR)
+            return
+        modeladmin.message_user(request, f"{len(moved)} orders moved to {to_status}")
+        if skipped:
+            modeladmin.message_user(
+                request,
+                f"{len(skipped)} orders cannot move to {to_status}",
+                messages.WARNING,
+            )
+
+    action.__name__ = f"mark_{to_status.lower().replace(' ', '_')}"
+    action.short_description = f"Mark selected orders as {to_status}"
+    return action
+
+
+@admin.action(description="Cancel selected orders and refund them")
+def cancel_selected_orders(modeladmin, request, queryset):
+    """cancels like the status API, refunding paid orders and restocking"""
+    try:
+        cancelled, skipped, refunded = cancel_orders(
+            list(queryset.values_list("order_id", flat=True)), request.user
+        )
+    except InvalidTransition as e:
+        modeladmin.message_user(request, e.message, messages.ERROR)
+        return
+    modeladmin.message_user(
+        request, f"{len(cancelled)} orders cancelled, {refunded} refunded"
+    )
+    if skipped:
+        modeladmin.message_user(
+            request, f"{len(skipped)} orders cannot be cancelled", messages.WARNING
+        )
+
+
 class OrderAdmin(admin.ModelAdmin):
     list_display = (
         "order_id",
         "user",
+        "status",
         "total_amount",
         "payment_status",
         "payment_type",
         "created_at",
     )
-    search_fields = ["order_id", "user__username"]
-    list_filter = ["created_at", "payment_status", "payment_type"]
+    # exact match on order_id so the lookup uses its unique index
+    search_fields = ["=order_id", "user__username"]
+    list_filter = ["created_at", "status", "payment_status", "payment_type"]
+    list_select_related = ["user"]
+    # status only changes through the actions so transitions are validated
+    readonly_fields = ["status"]
+    inlines = [OrderStatusHistoryInline]
+    actions = [
+        _move_orders(status) for status in ("Preparing", "On Delivery", "Delivered")
+    ] + [cancel_selected_orders]
+
+
+class RiderRunAdmin(admin.ModelAdmin):
+    list_display = ("id", "zone", "window_start", "order_count", "dispatched_at")
+    list_filter = ["zone", "dispatched_at"]
 
 
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem)
+
+
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ("order_id", "user", "status", "total_amount", "created_at")
+    search_fields = ["=order_id", "user__username"]
+    list_select_related = ["user"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ArchiveRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "cutoff",
+        "orders_moved",
+        "items_moved",
+        "verified",
+        "started_at",
+        "finished_at",
+    )
+
+
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
+admin.site.register(ArchiveRun, ArchiveRunAdmin)
+admin.site.register(RiderRun, RiderRunAdmin)
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class OrdersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "orders"
+
+    def ready(self):
+        from orders.dispatch import batch_ready_orders
+        from orders.events import publish_status_changes
+        from orders.rollups import record_placed_order
+        from orders.signals import order_placed, order_status_changed
+
+        order_status_changed.connect(
+            publish_status_changes, dispatch_uid="orders.publish_status_changes"
+        )
+        order_status_changed.connect(
+            batch_ready_orders, dispatch_uid="orders.dispatch_status_changes"
+        )
+        order_placed.connect(record_placed_order, dispatch_uid="orders.rollups_placed")
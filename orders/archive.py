@@ -0,0 +1,243 @@
+import calendar
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Tuple, Union
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from orders.models import (
+    ArchivedOrder,
+    ArchivedOrderItem,
+    ArchiveRun,
+    Order,
+    OrderItem,
+    OrderStatusHistory,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# only orders that can no longer change are archived
+ARCHIVE_STATUSES = ("Delivered", "Cancelled")
+
+# orders moved per transaction
+ARCHIVE_BATCH_SIZE = 500
+
+ORDER_FIELDS = [
+    "id",
+    "user_id",
+    "total_amount",
+    "status",
+    "order_id",
+    "payment_status",
+    "payment_type",
+    "delivery_address",
+    "delivery_zone",
+    "rider_run_id",
+    "promised_at",
+    "created_at",
+    "updated_at",
+]
+
+ITEM_FIELDS = [
+    "id",
+    "order_id",
+    "food_item_id",
+    "food_item_type",
+    "quantity",
+    "name",
+    "unit_price",
+]
+
+
+def months_ago(months: int, now: Union[datetime, None] = None) -> datetime:
+    """Same time of day `months` calendar months before `now`"""
+    now = now or timezone.now()
+    month = now.month - 1 - months
+    year = now.year + month // 12
+    month = month % 12 + 1
+    day = min(now.day, calendar.monthrange(year, month)[1])
+    return now.replace(year=year, month=month, day=day)
+
+
+def totals(cutoff: datetime) -> Tuple[int, int, Decimal]:
+    """Orders, lines and amount created before `cutoff`, hot and archived"""
+    hot = Order.objects.filter(created_at__lt=cutoff).aggregate(
+        orders=Count("id"), amount=Sum("total_amount")
+    )
+    cold = ArchivedOrder.objects.filter(created_at__lt=cutoff).aggregate(
+        orders=Count("id"), amount=Sum("total_amount")
+    )
+    items = (
+        OrderItem.objects.filter(order__created_at__lt=cutoff).count()
+        + ArchivedOrderItem.objects.filter(order__created_at__lt=cutoff).count()
+    )
+    amount = (hot["amount"] or Decimal("0")) + (cold["amount"] or Decimal("0"))
+    return hot["orders"] + cold["orders"], items, amount
+
+
+def start_run(months: Union[int, None] = None) -> ArchiveRun:
+    """Resumes the unfinished archive run or starts a new one
+
+    Args:
+        months (Union[int, None], optional): age in months of the orders to
+            archive. Defaults to settings.ORDER_ARCHIVE_MONTHS.
+
+    Returns:
+        ArchiveRun: the run with its totals taken before any order moved
+    """
+    run = ArchiveRun.objects.filter(finished_at__isnull=True).order_by("id").first()
+    if run is not None:
+        return run
+    if months is None:
+        months = settings.ORDER_ARCHIVE_MONTHS
+    cutoff = months_ago(months)
+    orders, items, amount = totals(cutoff)
+    return ArchiveRun.objects.create(
+        cutoff=cutoff,
+        orders_before=orders,
+        items_before=items,
+        amount_before=amount,
+    )
+
+
+def _history(order_ids) -> dict:
+    history = {}
+    rows = (
+        OrderStatusHistory.objects.filter(order_id__in=order_ids)
+        .order_by("order_id", "created_at", "id")
+        .values("order_id", "from_status", "to_status", "changed_by_id", "created_at")
+    )
+    for row in rows:
+        order_id = row.pop("order_id")
+        row["created_at"] = row["created_at"].isoformat()
+        history.setdefault(order_id, []).append(row)
+    return history
+
+
+def archive_batch(run: ArchiveRun, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Moves the next chunk of eligible orders to the archive tables
+
+    Copying and deleting happen in one transaction and the checkpoint is
+    saved with them, so a run stopped at any point resumes where it left off.
+
+    Returns:
+        int: number of orders moved, 0 once nothing is left to archive
+    """
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(
+                id__gt=run.last_order_id,
+                created_at__lt=run.cutoff,
+                status__in=ARCHIVE_STATUSES,
+            )
+            .order_by("id")
+            .values(*ORDER_FIELDS)[:batch_size]
+        )
+        if not orders:
+            return 0
+        order_ids = [order["id"] for order in orders]
+        history = _history(order_ids)
+        items = list(
+            OrderItem.objects.filter(order_id__in=order_ids).values(*ITEM_FIELDS)
+        )
+        ArchivedOrder.objects.bulk_create(
+            [
+                ArchivedOrder(**order, status_history=history.get(order["id"], []))
+                for order in orders
+            ],
+            ignore_conflicts=True,
+        )
+        ArchivedOrderItem.objects.bulk_create(
+            [ArchivedOrderItem(**item) for item in items], ignore_conflicts=True
+        )
+        # lines and history go with their order through the cascade
+        Order.objects.filter(id__in=order_ids).delete()
+        run.last_order_id = order_ids[-1]
+        run.orders_moved += len(orders)
+        run.items_moved += len(items)
+        run.save(update_fields=["last_order_id", "orders_moved", "items_moved"])
+    return len(orders)
+
+
+def verify(run: ArchiveRun) -> bool:
+    """Compares the totals before the cutoff with those taken when the run began"""
+    run.orders_after, run.items_after, run.amount_after = totals(run.cutoff)
+    run.verified = (run.orders_after, run.items_after, run.amount_after) == (
+        run.orders_before,
+        run.items_before,
+        run.amount_before,
+    )
+    if not run.verified:
+        logger.error(
+            f"Archive run {run.id} does not add up, before "
+            f"{run.orders_before}/{run.items_before}/{run.amount_before} after "
+            f"{run.orders_after}/{run.items_after}/{run.amount_after}"
+        )
+    return run.verified
+
+
+def run_archive(
+    months: Union[int, None] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    max_batches: Union[int, None] = None,
+) -> ArchiveRun:
+    """Archives old delivered and cancelled orders, then verifies the totals
+
+    Args:
+        months (Union[int, None], optional): age in months of the orders to
+            archive. Defaults to settings.ORDER_ARCHIVE_MONTHS.
+        batch_size (int, optional): orders moved per transaction.
+        max_batches (Union[int, None], optional): stop after this many chunks,
+            the run is resumed by the next call. Defaults to None.
+
+    Returns:
+        ArchiveRun: the run, finished and verified unless max_batches was hit
+    """
+    run = start_run(months)
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        if not archive_batch(run, batch_size):
+            verify(run)
+            run.finished_at = timezone.now()
+            run.save()
+            break
+        batches += 1
+    return run
+
+
+def archived_cutoff() -> Union[datetime, None]:
+    """Cutoff of the latest finished run, older orders may be archived"""
+    run = (
+        ArchiveRun.objects.filter(finished_at__isnull=False).order_by("-cutoff").first()
+    )
+    return run.cutoff if run else None
+
+
+def find_order(order_id: str, user=None) -> Union[Order, ArchivedOrder]:
+    """Fetches an order by reference, falling back to the archive
+
+    Args:
+        order_id (str): the order reference
+        user (User, optional): restrict the lookup to this user's orders
+
+    Raises:
+        Order.DoesNotExist: the order is neither live nor archived
+
+    Returns:
+        Union[Order, ArchivedOrder]: the order with its items prefetched
+    """
+    filters = {"order_id": order_id}
+    if user is not None:
+        filters["user"] = user
+    try:
+        return Order.objects.prefetch_related("items").get(**filters)
+    except Order.DoesNotExist:
+        pass
+    try:
+        return ArchivedOrder.objects.prefetch_related("items").get(**filters)
+    except ArchivedOrder.DoesNotExist:
+        raise Order.DoesNotExist(f"Order {order_id} does not exist")
@@ -0,0 +1,170 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Tuple, Union
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from foods.models import Food, FoodPackage
+from orders.lifecycle import MAX_BULK_ORDERS, allowed_sources, bulk_transition
+from orders.models import Order, OrderItem
+from orders.rollups import apply_order
+from users.bulk_credit import CreditRow, bulk_credit
+from utils.utils import to_money
+
+logger = logging.getLogger(__name__)
+
+
+CANCELLED = "Cancelled"
+REFUND_DESCRIPTION = "Order Refund"
+# ledger idempotency keys are refund:<order_id>, an order is refunded once
+REFUND_KEY_PREFIX = "refund"
+
+# statuses a customer may still cancel their own order from
+CUSTOMER_CANCELLABLE = ["Pending"]
+
+STOCK_MODELS = {"Meal": Food, "Package": FoodPackage}
+
+
+def _per_item(quantities: Dict[int, int]) -> Case:
+    """quantity of each catalog row, for a set based UPDATE"""
+    return Case(
+        *[
+            When(id=item_id, then=Value(quantity))
+            for item_id, quantity in quantities.items()
+        ],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _restock(items: List[OrderItem]) -> None:
+    """gives the stock back and reverses the purchase counts, one UPDATE per kind"""
+    quantities: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    for item in items:
+        quantities[item.food_item_type][item.food_item_id] += item.quantity
+    for kind, model in STOCK_MODELS.items():
+        if quantities.get(kind):
+            model.objects.filter(id__in=quantities[kind]).update(
+                available_quantity=F("available_quantity")
+                + _per_item(quantities[kind]),
+                total_purchase=F("total_purchase") - _per_item(quantities[kind]),
+            )
+
+
+def _remove_from_rollups(orders: List[Order], items: List[OrderItem]) -> None:
+    """on_commit hook taking the cancelled orders out of the sales rollups"""
+    lines = defaultdict(list)
+    for item in items:
+        lines[item.order_id].append(item)
+    for order in orders:
+        try:
+            apply_order(order, lines[order.id], sign=-1)
+        except Exception as e:
+            # the nightly rebuild leaves cancelled orders out anyway
+            logger.error(
+                f"Unable to update sales rollups for {order.order_id} due to {e}"
+            )
+
+
+def cancel_orders(
+    order_ids: List[str],
+    cancelled_by=None,
+    sources: Union[List[str], None] = None,
+) -> Tuple[List[str], List[str], Decimal]:
+    """Cancels orders, refunds the paid ones and gives their stock back
+
+    Everything happens in one transaction: the status transition, a ledger
+    credit of the order total for every paid order, and one UPDATE per
+    catalog table putting the quantities back into `available_quantity`
+    and taking them off `total_purchase`. Refunds are keyed by order
+    reference, so an order is never refunded twice.
+
+    Args:
+        order_ids (List[str]): order references
+        cancelled_by (User, optional): user cancelling the orders. Defaults to None.
+        sources (Union[List[str], None], optional): statuses the orders may be
+            cancelled from. Defaults to every cancellable status.
+
+    Raises:
+        InvalidTransition: too many orders
+
+    Returns:
+        Tuple[List[str], List[str], Decimal]: cancelled and skipped order
+            references and the amount refunded
+    """
+    with transaction.atomic():
+        cancelled, skipped = bulk_transition(
+            order_ids, CANCELLED, cancelled_by, sources
+        )
+        if not cancelled:
+            return cancelled, skipped, Decimal("0.00")
+        orders = list(
+            Order.objects.filter(order_id__in=cancelled).only(
+                "id",
+                "order_id",
+                "user_id",
+                "total_amount",
+                "payment_status",
+                "created_at",
+            )
+        )
+        items = list(OrderItem.objects.filter(order__in=orders))
+        _restock(items)
+        refunds = [
+            (
+                order.order_id,
+                CreditRow(order.user_id, to_money(order.total_amount), order.order_id),
+            )
+            for order in orders
+            if order.payment_status == "Paid" and order.total_amount
+        ]
+        report = bulk_credit(
+            refunds, description=REFUND_DESCRIPTION, key_prefix=REFUND_KEY_PREFIX
+        )
+        if report.failures:
+            raise ValueError(f"Unable to refund orders {report.failures}")
+        Order.objects.filter(order_id__in=[ref for ref, _ in refunds]).update(
+            payment_status="Refunded"
+        )
+        transaction.on_commit(lambda: _remove_from_rollups(orders, items))
+    logger.info(
+        f"Cancelled {len(cancelled)} orders and refunded {report.amount} to wallets"
+    )
+    return cancelled, skipped, report.amount
+
+
+def cancel_slot(
+    start: datetime, end: datetime, cancelled_by=None
+) -> Tuple[List[str], Decimal]:
+    """Cancels every open order promised within a failed time slot
+
+    Orders are cancelled MAX_BULK_ORDERS at a time, each batch in its own
+    transaction, so a large slot never holds a long lock.
+
+    Args:
+        start (datetime): start of the slot, inclusive
+        end (datetime): end of the slot, exclusive
+        cancelled_by (User, optional): user cancelling the slot. Defaults to None.
+
+    Returns:
+        Tuple[List[str], Decimal]: cancelled order references and the amount refunded
+    """
+    open_orders = Order.objects.filter(
+        promised_at__gte=start,
+        promised_at__lt=end,
+        status__in=allowed_sources(CANCELLED),
+    ).order_by("id")
+    cancelled, refunded, last_id = [], Decimal("0.00"), 0
+    while True:
+        rows = list(
+            open_orders.filter(id__gt=last_id).values_list("id", "order_id")[
+                :MAX_BULK_ORDERS
+            ]
+        )
+        if not rows:
+            return cancelled, refunded
+        moved, _, amount = cancel_orders([ref for _, ref in rows], cancelled_by)
+        cancelled += moved
+        refunded += amount
+        last_id = rows[-1][0]
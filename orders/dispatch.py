@@ -0,0 +1,293 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple, Union
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from orders.models import Order, RiderRun
+
+logger = logging.getLogger(__name__)
+
+
+# orders handed to riders once the kitchen is done with them
+READY_STATUS = "On Delivery"
+
+# orders changed this long before the last sync are read again, for
+# transactions that committed after a sync passed their updated_at
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def delivery_zone(state: str, city: str) -> str:
+    """Zone key of an address, orders in the same zone can share a rider"""
+    return f"{state.strip().lower()}:{city.strip().lower()}"
+
+
+def zone_of(order: dict) -> str:
+    """Zone of an order row, legacy orders only have "city - address" text"""
+    if order["delivery_zone"]:
+        return order["delivery_zone"]
+    city = order["delivery_address"].split(" - ", 1)[0]
+    return delivery_zone("", city)
+
+
+@dataclass
+class ReadyOrder:
+    """An order waiting for a rider"""
+
+    order_id: str
+    zone: str
+    ready_at: datetime
+    promised_at: datetime
+
+
+@dataclass
+class DeliveryBatch:
+    """Orders of one zone and time window that leave with the same rider"""
+
+    zone: str
+    window_start: datetime
+    opened_at: datetime
+    orders: List[ReadyOrder] = field(default_factory=list)
+
+    @property
+    def order_ids(self) -> List[str]:
+        return [order.order_id for order in self.orders]
+
+
+class BatchingEngine:
+    """Groups ready orders into rider runs by zone and delivery window
+
+    An order joins the open batch of its zone and of the window its promised
+    time falls in. A batch closes as soon as it holds `max_batch_size`
+    orders, or once its first order has waited `max_wait`, so riders never
+    hold food back for long when a zone is quiet. Orders are fed one at a
+    time as they become ready and `tick` is called regularly to flush the
+    batches that waited long enough.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 5,
+        max_wait: timedelta = timedelta(minutes=10),
+        window: timedelta = timedelta(minutes=30),
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.window = window
+        self._batches: Dict[Tuple[str, datetime], DeliveryBatch] = {}
+        # open batch of every waiting order
+        self._orders: Dict[str, Tuple[str, datetime]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def _window_start(self, moment: datetime) -> datetime:
+        epoch = datetime(2000, 1, 1, tzinfo=moment.tzinfo)
+        return moment - (moment - epoch) % self.window
+
+    def add(self, order: ReadyOrder) -> List[DeliveryBatch]:
+        """Adds a ready order, returns the batch it filled up if any"""
+        with self._lock:
+            if order.order_id in self._orders:
+                return []
+            key = (order.zone, self._window_start(order.promised_at))
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = DeliveryBatch(
+                    zone=key[0], window_start=key[1], opened_at=order.ready_at
+                )
+                self._batches[key] = batch
+            batch.orders.append(order)
+            self._orders[order.order_id] = key
+            if len(batch.orders) < self.max_batch_size:
+                return []
+            return [self._close(key)]
+
+    def remove(self, order_id: str) -> bool:
+        """Drops an order that no longer needs a rider"""
+        with self._lock:
+            key = self._orders.pop(order_id, None)
+            if key is None:
+                return False
+            batch = self._batches[key]
+            batch.orders = [
+                order for order in batch.orders if order.order_id != order_id
+            ]
+            if not batch.orders:
+                del self._batches[key]
+            return True
+
+    def tick(self, now: datetime) -> List[DeliveryBatch]:
+        """Closes and returns the batches that waited `max_wait` or longer"""
+        with self._lock:
+            due = [
+                key
+                for key, batch in self._batches.items()
+                if now - batch.opened_at >= self.max_wait
+            ]
+            return [self._close(key) for key in due]
+
+    def flush(self) -> List[DeliveryBatch]:
+        """Closes every open batch"""
+        with self._lock:
+            return [self._close(key) for key in list(self._batches)]
+
+    def _close(self, key: Tuple[str, datetime]) -> DeliveryBatch:
+        batch = self._batches.pop(key)
+        for order in batch.orders:
+            del self._orders[order.order_id]
+        return batch
+
+
+def build_engine() -> BatchingEngine:
+    return BatchingEngine(
+        max_batch_size=settings.DISPATCH_MAX_BATCH_SIZE,
+        max_wait=timedelta(minutes=settings.DISPATCH_MAX_WAIT_MINUTES),
+        window=timedelta(minutes=settings.DISPATCH_WINDOW_MINUTES),
+    )
+
+
+def _ready_orders(queryset) -> List[ReadyOrder]:
+    """ready orders without a rider, ready since their last status change"""
+    rows = queryset.filter(status=READY_STATUS, rider_run__isnull=True).values(
+        "order_id",
+        "delivery_zone",
+        "delivery_address",
+        "promised_at",
+        "created_at",
+        "updated_at",
+    )
+    return [
+        ReadyOrder(
+            order_id=row["order_id"],
+            zone=zone_of(row),
+            # transitions stamp updated_at, so a reloaded engine keeps the
+            # time waited before the process started
+            ready_at=row["updated_at"],
+            promised_at=row["promised_at"] or row["created_at"],
+        )
+        for row in rows
+    ]
+
+
+def load_engine() -> Tuple[BatchingEngine, List[DeliveryBatch]]:
+    """Builds an engine from the ready orders that have no rider yet
+
+    Returns:
+        Tuple[BatchingEngine, List[DeliveryBatch]]: the engine and the batches
+            already full while loading
+    """
+    engine = build_engine()
+    engine.synced_at = timezone.now()
+    closed = []
+    # oldest first, a batch opens when its first order became ready
+    for order in _ready_orders(Order.objects.order_by("updated_at", "id")):
+        closed += engine.add(order)
+    return engine, closed
+
+
+def sync_engine(engine: BatchingEngine) -> List[DeliveryBatch]:
+    """Applies the order changes made since the last sync to a loaded engine
+
+    Status transitions and dispatching stamp updated_at, so the orders
+    changed since the last sync, minus SYNC_OVERLAP, hold the orders any
+    worker made ready, cancelled or gave a rider.
+
+    Returns:
+        List[DeliveryBatch]: the batches the new ready orders filled up
+    """
+    started = timezone.now()
+    changed = Order.objects.filter(
+        updated_at__gte=engine.synced_at - SYNC_OVERLAP
+    ).order_by("updated_at", "id")
+    for order_id, status, rider_run_id in changed.values_list(
+        "order_id", "status", "rider_run_id"
+    ):
+        if status != READY_STATUS or rider_run_id is not None:
+            engine.remove(order_id)
+    closed = []
+    for order in _ready_orders(changed):
+        closed += engine.add(order)
+    engine.synced_at = started
+    return closed
+
+
+_engine: Union[BatchingEngine, None] = None
+_engine_lock = threading.Lock()
+
+
+def get_dispatcher() -> BatchingEngine:
+    """Returns the process wide engine, synced with the database
+
+    Each worker process batches on its own copy, loaded on first use and
+    brought up to date from the orders table on every call, so orders made
+    ready through another worker join its batches too. Orders are attached
+    to a run with a conditional UPDATE, so an order is never given to two
+    riders.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine, closed = load_engine()
+        else:
+            closed = sync_engine(_engine)
+        engine = _engine
+    dispatch(closed)
+    return engine
+
+
+def reset_dispatcher() -> None:
+    """Forgets the in-memory engine, it is reloaded on next use"""
+    global _engine
+    with _engine_lock:
+        _engine = None
+
+
+def dispatch(batches: List[DeliveryBatch]) -> List[RiderRun]:
+    """Saves closed batches as rider runs
+
+    Returns:
+        List[RiderRun]: the runs that got at least one order
+    """
+    runs = []
+    for batch in batches:
+        with transaction.atomic():
+            run = RiderRun.objects.create(
+                zone=batch.zone, window_start=batch.window_start
+            )
+            # updated_at tells the engines of other workers to drop them
+            attached = Order.objects.filter(
+                order_id__in=batch.order_ids,
+                status=READY_STATUS,
+                rider_run__isnull=True,
+            ).update(rider_run=run, updated_at=timezone.now())
+            if not attached:
+                # another worker dispatched these orders already
+                run.delete()
+                continue
+            run.order_count = attached
+            run.save(update_fields=["order_count"])
+        runs.append(run)
+    return runs
+
+
+def dispatch_due(now: Union[datetime, None] = None) -> List[RiderRun]:
+    """Flushes the batches that waited long enough, run it every minute"""
+    return dispatch(get_dispatcher().tick(now or timezone.now()))
+
+
+def batch_ready_orders(sender, changes, changed_at, **kwargs) -> None:
+    """order_status_changed receiver batching ready orders right away"""
+    if not any(c["to_status"] in (READY_STATUS, "Cancelled") for c in changes):
+        return
+    try:
+        # the sync adds the ready orders and drops the cancelled ones
+        dispatch(get_dispatcher().tick(changed_at))
+    except Exception as e:
+        # waiting orders are picked up again on the next sync
+        logger.error(f"Unable to batch ready orders due to {e}")
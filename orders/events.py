@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Set, Union
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# messages buffered per subscriber before the oldest one is dropped
+SUBSCRIPTION_BUFFER = 100
+
+
+def user_channel(user_id: int) -> str:
+    """name of the channel carrying a user's order events"""
+    return f"orders:user:{user_id}"
+
+
+class LocalSubscription:
+    """Subscription to the in-process broker, bound to the caller's event loop"""
+
+    def __init__(self, broker: "LocalBroker", channel: str) -> None:
+        self.broker = broker
+        self.channel = channel
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+        self._queue: Union[asyncio.Queue, None] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=SUBSCRIPTION_BUFFER)
+        self.broker._add(self)
+
+    def _put(self, message: Dict[str, Any]) -> None:
+        if self._queue.full():
+            # a stalled client only loses its oldest updates
+            self._queue.get_nowait()
+        self._queue.put_nowait(message)
+
+    def deliver(self, message: Dict[str, Any]) -> None:
+        """hand a message over from any thread"""
+        try:
+            self._loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # the event loop is gone, the client has disconnected
+            self.broker._remove(self)
+
+    async def get(self) -> Dict[str, Any]:
+        return await self._queue.get()
+
+    async def close(self) -> None:
+        self.broker._remove(self)
+
+
+class LocalBroker:
+    """In-process broker, used by tests and single process deployments"""
+
+    def __init__(self) -> None:
+        self._subscribers: Dict[str, Set[LocalSubscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _add(self, subscription: LocalSubscription) -> None:
+        with self._lock:
+            self._subscribers[subscription.channel].add(subscription)
+
+    def _remove(self, subscription: LocalSubscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def subscribe(self, channel: str) -> LocalSubscription:
+        return LocalSubscription(self, channel)
+
+    def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+
+class RedisSubscription:
+    """Subscription to a redis pub/sub channel"""
+
+    def __init__(self, url: str, channel: str) -> None:
+        self.url = url
+        self.channel = channel
+        self._client = None
+        self._pubsub = None
+
+    async def start(self) -> None:
+        from redis import asyncio as aioredis
+
+        self._client = aioredis.from_url(self.url)
+        self._pubsub = self._client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+
+    async def get(self) -> Dict[str, Any]:
+        while True:
+            message = await self._pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=1.0
+            )
+            if message is not None:
+                return json.loads(message["data"])
+
+    async def close(self) -> None:
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class RedisBroker:
+    """Broker shared by every worker through redis pub/sub"""
+
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+
+    def subscribe(self, channel: str) -> RedisSubscription:
+        return RedisSubscription(self.url, channel)
+
+    def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        self._client.publish(channel, json.dumps(message))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Returns the configured broker, redis when ORDER_EVENTS_BROKER_URL is set"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = getattr(settings, "ORDER_EVENTS_BROKER_URL", "")
+                _broker = RedisBroker(url) if url else LocalBroker()
+    return _broker
+
+
+def publish_status_changes(sender, changes, changed_at, **kwargs) -> None:
+    """order_status_changed receiver pushing every change to its owner"""
+    try:
+        broker = get_broker()
+        for change in changes:
+            message = {
+                "order_id": change["order_id"],
+                "from_status": change["from_status"],
+                "status": change["to_status"],
+                "changed_at": changed_at.isoformat(),
+            }
+            broker.publish(user_channel(change["user_id"]), message)
+    except Exception as e:
+        # pushing is best effort, clients can always fetch the order
+        logger.error(f"Unable to publish order status changes due to {e}")
+
+
+async def event_stream(subscription, heartbeat: float, max_seconds: float):
+    """Server-Sent Events body for a subscription
+
+    The subscription is started by the first iteration, a client gone
+    before the response is streamed never registers one. Sends a comment
+    every `heartbeat` seconds so proxies keep the connection open, and ends
+    after `max_seconds` so a client that vanished without closing the
+    socket cannot hold a subscription forever, EventSource reconnects on
+    its own.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_seconds
+    try:
+        await subscription.start()
+        yield "retry: 3000\n\n"
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(
+                    subscription.get(), timeout=min(heartbeat, remaining)
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: order.status\ndata: {json.dumps(message)}\n\n"
+    finally:
+        await subscription.close()
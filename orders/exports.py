@@ -0,0 +1,201 @@
+import csv
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterator, Union
+from orders.models import Order, OrderItem
+
+# orders fetched per query while exporting
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+CSV_HEADER = [
+    "order_id",
+    "created_at",
+    "user_id",
+    "status",
+    "payment_status",
+    "payment_type",
+    "total_amount",
+    "delivery_address",
+    "item_kind",
+    "item_id",
+    "item_name",
+    "quantity",
+    "unit_price",
+]
+
+ORDER_FIELDS = [
+    "id",
+    "order_id",
+    "created_at",
+    "user_id",
+    "status",
+    "payment_status",
+    "payment_type",
+    "total_amount",
+    "delivery_address",
+]
+
+ITEM_FIELDS = [
+    "order_id",
+    "food_item_type",
+    "food_item_id",
+    "name",
+    "quantity",
+    "unit_price",
+]
+
+
+def parse_filters(params) -> Dict[str, Union[date, str, None]]:
+    """Reads the start, end and status export filters
+
+    Args:
+        params (dict): query params or command options
+
+    Raises:
+        ValueError: a date is not in the YYYY-MM-DD format
+
+    Returns:
+        Dict[str, Union[date, str, None]]: export filters
+    """
+    start = params.get("start")
+    end = params.get("end")
+    return {
+        "start": date.fromisoformat(start) if start else None,
+        "end": date.fromisoformat(end) if end else None,
+        "status": params.get("status") or None,
+    }
+
+
+def iter_orders(
+    start: Union[date, None] = None,
+    end: Union[date, None] = None,
+    status: Union[str, None] = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[dict]:
+    """Yields matching orders as dicts with their `items`, in id order
+
+    Orders are read in keyset chunks of `chunk_size` with one extra query for
+    their items, so memory stays flat however many orders match. Neither
+    MySQL nor SQLite give Django server-side cursors, `.iterator()` alone
+    would have the driver buffer the whole result set. Plain dicts are used
+    instead of model instances, prefetched instances reference each other
+    and would only be freed by the cyclic garbage collector.
+    """
+    orders = Order.objects.order_by("id")
+    if start:
+        orders = orders.filter(
+            created_at__gte=datetime.combine(start, datetime.min.time())
+        )
+    if end:
+        orders = orders.filter(
+            created_at__lt=datetime.combine(
+                end + timedelta(days=1), datetime.min.time()
+            )
+        )
+    if status:
+        orders = orders.filter(status=status)
+    last_id = 0
+    while True:
+        chunk = list(orders.filter(id__gt=last_id).values(*ORDER_FIELDS)[:chunk_size])
+        if not chunk:
+            return
+        items: Dict[int, list] = {}
+        for item in (
+            OrderItem.objects.filter(order_id__in=[order["id"] for order in chunk])
+            .order_by("order_id", "id")
+            .values(*ITEM_FIELDS)
+        ):
+            items.setdefault(item.pop("order_id"), []).append(item)
+        for order in chunk:
+            order["items"] = items.get(order["id"], [])
+            yield order
+        last_id = chunk[-1]["id"]
+
+
+class _Echo:
+    """file like object handing every written csv row straight back"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def csv_lines(orders: Iterator[dict]) -> Iterator[str]:
+    """One csv row per order line, orders without lines get one empty row"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order in orders:
+        head = [
+            order["order_id"],
+            order["created_at"].isoformat(),
+            order["user_id"],
+            order["status"],
+            order["payment_status"],
+            order["payment_type"],
+            order["total_amount"],
+            order["delivery_address"],
+        ]
+        if not order["items"]:
+            yield writer.writerow(head + [""] * 5)
+        for item in order["items"]:
+            yield writer.writerow(
+                head
+                + [
+                    item["food_item_type"],
+                    item["food_item_id"],
+                    item["name"],
+                    item["quantity"],
+                    item["unit_price"],
+                ]
+            )
+
+
+def ndjson_lines(orders: Iterator[dict]) -> Iterator[str]:
+    """One json document per order with its lines nested"""
+    for order in orders:
+        document = {
+            "order_id": order["order_id"],
+            "created_at": order["created_at"],
+            "user_id": order["user_id"],
+            "status": order["status"],
+            "payment_status": order["payment_status"],
+            "payment_type": order["payment_type"],
+            "total_amount": order["total_amount"],
+            "delivery_address": order["delivery_address"],
+            "items": [
+                {
+                    "item_kind": item["food_item_type"],
+                    "item_id": item["food_item_id"],
+                    "name": item["name"],
+                    "quantity": item["quantity"],
+                    "unit_price": item["unit_price"],
+                }
+                for item in order["items"]
+            ],
+        }
+        yield json.dumps(document, default=_json_default) + "\n"
+
+
+def export_lines(
+    export_format: str, chunk_size: int = EXPORT_CHUNK_SIZE, **filters
+) -> Iterator[str]:
+    """Streams the matching orders in `export_format` (csv or ndjson)"""
+    orders = iter_orders(chunk_size=chunk_size, **filters)
+    if export_format == "csv":
+        return csv_lines(orders)
+    if export_format == "ndjson":
+        return ndjson_lines(orders)
+    raise ValueError(f"Unsupported export format {export_format}")
@@ -0,0 +1,397 @@
+import heapq
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple, Union
+from django.conf import settings
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.utils import timezone
+from foods.models import Food, FoodPackage
+from orders.lifecycle import bulk_transition
+from orders.models import Order, OrderItem, OrderStatusHistory
+
+# statuses the kitchen works on
+KITCHEN_STATUSES = ("Pending", "Preparing")
+
+# prepaid orders are cooked first when two orders must start at the same time
+PAYMENT_PRIORITY = {"Instant": 0, "OnDelivery": 1}
+
+# number of changes kept for the incremental feed
+FEED_SIZE = 1000
+
+# orders changed this long before the last sync are read again, for
+# transactions that committed after a sync passed their updated_at
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def version_of(moment: datetime) -> int:
+    """feed version of a change, the order's updated_at in microseconds"""
+    return int(moment.timestamp() * 1_000_000)
+
+
+@dataclass
+class KitchenTicket:
+    """An open order as seen by the kitchen"""
+
+    order_id: str
+    status: str
+    promised_at: datetime
+    payment_type: str
+    prep_minutes: int
+    claimed_by: Union[int, None] = None
+
+    @property
+    def start_by(self) -> datetime:
+        """latest time cooking can start and still meet the promise"""
+        return self.promised_at - timedelta(minutes=self.prep_minutes)
+
+    def priority(self) -> Tuple:
+        return (
+            self.start_by,
+            PAYMENT_PRIORITY.get(self.payment_type, len(PAYMENT_PRIORITY)),
+            self.order_id,
+        )
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["start_by"] = self.start_by
+        return data
+
+
+class KitchenQueue:
+    """Priority queue of the open orders, keyed by when they must start
+
+    Pending tickets live in a binary heap so claiming the most urgent one is
+    O(log n). Removals are lazy: the ticket is dropped from the index and its
+    stale heap entry is skipped when it reaches the top, which keeps complete
+    and cancel O(1) while the heap is rebuilt once stale entries dominate.
+    Every change is recorded with a version so screens can poll for deltas.
+    Versions count up from 0 unless the caller passes them, the queue of
+    get_kitchen_queue passes versions taken from the database.
+    """
+
+    def __init__(self, feed_size: int = FEED_SIZE) -> None:
+        self._tickets: Dict[str, KitchenTicket] = {}
+        self._heap: List[Tuple] = []
+        self._stale = 0
+        self._version = 0
+        # highest version pushed out of the feed
+        self._evicted = -1
+        self._changes: deque = deque(maxlen=feed_size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, order_id: str) -> Union[KitchenTicket, None]:
+        return self._tickets.get(order_id)
+
+    def _record(
+        self, event: str, ticket: KitchenTicket, version: Union[int, None] = None
+    ) -> None:
+        if version is None:
+            version = self._version + 1
+        self._version = max(self._version, version)
+        if len(self._changes) == self._changes.maxlen:
+            self._evicted = max(self._evicted, self._changes[0][0])
+        self._changes.append((version, event, ticket.to_dict()))
+
+    def _push(self, ticket: KitchenTicket) -> None:
+        heapq.heappush(self._heap, (ticket.priority(), ticket.order_id))
+
+    def _discard(self, ticket: KitchenTicket) -> None:
+        del self._tickets[ticket.order_id]
+        if ticket.status == "Pending":
+            self._stale += 1
+            if self._stale > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if self._is_live(entry)]
+                heapq.heapify(self._heap)
+                self._stale = 0
+
+    def _is_live(self, entry: Tuple) -> bool:
+        ticket = self._tickets.get(entry[1])
+        return (
+            ticket is not None
+            and ticket.status == "Pending"
+            and ticket.priority() == entry[0]
+        )
+
+    def add(self, ticket: KitchenTicket, version: Union[int, None] = None) -> None:
+        """Adds or replaces a ticket"""
+        with self._lock:
+            previous = self._tickets.get(ticket.order_id)
+            if previous is not None:
+                self._discard(previous)
+            self._tickets[ticket.order_id] = ticket
+            if ticket.status == "Pending":
+                self._push(ticket)
+            self._record("added", ticket, version)
+
+    def claim(self, claimed_by: Union[int, None] = None) -> Union[KitchenTicket, None]:
+        """Moves the most urgent pending ticket to Preparing and returns it"""
+        with self._lock:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                if not self._is_live(entry):
+                    self._stale = max(self._stale - 1, 0)
+                    continue
+                ticket = self._tickets[entry[1]]
+                ticket.status = "Preparing"
+                ticket.claimed_by = claimed_by
+                self._record("claimed", ticket)
+                return ticket
+            return None
+
+    def peek(self) -> Union[KitchenTicket, None]:
+        """The most urgent pending ticket, left in the queue"""
+        with self._lock:
+            while self._heap:
+                if self._is_live(self._heap[0]):
+                    return self._tickets[self._heap[0][1]]
+                heapq.heappop(self._heap)
+                self._stale = max(self._stale - 1, 0)
+            return None
+
+    def mark_preparing(
+        self,
+        order_id: str,
+        claimed_by: Union[int, None] = None,
+        version: Union[int, None] = None,
+    ) -> None:
+        """Records a ticket moved to Preparing outside of claim"""
+        with self._lock:
+            ticket = self._tickets.get(order_id)
+            if ticket is None or ticket.status != "Pending":
+                return
+            # the heap entry goes stale and is skipped on the next claim
+            ticket.status = "Preparing"
+            ticket.claimed_by = claimed_by
+            self._stale += 1
+            self._record("claimed", ticket, version)
+
+    def remove(
+        self,
+        order_id: str,
+        event: str = "completed",
+        version: Union[int, None] = None,
+    ) -> Union[KitchenTicket, None]:
+        """Drops a ticket that left the kitchen"""
+        with self._lock:
+            ticket = self._tickets.get(order_id)
+            if ticket is None:
+                return None
+            self._discard(ticket)
+            self._record(event, ticket, version)
+            return ticket
+
+    def snapshot(self) -> List[KitchenTicket]:
+        """All tickets, preparing first then pending, most urgent first"""
+        with self._lock:
+            tickets = list(self._tickets.values())
+        return sorted(
+            tickets,
+            key=lambda ticket: (ticket.status != "Preparing", ticket.priority()),
+        )
+
+    def changes_since(self, version: int) -> Tuple[Union[List[dict], None], int]:
+        """Changes recorded after `version`
+
+        Returns None instead of the list when the feed no longer reaches back
+        to `version`, the client must reload the snapshot.
+        """
+        with self._lock:
+            if version < self._evicted:
+                return None, self._version
+            changes = [
+                {"version": number, "event": event, "ticket": ticket}
+                for number, event, ticket in self._changes
+                if number > version
+            ]
+            # synced changes can arrive after newer ones
+            changes.sort(key=lambda change: change["version"])
+            return changes, self._version
+
+
+def _prep_minutes(orders: List[Order]) -> Dict[Tuple[str, int], int]:
+    """preparation estimate of every item in the orders, two queries in total"""
+    ids = {"Meal": set(), "Package": set()}
+    for order in orders:
+        for item in order.items.all():
+            ids.setdefault(item.food_item_type, set()).add(item.food_item_id)
+    estimates = {}
+    for kind, model in (("Meal", Food), ("Package", FoodPackage)):
+        if ids[kind]:
+            rows = model.objects.filter(id__in=ids[kind]).values_list(
+                "id", "prep_minutes"
+            )
+            estimates.update({(kind, pk): minutes for pk, minutes in rows})
+    return estimates
+
+
+def build_tickets(orders: List[Order]) -> List[KitchenTicket]:
+    """Turns orders with their items prefetched into kitchen tickets"""
+    estimates = _prep_minutes(orders)
+    default_prep = Food._meta.get_field("prep_minutes").default
+    tickets = []
+    for order in orders:
+        # lines cook in parallel, the slowest one decides
+        prep = max(
+            (
+                estimates.get((item.food_item_type, item.food_item_id), default_prep)
+                for item in order.items.all()
+            ),
+            default=default_prep,
+        )
+        promised_at = order.promised_at or order.created_at + timedelta(
+            minutes=prep + settings.KITCHEN_DELIVERY_MINUTES
+        )
+        tickets.append(
+            KitchenTicket(
+                order_id=order.order_id,
+                status=order.status,
+                promised_at=promised_at,
+                payment_type=order.payment_type,
+                prep_minutes=prep,
+            )
+        )
+    return tickets
+
+
+def _open_orders(queryset) -> List[Order]:
+    return list(
+        queryset.filter(status__in=KITCHEN_STATUSES).prefetch_related(
+            Prefetch(
+                "items",
+                queryset=OrderItem.objects.only(
+                    "id", "order", "food_item_id", "food_item_type"
+                ),
+            )
+        )
+    )
+
+
+def _claimed_by():
+    """user who moved an order to Preparing, from its status history"""
+    return Subquery(
+        OrderStatusHistory.objects.filter(
+            order=OuterRef("pk"), to_status="Preparing"
+        ).values("changed_by")[:1]
+    )
+
+
+def _add_orders(queue: KitchenQueue, queryset) -> None:
+    """adds open orders as tickets, versioned by their updated_at"""
+    orders = _open_orders(queryset.annotate(claimed_by_id=_claimed_by()))
+    for order, ticket in zip(orders, build_tickets(orders)):
+        ticket.claimed_by = order.claimed_by_id
+        queue.add(ticket, version=version_of(order.updated_at))
+
+
+def load_queue() -> KitchenQueue:
+    """Builds a queue from every open order in the database"""
+    queue = KitchenQueue()
+    queue.synced_at = timezone.now()
+    _add_orders(queue, Order.objects.all())
+    return queue
+
+
+def sync_queue(queue: KitchenQueue) -> None:
+    """Applies the order changes made since the last sync to a loaded queue
+
+    Placing an order and every status transition stamp updated_at, so the
+    orders changed since the last sync, minus SYNC_OVERLAP, hold every
+    change made through any worker. Changes already applied are skipped.
+    Feed versions come from updated_at, every worker numbers the same
+    change alike.
+    """
+    started = timezone.now()
+    rows = (
+        Order.objects.filter(updated_at__gte=queue.synced_at - SYNC_OVERLAP)
+        .annotate(claimed_by_id=_claimed_by())
+        .values_list("order_id", "status", "updated_at", "claimed_by_id")
+    )
+    added = []
+    for order_id, status, updated_at, claimed_by in rows:
+        ticket = queue.get(order_id)
+        version = version_of(updated_at)
+        if ticket is None:
+            if status in KITCHEN_STATUSES:
+                added.append(order_id)
+        elif status == "Preparing":
+            queue.mark_preparing(order_id, claimed_by, version)
+        elif status not in KITCHEN_STATUSES:
+            event = "cancelled" if status == "Cancelled" else "completed"
+            queue.remove(order_id, event=event, version=version)
+    if added:
+        _add_orders(queue, Order.objects.filter(order_id__in=added))
+    queue.synced_at = started
+
+
+_queue: Union[KitchenQueue, None] = None
+_queue_lock = threading.Lock()
+
+
+def get_kitchen_queue() -> KitchenQueue:
+    """Returns the process wide queue, synced with the database
+
+    Each worker process keeps its own copy in memory, loaded on first use
+    and brought up to date from the orders table on every call, so orders
+    placed or moved through another worker show up too. Claims and
+    completions still go through the conditional UPDATE of the order
+    lifecycle, so two workers can never hand the same order to two cooks.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = load_queue()
+        else:
+            sync_queue(_queue)
+        return _queue
+
+
+def reset_kitchen_queue() -> None:
+    """Forgets the in-memory queue, it is reloaded on next use"""
+    global _queue
+    with _queue_lock:
+        _queue = None
+
+
+def changes_since(version: int) -> Tuple[Union[List[dict], None], int]:
+    """Feed of the process wide queue
+
+    Changes committed late can carry versions lower than ones a client
+    already got, the feed reaches SYNC_OVERLAP further back for them. The
+    screen applies the repeated changes idempotently.
+    """
+    overlap = SYNC_OVERLAP // timedelta(microseconds=1)
+    return get_kitchen_queue().changes_since(version - overlap)
+
+
+def claim_next(user) -> Union[KitchenTicket, None]:
+    """Claims the most urgent pending order for a cook"""
+    queue = get_kitchen_queue()
+    while True:
+        ticket = queue.peek()
+        if ticket is None:
+            return None
+        moved, _ = bulk_transition([ticket.order_id], "Preparing", user)
+        # records the claim, or the change of the worker that moved it first
+        queue = get_kitchen_queue()
+        if moved:
+            return ticket
+        if queue.get(ticket.order_id) is ticket and ticket.status == "Pending":
+            # its change is older than the sync overlap
+            queue.remove(ticket.order_id, event="removed")
+
+
+def complete(order_id: str, user) -> bool:
+    """Hands a prepared order over to delivery"""
+    moved, _ = bulk_transition([order_id], "On Delivery", user)
+    if moved:
+        get_kitchen_queue()
+    return bool(moved)
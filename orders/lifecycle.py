@@ -0,0 +1,146 @@
+from typing import Dict, List, Tuple, Union
+from django.db import transaction
+from django.utils import timezone
+from orders.models import Order, OrderStatusHistory
+from orders.signals import order_status_changed
+
+
+# allowed next statuses for every order status
+TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    "Pending": ("Preparing", "Cancelled"),
+    "Preparing": ("On Delivery", "Cancelled"),
+    "On Delivery": ("Delivered", "Cancelled"),
+    "Delivered": (),
+    "Cancelled": (),
+}
+
+# maximum number of orders moved by a single bulk transition
+MAX_BULK_ORDERS = 500
+
+
+class InvalidTransition(Exception):
+    """Raised when an order cannot move to the requested status"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+def allowed_sources(to_status: str) -> List[str]:
+    """Returns the statuses an order may move to `to_status` from
+
+    Args:
+        to_status (str): target status
+
+    Raises:
+        InvalidTransition: the target status is unknown
+
+    Returns:
+        List[str]: source statuses
+    """
+    if to_status not in TRANSITIONS:
+        raise InvalidTransition(f"Invalid order status {to_status}")
+    return [status for status, targets in TRANSITIONS.items() if to_status in targets]
+
+
+def can_transition(from_status: str, to_status: str) -> bool:
+    """checks if an order in `from_status` may move to `to_status`"""
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def bulk_transition(
+    order_ids: List[str],
+    to_status: str,
+    changed_by=None,
+    sources: Union[List[str], None] = None,
+) -> Tuple[List[str], List[str]]:
+    """Moves many orders to a new status in one conditional UPDATE
+
+    Orders that are not in a valid source status are left untouched and
+    reported back as skipped, so a kitchen screen can move a whole batch
+    without failing on one order another device already moved.
+
+    Args:
+        order_ids (List[str]): order references
+        to_status (str): target status
+        changed_by (User, optional): user performing the transition. Defaults to None.
+        sources (Union[List[str], None], optional): narrows the statuses
+            orders may move from. Defaults to every valid source.
+
+    Raises:
+        InvalidTransition: the target status is unknown or too many orders
+
+    Returns:
+        Tuple[List[str], List[str]]: moved and skipped order references
+    """
+    valid = allowed_sources(to_status)
+    sources = [status for status in sources or valid if status in valid]
+    order_ids = list(dict.fromkeys(order_ids))
+    if len(order_ids) > MAX_BULK_ORDERS:
+        raise InvalidTransition(
+            f"A maximum of {MAX_BULK_ORDERS} orders can be moved at once"
+        )
+    with transaction.atomic():
+        rows = list(
+            Order.objects.select_for_update()
+            .filter(order_id__in=order_ids, status__in=sources)
+            .values_list("id", "order_id", "status", "user_id")
+        )
+        now = timezone.now()
+        Order.objects.filter(
+            id__in=[row[0] for row in rows], status__in=sources
+        ).update(status=to_status, updated_at=now)
+        OrderStatusHistory.objects.bulk_create(
+            [
+                OrderStatusHistory(
+                    order_id=pk,
+                    from_status=from_status,
+                    to_status=to_status,
+                    changed_by=changed_by,
+                    created_at=now,
+                )
+                for pk, _, from_status, _ in rows
+            ]
+        )
+        changes = [
+            {
+                "order_id": order_id,
+                "user_id": user_id,
+                "from_status": from_status,
+                "to_status": to_status,
+            }
+            for _, order_id, from_status, user_id in rows
+        ]
+        if changes:
+            transaction.on_commit(
+                lambda: order_status_changed.send(
+                    sender=Order, changes=changes, changed_at=now
+                )
+            )
+    moved_set = {row[1] for row in rows}
+    moved = [ref for ref in order_ids if ref in moved_set]
+    skipped = [ref for ref in order_ids if ref not in moved_set]
+    return moved, skipped
+
+
+def transition(order: Order, to_status: str, changed_by=None) -> Order:
+    """Moves a single order to a new status
+
+    Args:
+        order (Order): order to move
+        to_status (str): target status
+        changed_by (User, optional): user performing the transition. Defaults to None.
+
+    Raises:
+        InvalidTransition: the order cannot move to the target status
+
+    Returns:
+        Order: the order with its status refreshed
+    """
+    moved, _ = bulk_transition([order.order_id], to_status, changed_by)
+    order.refresh_from_db(fields=["status", "updated_at"])
+    if not moved:
+        raise InvalidTransition(
+            f"Order {order.order_id} cannot move from {order.status} to {to_status}"
+        )
+    return order
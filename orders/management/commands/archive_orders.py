@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from orders.archive import ARCHIVE_BATCH_SIZE, run_archive
+
+
+class Command(BaseCommand):
+    help = "Move old delivered and cancelled orders to the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            help="archive orders older than this, defaults to ORDER_ARCHIVE_MONTHS",
+        )
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            help="stop after this many batches, the next run resumes",
+        )
+
+    def handle(self, *args, **options):
+        run = run_archive(
+            options["months"], options["batch_size"], options["max_batches"]
+        )
+        self.stdout.write(
+            f"Archive run {run.id}: {run.orders_moved} orders and "
+            f"{run.items_moved} lines moved from before {run.cutoff:%Y-%m-%d}"
+        )
+        if run.finished_at is None:
+            self.stdout.write("Stopped early, run the command again to resume")
+        elif run.verified:
+            self.stdout.write(self.style.SUCCESS("Totals verified"))
+        else:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"Totals differ: {run.orders_before} orders / "
+                    f"{run.amount_before} before, {run.orders_after} orders / "
+                    f"{run.amount_after} after"
+                )
+            )
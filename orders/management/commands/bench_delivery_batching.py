@@ -0,0 +1,86 @@
+import random
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.dispatch import BatchingEngine, ReadyOrder
+
+
+class Command(BaseCommand):
+    help = "Simulate a day of ready orders and report orders per rider hour"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=2000)
+        parser.add_argument("--hours", type=int, default=12)
+        parser.add_argument("--zones", type=int, default=8)
+        parser.add_argument("--max-batch-size", type=int, default=5)
+        parser.add_argument("--max-wait", type=int, default=10, help="minutes")
+        parser.add_argument("--window", type=int, default=30, help="minutes")
+        parser.add_argument(
+            "--trip-minutes",
+            type=int,
+            default=30,
+            help="ride out to a zone and back",
+        )
+        parser.add_argument(
+            "--stop-minutes", type=int, default=6, help="time spent per drop off"
+        )
+        parser.add_argument("--seed", type=int, default=42)
+
+    def _simulate(self, orders, options, max_batch_size):
+        engine = BatchingEngine(
+            max_batch_size=max_batch_size,
+            max_wait=timedelta(minutes=options["max_wait"]),
+            window=timedelta(minutes=options["window"]),
+        )
+        runs, waits = [], []
+        position = 0
+        start = orders[0].ready_at
+        minutes = options["hours"] * 60 + options["max_wait"]
+        for minute in range(minutes + 1):
+            now = start + timedelta(minutes=minute)
+            while position < len(orders) and orders[position].ready_at <= now:
+                runs += [(batch, now) for batch in engine.add(orders[position])]
+                position += 1
+            runs += [(batch, now) for batch in engine.tick(now)]
+        runs += [(batch, now) for batch in engine.flush()]
+        rider_minutes = 0
+        for batch, left_at in runs:
+            rider_minutes += options["trip_minutes"] + options["stop_minutes"] * len(
+                batch.orders
+            )
+            waits += [
+                (left_at - order.ready_at).total_seconds() / 60
+                for order in batch.orders
+            ]
+        return runs, waits, rider_minutes
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        start = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        zones = [f"lagos:zone{index}" for index in range(options["zones"])]
+        orders = []
+        for index in range(options["orders"]):
+            ready_at = start + timedelta(minutes=rng.uniform(0, options["hours"] * 60))
+            orders.append(
+                ReadyOrder(
+                    order_id=str(index),
+                    zone=rng.choice(zones),
+                    ready_at=ready_at,
+                    promised_at=ready_at + timedelta(minutes=rng.randint(10, 40)),
+                )
+            )
+        orders.sort(key=lambda order: order.ready_at)
+
+        for label, size in (
+            ("single", 1),
+            ("batched", options["max_batch_size"]),
+        ):
+            runs, waits, rider_minutes = self._simulate(orders, options, size)
+            per_hour = len(orders) / (rider_minutes / 60)
+            self.stdout.write(
+                f"{label:<8} {len(runs):>6} runs  "
+                f"{len(orders) / len(runs):5.2f} orders/run  "
+                f"{sum(waits) / len(waits):5.1f} min avg wait  "
+                f"{max(waits):5.1f} min max wait  "
+                f"{per_hour:6.2f} orders per rider hour"
+            )
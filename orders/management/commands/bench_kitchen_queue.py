@@ -0,0 +1,70 @@
+import random
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.kitchen import KitchenQueue, KitchenTicket
+from utils.utils import generate_order_ref
+
+
+class Command(BaseCommand):
+    help = "Benchmark the in-memory kitchen queue with simulated open orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def _report(self, label: str, count: int, elapsed: float) -> None:
+        per_op = elapsed / count * 1_000_000 if count else 0
+        self.stdout.write(f"{label:<10} {count:>8} ops  {per_op:8.2f} us/op")
+
+    def handle(self, *args, **options):
+        count = options["orders"]
+        rng = random.Random(options["seed"])
+        now = timezone.now()
+        tickets = [
+            KitchenTicket(
+                order_id=generate_order_ref(),
+                status="Pending",
+                promised_at=now + timedelta(minutes=rng.randint(20, 120)),
+                payment_type=rng.choice(["Instant", "OnDelivery"]),
+                prep_minutes=rng.choice([10, 15, 20, 30, 45]),
+            )
+            for _ in range(count)
+        ]
+        queue = KitchenQueue()
+
+        started = time.perf_counter()
+        for ticket in tickets:
+            queue.add(ticket)
+        self._report("add", count, time.perf_counter() - started)
+
+        # a tenth of the orders get cancelled while waiting
+        cancelled = rng.sample(tickets, count // 10)
+        started = time.perf_counter()
+        for ticket in cancelled:
+            queue.remove(ticket.order_id, event="cancelled")
+        self._report("cancel", len(cancelled), time.perf_counter() - started)
+
+        claimed = []
+        started = time.perf_counter()
+        while True:
+            ticket = queue.claim()
+            if ticket is None:
+                break
+            claimed.append(ticket)
+        self._report("claim", len(claimed), time.perf_counter() - started)
+
+        start_times = [ticket.start_by for ticket in claimed]
+        if start_times != sorted(start_times):
+            self.stderr.write("claims were not in priority order")
+
+        started = time.perf_counter()
+        for ticket in claimed:
+            queue.remove(ticket.order_id)
+        self._report("complete", len(claimed), time.perf_counter() - started)
+
+        started = time.perf_counter()
+        changes, version = queue.changes_since(version=queue.version - 100)
+        self._report("feed", len(changes), time.perf_counter() - started)
+        self.stdout.write(f"open orders left: {len(queue)}, version: {version}")
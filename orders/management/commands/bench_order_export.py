@@ -0,0 +1,107 @@
+import random
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.exports import EXPORT_CHUNK_SIZE, export_lines
+from orders.models import Order, OrderItem
+from utils.benchmarks import Timer, benchmark_database, current_rss_mb
+from utils.utils import generate_order_ref
+
+User = get_user_model()
+
+
+class _Null:
+    """counts what is written and throws it away"""
+
+    def __init__(self) -> None:
+        self.bytes = 0
+
+    def write(self, value: str) -> None:
+        self.bytes += len(value)
+
+
+class Command(BaseCommand):
+    help = "Export synthetic orders from a throw away database and report memory use"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1_000_000)
+        parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--trace",
+            action="store_true",
+            help="also report the python heap peak, slows the export down",
+        )
+
+    def _seed(self, count: int, batch_size: int) -> None:
+        rng = random.Random(7)
+        user = User.objects.create_user(
+            email="bench@example.com", username="bench", password="bench"
+        )
+        started = timezone.now() - timedelta(days=365)
+        for first in range(1, count + 1, batch_size):
+            ids = range(first, min(first + batch_size, count + 1))
+            Order.objects.bulk_create(
+                [
+                    Order(
+                        id=pk,
+                        user=user,
+                        order_id=generate_order_ref(),
+                        total_amount=Decimal(rng.randint(1000, 20000)),
+                        status=rng.choice(["Delivered", "Cancelled", "Pending"]),
+                        delivery_address="Island - 1 Marina Road",
+                        created_at=started + timedelta(seconds=pk * 30),
+                    )
+                    for pk in ids
+                ]
+            )
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(
+                        order_id=pk,
+                        food_item_id=rng.randint(1, 50),
+                        food_item_type="Meal",
+                        name="Jollof Rice",
+                        quantity=rng.randint(1, 4),
+                        unit_price=Decimal("2500.00"),
+                    )
+                    for pk in ids
+                ]
+            )
+
+    def handle(self, *args, **options):
+        count = options["orders"]
+        with benchmark_database():
+            with Timer() as seeding:
+                self._seed(count, options["batch_size"])
+            self.stdout.write(f"seeded {count} orders in {seeding.elapsed:.1f}s")
+
+            sink = _Null()
+            rss_before = current_rss_mb()
+            if options["trace"]:
+                tracemalloc.start()
+            with Timer() as exporting:
+                for line in export_lines(
+                    options["format"], chunk_size=options["chunk_size"]
+                ):
+                    sink.write(line)
+            if options["trace"]:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            rss_after = current_rss_mb()
+
+        self.stdout.write(
+            f"exported {sink.bytes / 1024 / 1024:.1f} MB of {options['format']} "
+            f"in {exporting.elapsed:.1f}s ({count / exporting.elapsed:.0f} orders/s)"
+        )
+        if options["trace"]:
+            self.stdout.write(
+                f"python heap peak during export: {peak / 1024 / 1024:.1f} MB"
+            )
+        self.stdout.write(
+            f"rss before/after export: {rss_before:.1f} / {rss_after:.1f} MB"
+        )
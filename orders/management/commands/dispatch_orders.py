@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from orders.dispatch import dispatch, dispatch_due, get_dispatcher
+
+
+class Command(BaseCommand):
+    help = "Hand the delivery batches that waited long enough to riders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="dispatch every open batch without waiting",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            runs = dispatch(get_dispatcher().flush())
+        else:
+            runs = dispatch_due()
+        for run in runs:
+            self.stdout.write(f"Run {run.id}: {run.order_count} orders to {run.zone}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Dispatched {len(runs)} runs, {len(get_dispatcher())} orders waiting"
+            )
+        )
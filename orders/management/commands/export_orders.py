@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from orders.exports import (
+    EXPORT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    export_lines,
+    parse_filters,
+)
+
+
+class Command(BaseCommand):
+    help = "Stream orders with their lines as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--start", help="first day (YYYY-MM-DD)")
+        parser.add_argument("--end", help="last day (YYYY-MM-DD)")
+        parser.add_argument("--status", help="only orders in this status")
+        parser.add_argument("--output", help="file to write, defaults to stdout")
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_filters(options)
+        except ValueError:
+            raise CommandError(
+                "--start and --end must be dates in the YYYY-MM-DD format"
+            )
+        lines = export_lines(
+            options["format"], chunk_size=options["chunk_size"], **filters
+        )
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,25 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from orders.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from the watermark up to today"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            help="first day to recompute (YYYY-MM-DD), defaults to the watermark",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = date.fromisoformat(options["since"])
+            except ValueError:
+                raise CommandError("--since must be a date in the YYYY-MM-DD format")
+        first_day, rows = rebuild(since)
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {rows} item rollups from {first_day}")
+        )
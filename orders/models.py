@@ -3,7 +3,7 @@ from django.contrib.auth import get_user_model
 from constants.constant import order_status, payment_status, payment_type, food_types
 from django.utils import timezone
 from utils.decorators import str_meta
-from utils.utils import generate_ref
+from utils.utils import generate_order_ref
 
 from foods.models import Food, FoodItem, FoodPackage
 
@@ -13,13 +13,30 @@ User = get_user_model()
 # Create your models here.
 
 
+class RiderRun(models.Model):
+    """Orders of one zone and delivery window handed to a single rider"""
+
+    zone = models.CharField(max_length=61)
+    window_start = models.DateTimeField()
+    order_count = models.PositiveSmallIntegerField(default=0)
+    dispatched_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Run {self.id} - {self.zone}"
+
+    class Meta:
+        verbose_name = "Rider Run"
+        verbose_name_plural = "Rider Runs"
+        db_table = "rider_runs"
+
+
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="orders")
     total_amount = models.DecimalField(
         max_digits=10, decimal_places=2, null=True, blank=True
     )
     status = models.CharField(max_length=100, choices=order_status, default="Pending")
-    order_id = models.CharField(max_length=100)
+    order_id = models.CharField(max_length=100, unique=True)
     payment_status = models.CharField(
         max_length=30, choices=payment_status, default="UnPaid"
     )
@@ -27,6 +44,17 @@ class Order(models.Model):
         max_length=30, choices=payment_type, default="OnDelivery"
     )
     delivery_address = models.TextField()
+    # "state:city" of the delivery address, orders of a zone share riders
+    delivery_zone = models.CharField(max_length=61, blank=True, default="")
+    rider_run = models.ForeignKey(
+        RiderRun,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="orders",
+    )
+    # time the order was promised to the customer, drives kitchen priority
+    promised_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(default=timezone.now)
 
@@ -37,10 +65,15 @@ class Order(models.Model):
         verbose_name = "Order"
         verbose_name_plural = "Orders"
         db_table = "orders"
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="orders_user_created_idx"),
+            # the kitchen queue of every worker syncs on recently changed orders
+            models.Index(fields=["updated_at"], name="orders_updated_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.order_id:
-            self.order_id = generate_ref()
+            self.order_id = generate_order_ref()
         super().save(*args, **kwargs)
 
     def calculate_total_amount(self):
@@ -54,8 +87,15 @@ class OrderItem(models.Model):
     food_item_id = models.IntegerField()
     food_item_type = models.CharField(max_length=50, choices=food_types, default="Meal")
     quantity = models.IntegerField(default=1)
+    # snapshot of the catalog item at checkout, so history never re-reads prices
+    name = models.CharField(max_length=100, blank=True, default="")
+    unit_price = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True
+    )
 
     def subtotal(self) -> float:
+        if self.unit_price is not None:
+            return float(self.quantity) * float(self.unit_price)
         if self.food_item_type == "Meal":
             return float(self.quantity) * float(
                 Food.objects.get(id=self.food_item_id).price
@@ -65,3 +105,175 @@ class OrderItem(models.Model):
                 FoodPackage.objects.get(id=self.food_item_id).price
             )
         return 0
+
+
+class OrderStatusHistory(models.Model):
+    """Append only log of order status transitions"""
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="status_history"
+    )
+    from_status = models.CharField(max_length=20, choices=order_status)
+    to_status = models.CharField(max_length=20, choices=order_status)
+    changed_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.from_status} -> {self.to_status}"
+
+    class Meta:
+        verbose_name = "Order Status History"
+        verbose_name_plural = "Order Status History"
+        db_table = "order_status_history"
+        ordering = ["created_at"]
+
+
+class DailySales(models.Model):
+    """Quantity and revenue of an item per day, kept up to date at checkout"""
+
+    day = models.DateField()
+    item_kind = models.CharField(max_length=50, choices=food_types)
+    item_id = models.IntegerField()
+    name = models.CharField(max_length=100, blank=True, default="")
+    quantity = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day} - {self.name or self.item_id}"
+
+    class Meta:
+        verbose_name = "Daily Sales"
+        verbose_name_plural = "Daily Sales"
+        db_table = "daily_sales"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "item_kind", "item_id"], name="daily_sales_item_unique"
+            ),
+        ]
+
+
+class DailyOrders(models.Model):
+    """Number of orders and amount charged per day"""
+
+    day = models.DateField(unique=True)
+    orders = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day} - {self.orders} orders"
+
+    class Meta:
+        verbose_name = "Daily Orders"
+        verbose_name_plural = "Daily Orders"
+        db_table = "daily_orders"
+
+
+class RollupWatermark(models.Model):
+    """First day the next rollup rebuild has to recompute"""
+
+    name = models.CharField(max_length=50, unique=True)
+    day = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} - {self.day}"
+
+    class Meta:
+        verbose_name = "Rollup Watermark"
+        verbose_name_plural = "Rollup Watermarks"
+        db_table = "rollup_watermarks"
+
+
+class ArchivedOrder(models.Model):
+    """Delivered or cancelled order moved out of the `orders` table
+
+    Rows keep the primary key of the original order so an interrupted
+    archive run can never copy the same order twice.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="archived_orders"
+    )
+    total_amount = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True
+    )
+    status = models.CharField(max_length=100, choices=order_status)
+    order_id = models.CharField(max_length=100, unique=True)
+    payment_status = models.CharField(max_length=30, choices=payment_status)
+    payment_type = models.CharField(max_length=30, choices=payment_type)
+    delivery_address = models.TextField()
+    delivery_zone = models.CharField(max_length=61, blank=True, default="")
+    rider_run = models.ForeignKey(
+        RiderRun,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="archived_orders",
+    )
+    promised_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    # status transitions of the order, oldest first
+    status_history = models.JSONField(default=list, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Archived Order {self.order_id}"
+
+    class Meta:
+        verbose_name = "Archived Order"
+        verbose_name_plural = "Archived Orders"
+        db_table = "archived_orders"
+
+
+@str_meta
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.CASCADE, related_name="items"
+    )
+    food_item_id = models.IntegerField()
+    food_item_type = models.CharField(max_length=50, choices=food_types)
+    quantity = models.IntegerField(default=1)
+    name = models.CharField(max_length=100, blank=True, default="")
+    unit_price = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = "Archived Order Item"
+        verbose_name_plural = "Archived Order Items"
+        db_table = "archived_order_items"
+
+
+class ArchiveRun(models.Model):
+    """Progress and verification totals of an order archive run"""
+
+    cutoff = models.DateTimeField()
+    # highest order id already looked at, the run resumes after it
+    last_order_id = models.BigIntegerField(default=0)
+    orders_moved = models.PositiveIntegerField(default=0)
+    items_moved = models.PositiveIntegerField(default=0)
+    # orders, lines and amount created before the cutoff, hot and archived
+    orders_before = models.PositiveIntegerField(default=0)
+    items_before = models.PositiveIntegerField(default=0)
+    amount_before = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    orders_after = models.PositiveIntegerField(null=True, blank=True)
+    items_after = models.PositiveIntegerField(null=True, blank=True)
+    amount_after = models.DecimalField(
+        max_digits=16, decimal_places=2, null=True, blank=True
+    )
+    verified = models.BooleanField(null=True, blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Archive run {self.id} - before {self.cutoff}"
+
+    class Meta:
+        verbose_name = "Archive Run"
+        verbose_name_plural = "Archive Runs"
+        db_table = "archive_runs"
@@ -0,0 +1,103 @@
+from typing import Dict, List, Tuple, Union
+from django.db import transaction
+from foods.models import Food, FoodPackage
+from orders.models import ArchivedOrder, Order
+from users.models import Tray, TrayItem
+
+CATALOG_MODELS = {"Meal": Food, "Package": FoodPackage}
+
+
+def load_catalog(keys) -> Dict[Tuple[str, int], Union[Food, FoodPackage]]:
+    """Catalog items for (kind, id) pairs, one query per kind"""
+    ids: Dict[str, set] = {}
+    for kind, item_id in keys:
+        ids.setdefault(kind, set()).add(item_id)
+    catalog = {}
+    for kind, model in CATALOG_MODELS.items():
+        if ids.get(kind):
+            for item_id, item in model.objects.in_bulk(ids[kind]).items():
+                catalog[(kind, item_id)] = item
+    return catalog
+
+
+def reorder(
+    order: Union[Order, ArchivedOrder], user
+) -> Tuple[List[TrayItem], List[dict], List[dict], dict]:
+    """Copies the lines of a past order into the user's tray
+
+    Lines already in the tray get their quantity raised instead of a second
+    line. Availability and prices are checked against the catalog in bulk,
+    lines that cannot be ordered again are skipped and reported.
+
+    Args:
+        order (Union[Order, ArchivedOrder]): the past order, items prefetched
+        user (User): owner of the tray
+
+    Returns:
+        Tuple[List[TrayItem], List[dict], List[dict], dict]: the tray items,
+            skipped lines, lines whose price changed and the catalog items
+            of the tray
+    """
+    wanted: Dict[Tuple[str, int], int] = {}
+    paid: Dict[Tuple[str, int], object] = {}
+    for item in order.items.all():
+        key = (item.food_item_type, item.food_item_id)
+        wanted[key] = wanted.get(key, 0) + item.quantity
+        paid[key] = item.unit_price
+    with transaction.atomic():
+        tray, _ = Tray.objects.get_or_create(user=user)
+        tray_items = list(tray.items.select_for_update().order_by("id"))
+        in_tray = {}
+        for tray_item in tray_items:
+            in_tray.setdefault(
+                (tray_item.food_item_type, tray_item.food_item_id), tray_item
+            )
+        catalog = load_catalog(set(wanted) | set(in_tray))
+
+        skipped, price_changes, to_create, to_update = [], [], [], []
+        for (kind, item_id), quantity in wanted.items():
+            food = catalog.get((kind, item_id))
+            line = {"food_item_type": kind, "food_item_id": item_id}
+            current = in_tray.get((kind, item_id))
+            total = quantity + (current.quantity if current else 0)
+            if food is None:
+                skipped.append({**line, "reason": "No longer on the menu"})
+                continue
+            if total > food.available_quantity:
+                skipped.append(
+                    {
+                        **line,
+                        "name": food.name,
+                        "reason": f"Only {food.available_quantity} left in stock",
+                    }
+                )
+                continue
+            if (
+                paid[(kind, item_id)] is not None
+                and paid[(kind, item_id)] != food.price
+            ):
+                price_changes.append(
+                    {
+                        **line,
+                        "name": food.name,
+                        "previous_price": paid[(kind, item_id)],
+                        "price": food.price,
+                    }
+                )
+            if current is not None:
+                current.quantity = total
+                to_update.append(current)
+            else:
+                to_create.append(
+                    TrayItem(
+                        tray=tray,
+                        food_item_type=kind,
+                        food_item_id=item_id,
+                        quantity=quantity,
+                    )
+                )
+        TrayItem.objects.bulk_update(to_update, ["quantity"])
+        TrayItem.objects.bulk_create(to_create)
+        # read back, MySQL does not return the ids of bulk created rows
+        tray_items = list(tray.items.order_by("id"))
+    return tray_items, skipped, price_changes, catalog
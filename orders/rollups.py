@@ -0,0 +1,240 @@
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Tuple, Union
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    F,
+    Max,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from foods.models import Food, FoodPackage
+from orders.archive import archived_cutoff
+from orders.models import (
+    DailyOrders,
+    DailySales,
+    Order,
+    OrderItem,
+    RollupWatermark,
+)
+
+logger = logging.getLogger(__name__)
+
+
+WATERMARK = "daily_sales"
+
+# orders that never count towards sales
+EXCLUDED_STATUSES = ("Cancelled",)
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _increment(model, lookup: dict, defaults: dict, **deltas) -> None:
+    """add `deltas` to a rollup row, creating it when missing"""
+    changes = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **defaults, **deltas)
+    except IntegrityError:
+        # created by a concurrent checkout in the meantime
+        model.objects.filter(**lookup).update(**changes)
+
+
+def _money(value) -> Decimal:
+    return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+
+
+def apply_order(order: Order, items: Iterable[OrderItem], sign: int = 1) -> None:
+    """Adds an order to the rollups of its day, or removes it with sign=-1
+
+    Args:
+        order (Order): the order
+        items (Iterable[OrderItem]): the order lines with their price snapshot
+        sign (int, optional): 1 to add the order, -1 to remove it. Defaults to 1.
+    """
+    day = order.created_at.date()
+    lines: Dict[Tuple[str, int], list] = defaultdict(lambda: ["", 0, Decimal("0")])
+    for item in items:
+        line = lines[(item.food_item_type, item.food_item_id)]
+        line[0] = item.name
+        line[1] += item.quantity
+        if item.unit_price is not None:
+            line[2] += item.unit_price * item.quantity
+    with transaction.atomic():
+        for (kind, item_id), (name, quantity, revenue) in lines.items():
+            _increment(
+                DailySales,
+                {"day": day, "item_kind": kind, "item_id": item_id},
+                {"name": name},
+                quantity=sign * quantity,
+                revenue=sign * revenue,
+            )
+        _increment(
+            DailyOrders,
+            {"day": day},
+            {},
+            orders=sign,
+            revenue=sign * _money(order.total_amount),
+        )
+
+
+def record_placed_order(sender, order, **kwargs) -> None:
+    """order_placed receiver adding the new order to the rollups"""
+    try:
+        apply_order(order, order.items.all())
+    except Exception as e:
+        # the nightly rebuild recomputes the day, never fail a checkout
+        logger.error(f"Unable to update sales rollups for {order.order_id} due to {e}")
+
+
+def _line_revenue():
+    """line revenue from the snapshot, priced from the catalog for old lines"""
+    catalog_price = Case(
+        When(
+            food_item_type="Meal",
+            then=Subquery(
+                Food.objects.filter(id=OuterRef("food_item_id")).values("price")[:1]
+            ),
+        ),
+        When(
+            food_item_type="Package",
+            then=Subquery(
+                FoodPackage.objects.filter(id=OuterRef("food_item_id")).values("price")[
+                    :1
+                ]
+            ),
+        ),
+        output_field=MONEY,
+    )
+    price = Coalesce(F("unit_price"), catalog_price, Value(Decimal("0")))
+    return Sum(F("quantity") * price, output_field=MONEY)
+
+
+def rebuild(since: Union[date, None] = None) -> Tuple[date, int]:
+    """Recomputes the rollups of every day from `since` up to today
+
+    Without `since` the rebuild starts at the watermark left by the previous
+    run. The watermark is then moved to today, the only day still changing,
+    so a scheduled run only ever rescans the orders of a day or two.
+
+    Args:
+        since (Union[date, None], optional): first day to recompute. Defaults to None.
+
+    Returns:
+        Tuple[date, int]: first recomputed day and number of item rows written
+    """
+    watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK)
+    if since is None:
+        since = watermark.day
+    if since is None:
+        first = Order.objects.order_by("created_at").values_list(
+            "created_at", flat=True
+        )[:1]
+        since = first[0].date() if first else timezone.now().date()
+    cutoff = archived_cutoff()
+    if cutoff is not None and since <= cutoff.date():
+        # archived orders are gone from `orders`, keep the days they were in
+        since = cutoff.date() + timedelta(days=1)
+        logger.warning(f"Rollups before {since} hold archived orders, not rebuilt")
+    start = datetime.combine(since, datetime.min.time())
+    orders = Order.objects.filter(created_at__gte=start).exclude(
+        status__in=EXCLUDED_STATUSES
+    )
+    item_rows = (
+        OrderItem.objects.filter(order__in=orders)
+        .annotate(day=TruncDate("order__created_at"))
+        .values("day", "food_item_type", "food_item_id")
+        .annotate(
+            quantity_sum=Sum("quantity"),
+            revenue=_line_revenue(),
+            item_name=Max("name"),
+        )
+    )
+    order_rows = (
+        orders.annotate(day=TruncDate("created_at"))
+        .values("day")
+        .annotate(order_count=Count("id"), revenue=Sum("total_amount"))
+    )
+    with transaction.atomic():
+        DailySales.objects.filter(day__gte=since).delete()
+        DailyOrders.objects.filter(day__gte=since).delete()
+        sales = DailySales.objects.bulk_create(
+            [
+                DailySales(
+                    day=row["day"],
+                    item_kind=row["food_item_type"],
+                    item_id=row["food_item_id"],
+                    name=row["item_name"] or "",
+                    quantity=row["quantity_sum"] or 0,
+                    revenue=_money(row["revenue"]),
+                )
+                for row in item_rows.iterator()
+            ],
+            batch_size=1000,
+        )
+        DailyOrders.objects.bulk_create(
+            [
+                DailyOrders(
+                    day=row["day"],
+                    orders=row["order_count"],
+                    revenue=_money(row["revenue"]),
+                )
+                for row in order_rows.iterator()
+            ],
+            batch_size=1000,
+        )
+        watermark.day = max(since, timezone.now().date())
+        watermark.updated_at = timezone.now()
+        watermark.save()
+    return since, len(sales)
+
+
+def stats(start: date, end: date, top: int = 10) -> dict:
+    """Sales figures between two days, read from the rollups only"""
+    days = list(
+        DailyOrders.objects.filter(day__gte=start, day__lte=end)
+        .order_by("day")
+        .values("day", "orders", "revenue")
+    )
+    top_items = [
+        {
+            "item_kind": row["item_kind"],
+            "item_id": row["item_id"],
+            "name": row["item_name"],
+            "quantity": row["total_quantity"],
+            "revenue": row["total_revenue"],
+        }
+        for row in DailySales.objects.filter(day__gte=start, day__lte=end)
+        .values("item_kind", "item_id")
+        .annotate(
+            item_name=Max("name"),
+            total_quantity=Sum("quantity"),
+            total_revenue=Sum("revenue"),
+        )
+        .order_by("-total_revenue")[:top]
+    ]
+    return {
+        "start": start,
+        "end": end,
+        "orders": sum(row["orders"] for row in days),
+        "revenue": sum((row["revenue"] for row in days), Decimal("0")),
+        "days": days,
+        "top_items": top_items,
+    }
+
+
+def default_range(days: int = 30) -> Tuple[date, date]:
+    end = timezone.now().date()
+    return end - timedelta(days=days - 1), end
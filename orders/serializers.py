@@ -3,6 +3,7 @@ from rest_framework import serializers
 from foods.models import Food, FoodPackage
 from foods.serializers import FoodPackageSerializer, FoodSerializer
 from users.models import TrayItem
+from orders.models import Order, OrderItem
 
 
 # class UpdateTrayItemQuantitySerializer(serializers.ModelSerializer):
@@ -27,8 +28,17 @@ class TrayItemSerializer(serializers.ModelSerializer):
         food_type = instance.food_item_type
         food_item_id = instance.food_item_id
         request = self.context.get("request")
+        # catalog items loaded in bulk by the caller, saves a query per line
+        catalog = self.context.get("catalog", {})
 
-        if food_type == "Meal":
+        if (food_type, food_item_id) in catalog:
+            serializer = (
+                FoodSerializer if food_type == "Meal" else FoodPackageSerializer
+            )
+            food = serializer(
+                catalog[(food_type, food_item_id)], context={"request": request}
+            ).data
+        elif food_type == "Meal":
             food_item_obj = Food.objects.get(id=food_item_id)
             food = FoodSerializer(food_item_obj, context={"request": request}).data
         elif food_type == "Package":
@@ -53,3 +63,41 @@ class TrayItemSerializer(serializers.ModelSerializer):
         ret.pop("food_item_id", None)
 
         return ret
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    subtotal = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = (
+            "food_item_id",
+            "food_item_type",
+            "name",
+            "quantity",
+            "unit_price",
+            "subtotal",
+        )
+
+    def get_subtotal(self, obj):
+        # rendered from the checkout snapshot only, legacy lines have no price
+        if obj.unit_price is None:
+            return None
+        return obj.unit_price * obj.quantity
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = (
+            "order_id",
+            "status",
+            "total_amount",
+            "payment_status",
+            "payment_type",
+            "delivery_address",
+            "created_at",
+            "items",
+        )
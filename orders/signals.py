@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# sent once the transaction moving orders to a new status has committed, with
+# `changes`, a list of dicts holding order_id, user_id, from_status and
+# to_status, and `changed_at`
+order_status_changed = Signal()
+
+# sent by checkout once an order and all its items are saved, with `order`
+order_placed = Signal()
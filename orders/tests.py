@@ -1,9 +1,45 @@
+import asyncio
+import csv
+import json
+import tracemalloc
 import pytest
+from io import StringIO
+from decimal import Decimal
+from django.core.management import call_command
+from django.db.models import F
+from django.utils import timezone
+from datetime import datetime, timedelta
 from rest_framework.test import APIClient, APIRequestFactory
 from django.contrib.auth import get_user_model
 
 from foods.models import Food
-from .models import Order, OrderItem
+from users.models import DeliveryAddress, Tray, TrayItem
+from .archive import find_order, run_archive
+from .dispatch import BatchingEngine, ReadyOrder, get_dispatcher, reset_dispatcher
+from .events import LocalBroker, event_stream, user_channel
+from .exports import export_lines
+from .kitchen import (
+    KitchenQueue,
+    KitchenTicket,
+    changes_since,
+    get_kitchen_queue,
+    load_queue,
+    reset_kitchen_queue,
+    version_of,
+)
+from .lifecycle import InvalidTransition, bulk_transition, transition
+from .models import (
+    ArchivedOrder,
+    ArchiveRun,
+    DailyOrders,
+    DailySales,
+    Order,
+    OrderItem,
+    OrderStatusHistory,
+    RiderRun,
+    RollupWatermark,
+)
+from .signals import order_placed
 from .serializers import TrayItemSerializer
 from .views import (
     AddItemToTrayAPIView,
@@ -71,3 +107,797 @@ def test_order_creation(create_order):
 def test_order_item_creation(create_order_item, create_order):
     assert create_order_item.order == create_order
     assert create_order_item.quantity == 2
+
+
+@pytest.mark.django_db
+def test_order_gets_generated_reference(create_user):
+    order = Order.objects.create(
+        user=create_user, total_amount=100, delivery_address="Some address"
+    )
+    assert len(order.order_id) == 13
+
+
+@pytest.mark.django_db
+def test_order_detail_lookup_by_reference(api_client, create_user, create_order_item):
+    api_client.force_authenticate(user=create_user)
+    response = api_client.get("/api/v1/orders/566636")
+    assert response.status_code == 200
+    assert response.data["data"]["order_id"] == "566636"
+    assert len(response.data["data"]["items"]) == 1
+
+
+@pytest.mark.django_db
+def test_order_detail_hides_other_users_orders(api_client, create_order):
+    other = User.objects.create_user(
+        username="other", password="12345", email="other@test.com"
+    )
+    api_client.force_authenticate(user=other)
+    response = api_client.get("/api/v1/orders/566636")
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_order_list_is_cursor_paginated(
+    api_client, create_user, django_assert_num_queries
+):
+    for index in range(5):
+        order = Order.objects.create(
+            user=create_user, total_amount=100, delivery_address="Some address"
+        )
+        OrderItem.objects.create(
+            order=order,
+            food_item_id=index,
+            name="Jollof",
+            unit_price=50,
+            quantity=2,
+        )
+    api_client.force_authenticate(user=create_user)
+    # one query for the page of orders, one for the prefetched items
+    with django_assert_num_queries(2):
+        response = api_client.get("/api/v1/orders?limit=3")
+    assert response.status_code == 200
+    first_page = response.data["data"]
+    assert len(first_page["orders"]) == 3
+    assert first_page["orders"][0]["items"][0]["subtotal"] == 100
+
+    response = api_client.get(
+        f"/api/v1/orders?limit=3&cursor={first_page['next_cursor']}"
+    )
+    second_page = response.data["data"]
+    assert len(second_page["orders"]) == 2
+    assert second_page["next_cursor"] is None
+    refs = [order["order_id"] for order in first_page["orders"] + second_page["orders"]]
+    assert len(set(refs)) == 5
+
+
+@pytest.mark.django_db
+def test_order_list_rejects_bad_cursor(api_client, create_user):
+    api_client.force_authenticate(user=create_user)
+    response = api_client.get("/api/v1/orders?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_checkout_snapshots_line_items(api_client, create_user, create_food):
+    create_food.available_quantity = 10
+    create_food.save()
+    create_user.wallet_balance = 1000
+    create_user.save(update_fields=["wallet_balance"])
+    address = DeliveryAddress.objects.create(user=create_user, address="Some address")
+    tray = Tray.objects.create(user=create_user)
+    TrayItem.objects.create(
+        tray=tray, food_item_id=create_food.id, food_item_type="Meal", quantity=2
+    )
+    api_client.force_authenticate(user=create_user)
+    response = api_client.post(
+        "/api/v1/tray/checkout",
+        {"address_id": address.id, "payment_type": "Instant"},
+        format="json",
+    )
+    assert response.status_code == 200
+    item = OrderItem.objects.get(order__order_id=response.data["data"]["order_id"])
+    assert item.name == "some food"
+    assert item.unit_price == 24
+
+
+@pytest.mark.django_db
+def test_checkout_with_a_colliding_ref_charges_nothing(
+    api_client, create_user, create_food, mocker
+):
+    create_food.available_quantity = 10
+    create_food.save()
+    User.deposit(create_user.id, 1000, "Wallet Funding", "REF1")
+    existing = Order.objects.create(
+        user=create_user, total_amount=100, delivery_address="Somewhere"
+    )
+    mocker.patch("orders.views.generate_order_ref", return_value=existing.order_id)
+    address = DeliveryAddress.objects.create(user=create_user, address="Some address")
+    tray = Tray.objects.create(user=create_user)
+    TrayItem.objects.create(
+        tray=tray, food_item_id=create_food.id, food_item_type="Meal", quantity=2
+    )
+    api_client.force_authenticate(user=create_user)
+
+    response = api_client.post(
+        "/api/v1/tray/checkout",
+        {"address_id": address.id, "payment_type": "Instant"},
+        format="json",
+    )
+
+    assert response.status_code == 500
+    create_user.refresh_from_db()
+    create_food.refresh_from_db()
+    assert create_user.wallet_balance == Decimal("1000.00")
+    assert create_food.available_quantity == 10
+    assert tray.items.count() == 1
+
+
+@pytest.mark.django_db
+def test_checkout_retries_a_ref_taken_by_another_worker(
+    api_client, create_user, create_food, mocker
+):
+    create_food.available_quantity = 10
+    create_food.save()
+    User.deposit(create_user.id, 1000, "Wallet Funding", "REF1")
+    existing = Order.objects.create(
+        user=create_user, total_amount=100, delivery_address="Somewhere"
+    )
+    mocker.patch(
+        "orders.views.generate_order_ref",
+        side_effect=[existing.order_id, "FRESHREF0001"],
+    )
+    address = DeliveryAddress.objects.create(user=create_user, address="Some address")
+    tray = Tray.objects.create(user=create_user)
+    TrayItem.objects.create(
+        tray=tray, food_item_id=create_food.id, food_item_type="Meal", quantity=2
+    )
+    api_client.force_authenticate(user=create_user)
+
+    response = api_client.post(
+        "/api/v1/tray/checkout",
+        {"address_id": address.id, "payment_type": "Instant"},
+        format="json",
+    )
+
+    assert response.status_code == 200
+    assert response.data["data"]["order_id"] == "FRESHREF0001"
+    create_user.refresh_from_db()
+    create_food.refresh_from_db()
+    charged = Decimal("1000.00") - create_user.wallet_balance
+    assert charged == Order.objects.get(order_id="FRESHREF0001").total_amount
+    assert create_food.available_quantity == 8
+    assert tray.items.count() == 0
+
+
+@pytest.fixture
+def create_staff():
+    return User.objects.create_user(
+        username="kitchen", password="12345", email="kitchen@test.com", is_staff=True
+    )
+
+
+def _make_orders(user, count, status="Pending"):
+    return [
+        Order.objects.create(
+            user=user, status=status, total_amount=100, delivery_address="Somewhere"
+        )
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.django_db
+def test_bulk_transition_moves_valid_orders_only(create_user, create_staff):
+    pending = _make_orders(create_user, 3)
+    delivered = _make_orders(create_user, 1, status="Delivered")
+    refs = [order.order_id for order in pending + delivered]
+
+    moved, skipped = bulk_transition(refs, "Preparing", create_staff)
+
+    assert moved == [order.order_id for order in pending]
+    assert skipped == [delivered[0].order_id]
+    assert Order.objects.filter(status="Preparing").count() == 3
+    history = OrderStatusHistory.objects.filter(order=pending[0]).get()
+    assert (history.from_status, history.to_status) == ("Pending", "Preparing")
+    assert history.changed_by == create_staff
+
+
+@pytest.mark.django_db
+def test_transition_rejects_invalid_move(create_user):
+    order = _make_orders(create_user, 1)[0]
+    with pytest.raises(InvalidTransition):
+        transition(order, "Delivered")
+    assert transition(order, "Preparing").status == "Preparing"
+
+
+@pytest.mark.django_db
+def test_order_status_endpoint_is_staff_only(api_client, create_user, create_staff):
+    order = _make_orders(create_user, 1)[0]
+    payload = {"order_ids": [order.order_id], "status": "Preparing"}
+
+    api_client.force_authenticate(user=create_user)
+    response = api_client.post("/api/v1/orders/status", payload, format="json")
+    assert response.status_code == 403
+
+    api_client.force_authenticate(user=create_staff)
+    response = api_client.post("/api/v1/orders/status", payload, format="json")
+    assert response.status_code == 200
+    assert response.data["data"]["updated"] == [order.order_id]
+
+
+def test_local_broker_delivers_to_subscribers():
+    broker = LocalBroker()
+
+    async def scenario():
+        subscription = broker.subscribe(user_channel(1))
+        await subscription.start()
+        broker.publish(user_channel(2), {"order_id": "OTHER"})
+        broker.publish(user_channel(1), {"order_id": "MINE"})
+        message = await asyncio.wait_for(subscription.get(), timeout=1)
+        await subscription.close()
+        return message
+
+    assert asyncio.run(scenario()) == {"order_id": "MINE"}
+    assert broker._subscribers == {}
+
+
+def test_event_stream_sends_messages_and_heartbeats():
+    broker = LocalBroker()
+
+    async def scenario():
+        stream = event_stream(
+            broker.subscribe("channel"), heartbeat=0.01, max_seconds=1
+        )
+        # nothing is registered until the response is streamed
+        assert broker._subscribers == {}
+        chunks = [await stream.__anext__(), await stream.__anext__()]
+        broker.publish("channel", {"order_id": "REF"})
+        chunks.append(await stream.__anext__())
+        await stream.aclose()
+        return chunks
+
+    retry, heartbeat, event = asyncio.run(scenario())
+    assert retry.startswith("retry:")
+    assert heartbeat == ": keep-alive\n\n"
+    assert event == 'event: order.status\ndata: {"order_id": "REF"}\n\n'
+    assert broker._subscribers == {}
+
+
+@pytest.mark.django_db
+def test_transition_publishes_status_change(
+    create_user, mocker, django_capture_on_commit_callbacks
+):
+    broker = mocker.Mock()
+    mocker.patch("orders.events.get_broker", return_value=broker)
+    order = _make_orders(create_user, 1)[0]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        transition(order, "Preparing")
+
+    channel, message = broker.publish.call_args.args
+    assert channel == user_channel(create_user.id)
+    assert message["order_id"] == order.order_id
+    assert message["status"] == "Preparing"
+
+
+def test_order_events_requires_token(client):
+    response = client.get("/api/v1/orders/events")
+    assert response.status_code == 401
+
+
+def _ticket(order_id, minutes, payment_type="OnDelivery", prep=15):
+    return KitchenTicket(
+        order_id=order_id,
+        status="Pending",
+        promised_at=datetime(2024, 1, 1, 12, 0) + timedelta(minutes=minutes),
+        payment_type=payment_type,
+        prep_minutes=prep,
+    )
+
+
+def test_kitchen_queue_claims_by_priority():
+    queue = KitchenQueue()
+    queue.add(_ticket("LATE", 90))
+    queue.add(_ticket("SLOW", 60, prep=50))
+    queue.add(_ticket("CASH", 30))
+    queue.add(_ticket("PAID", 30, payment_type="Instant"))
+    queue.remove("CASH", event="cancelled")
+
+    claimed = [queue.claim().order_id for _ in range(3)]
+
+    assert claimed == ["SLOW", "PAID", "LATE"]
+    assert queue.claim() is None
+
+
+def test_kitchen_queue_feed_is_incremental():
+    queue = KitchenQueue(feed_size=3)
+    queue.add(_ticket("A", 10))
+    version = queue.version
+    queue.claim()
+    queue.remove("A")
+
+    changes, latest = queue.changes_since(version)
+    assert [change["event"] for change in changes] == ["claimed", "completed"]
+    assert latest == version + 2
+
+    for order_id in "BCD":
+        queue.add(_ticket(order_id, 10))
+    changes, _ = queue.changes_since(version)
+    assert changes is None
+
+
+@pytest.mark.django_db
+def test_kitchen_queue_follows_changes_made_through_other_workers(
+    create_user, create_staff
+):
+    reset_kitchen_queue()
+    (first,) = _make_orders(create_user, 1)
+    version = get_kitchen_queue().version
+    # placed and claimed through another worker, no signal reaches this one
+    (second,) = _make_orders(create_user, 1)
+    bulk_transition([first.order_id], "Preparing", create_staff)
+
+    changes, _ = changes_since(version)
+    events = {(change["event"], change["ticket"]["order_id"]) for change in changes}
+    assert {("added", second.order_id), ("claimed", first.order_id)} <= events
+    claimed = next(change for change in changes if change["event"] == "claimed")
+    assert claimed["ticket"]["claimed_by"] == create_staff.id
+    first.refresh_from_db()
+    assert claimed["version"] == version_of(first.updated_at)
+
+    # a worker loading the queue now numbers the same changes alike
+    loaded, _ = load_queue().changes_since(0)
+    assert {change["ticket"]["order_id"]: change["version"] for change in loaded} == {
+        first.order_id: claimed["version"],
+        second.order_id: version_of(second.updated_at),
+    }
+    reset_kitchen_queue()
+
+
+@pytest.mark.django_db
+def test_kitchen_claim_and_complete(api_client, create_user, create_staff):
+    reset_kitchen_queue()
+    orders = _make_orders(create_user, 2)
+    api_client.force_authenticate(user=create_staff)
+
+    response = api_client.post("/api/v1/kitchen/claim")
+    assert response.status_code == 200
+    claimed = response.data["data"]["order_id"]
+    assert claimed == orders[0].order_id
+    assert Order.objects.get(order_id=claimed).status == "Preparing"
+
+    response = api_client.post(f"/api/v1/kitchen/{claimed}/complete")
+    assert response.status_code == 200
+    assert Order.objects.get(order_id=claimed).status == "On Delivery"
+
+    response = api_client.get("/api/v1/kitchen/queue")
+    tickets = response.data["data"]["tickets"]
+    assert [ticket["order_id"] for ticket in tickets] == [orders[1].order_id]
+    reset_kitchen_queue()
+
+
+def _place_order(user, food, quantity, unit_price=None):
+    order = Order.objects.create(
+        user=user, total_amount=quantity * food.price + 300, delivery_address="X"
+    )
+    OrderItem.objects.create(
+        order=order,
+        food_item_id=food.id,
+        food_item_type="Meal",
+        name=food.name,
+        quantity=quantity,
+        unit_price=food.price if unit_price is None else unit_price,
+    )
+    order_placed.send(sender=Order, order=order)
+    return order
+
+
+@pytest.mark.django_db
+def test_checkout_updates_sales_rollups(create_user, create_food):
+    _place_order(create_user, create_food, 2)
+    _place_order(create_user, create_food, 3)
+
+    sales = DailySales.objects.get(item_kind="Meal", item_id=create_food.id)
+    assert sales.quantity == 5
+    assert sales.revenue == 120
+    totals = DailyOrders.objects.get()
+    assert totals.orders == 2
+    assert totals.revenue == 720
+
+
+@pytest.mark.django_db
+def test_rebuild_sales_rollups_matches_incremental(create_user, create_food):
+    _place_order(create_user, create_food, 2)
+    cancelled = _place_order(create_user, create_food, 4)
+    Order.objects.filter(id=cancelled.id).update(status="Cancelled")
+    DailySales.objects.update(quantity=999)
+
+    call_command("rebuild_sales_rollups", stdout=StringIO())
+
+    sales = DailySales.objects.get()
+    assert (sales.quantity, sales.revenue) == (2, 48)
+    assert DailyOrders.objects.get().orders == 1
+    assert RollupWatermark.objects.get().day == sales.day
+
+
+@pytest.mark.django_db
+def test_sales_stats_reads_rollups(
+    api_client, create_user, create_staff, create_food, django_assert_num_queries
+):
+    _place_order(create_user, create_food, 2)
+    api_client.force_authenticate(user=create_staff)
+    with django_assert_num_queries(2):
+        response = api_client.get("/api/v1/admin/stats")
+    assert response.status_code == 200
+    data = response.data["data"]
+    assert data["orders"] == 1
+    assert data["top_items"][0]["quantity"] == 2
+
+
+def _bulk_orders(user, first, count):
+    Order.objects.bulk_create(
+        [
+            Order(
+                id=pk,
+                user=user,
+                order_id=f"EXPORT{pk:07d}",
+                total_amount=100,
+                delivery_address="X",
+            )
+            for pk in range(first, first + count)
+        ]
+    )
+    OrderItem.objects.bulk_create(
+        [
+            OrderItem(order_id=pk, food_item_id=1, name="Rice", unit_price=50)
+            for pk in range(first, first + count)
+        ]
+    )
+
+
+def _export_peak(**filters):
+    tracemalloc.start()
+    rows = sum(1 for _ in export_lines("csv", chunk_size=100, **filters))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, peak
+
+
+@pytest.mark.django_db
+def test_order_export_memory_is_bounded(create_user):
+    _bulk_orders(create_user, 1, 300)
+    small_rows, small_peak = _export_peak()
+    _bulk_orders(create_user, 301, 2700)
+    large_rows, large_peak = _export_peak()
+
+    assert (small_rows, large_rows) == (301, 3001)
+    # ten times the orders, memory use stays at one chunk
+    assert large_peak < small_peak * 1.5
+
+
+@pytest.mark.django_db
+def test_order_export_endpoint_streams_filtered_orders(
+    api_client, create_user, create_staff
+):
+    _bulk_orders(create_user, 1, 3)
+    Order.objects.filter(id=2).update(status="Delivered")
+    api_client.force_authenticate(user=create_staff)
+
+    response = api_client.get("/api/v1/orders/export?output=ndjson&status=Delivered")
+    assert response.status_code == 200
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert [json.loads(line)["order_id"] for line in lines] == ["EXPORT0000002"]
+
+    response = api_client.get("/api/v1/orders/export?start=2020-13-01")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_export_orders_command_writes_csv(create_user):
+    _bulk_orders(create_user, 1, 2)
+    output = StringIO()
+    call_command("export_orders", stdout=output)
+    rows = list(csv.reader(StringIO(output.getvalue())))
+    assert rows[0][0] == "order_id"
+    assert [row[0] for row in rows[1:]] == ["EXPORT0000001", "EXPORT0000002"]
+
+
+def _old_orders(user, count, status="Delivered", days=400):
+    orders = _make_orders(user, count, status=status)
+    for order in orders:
+        OrderItem.objects.create(order=order, food_item_id=1, name="Jollof")
+        Order.objects.filter(id=order.id).update(
+            created_at=timezone.now() - timedelta(days=days)
+        )
+    return orders
+
+
+@pytest.mark.django_db
+def test_archive_moves_old_finished_orders_and_verifies(create_user):
+    delivered = _old_orders(create_user, 3)
+    rider_run = RiderRun.objects.create(
+        zone="lagos:island", window_start=timezone.now(), order_count=1
+    )
+    Order.objects.filter(id=delivered[0].id).update(
+        delivery_zone="lagos:island", rider_run=rider_run
+    )
+    pending = _old_orders(create_user, 1, status="Pending")
+    recent = _make_orders(create_user, 1, status="Delivered")
+
+    # stop after the first batch, the next call resumes the same run
+    first = run_archive(months=6, batch_size=2, max_batches=1)
+    assert (first.orders_moved, first.finished_at) == (2, None)
+    run = run_archive(months=6, batch_size=2)
+
+    assert run.id == first.id
+    assert (run.orders_moved, run.items_moved, run.verified) == (3, 3, True)
+    assert ArchiveRun.objects.count() == 1
+    assert set(Order.objects.values_list("id", flat=True)) == {
+        pending[0].id,
+        recent[0].id,
+    }
+    archived = ArchivedOrder.objects.get(id=delivered[0].id)
+    assert archived.order_id == delivered[0].order_id
+    assert (archived.delivery_zone, archived.rider_run) == ("lagos:island", rider_run)
+    assert archived.items.count() == 1
+
+
+@pytest.mark.django_db
+def test_order_lookup_falls_back_to_archive(api_client, create_user):
+    order = _old_orders(create_user, 1)[0]
+    run_archive(months=6)
+
+    assert isinstance(find_order(order.order_id), ArchivedOrder)
+    api_client.force_authenticate(user=create_user)
+    response = api_client.get(f"/api/v1/orders/{order.order_id}")
+    assert response.status_code == 200
+    assert response.data["data"]["status"] == "Delivered"
+    assert response.data["data"]["items"][0]["name"] == "Jollof"
+    with pytest.raises(Order.DoesNotExist):
+        find_order("MISSING")
+
+
+def _ready(order_id, zone, minute, promised=20):
+    start = datetime(2024, 1, 1, 12, 0)
+    return ReadyOrder(
+        order_id=order_id,
+        zone=zone,
+        ready_at=start + timedelta(minutes=minute),
+        promised_at=start + timedelta(minutes=promised),
+    )
+
+
+def test_batching_engine_groups_by_zone_and_window():
+    engine = BatchingEngine(max_batch_size=2, max_wait=timedelta(minutes=10))
+    assert engine.add(_ready("A", "lagos:island", 0)) == []
+    assert engine.add(_ready("B", "lagos:ikeja", 1)) == []
+    # same zone, promised in the next window
+    assert engine.add(_ready("C", "lagos:island", 2, promised=50)) == []
+
+    full = engine.add(_ready("D", "lagos:island", 3))
+    assert [batch.order_ids for batch in full] == [["A", "D"]]
+    assert engine.tick(datetime(2024, 1, 1, 12, 9)) == []
+    due = engine.tick(datetime(2024, 1, 1, 12, 12))
+    assert sorted(batch.order_ids for batch in due) == [["B"], ["C"]]
+    assert len(engine) == 0
+
+
+@pytest.mark.django_db
+def test_ready_orders_are_dispatched_in_rider_runs(
+    create_user, create_staff, settings, django_capture_on_commit_callbacks
+):
+    settings.DISPATCH_MAX_BATCH_SIZE = 3
+    reset_dispatcher()
+    orders = _make_orders(create_user, 4, status="Preparing")
+    Order.objects.update(delivery_zone="lagos:island")
+    refs = [order.order_id for order in orders]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        bulk_transition([refs[0], refs[2]], "On Delivery", create_staff)
+    # a cancelled order leaves its batch before a rider takes it
+    with django_capture_on_commit_callbacks(execute=True):
+        bulk_transition([refs[2]], "Cancelled", create_staff)
+    assert RiderRun.objects.count() == 0
+
+    with django_capture_on_commit_callbacks(execute=True):
+        bulk_transition([refs[1], refs[3]], "On Delivery", create_staff)
+    run = RiderRun.objects.get()
+    assert (run.zone, run.order_count) == ("lagos:island", 3)
+    assert set(run.orders.values_list("order_id", flat=True)) == {
+        refs[0],
+        refs[1],
+        refs[3],
+    }
+    reset_dispatcher()
+
+
+@pytest.mark.django_db
+def test_dispatcher_follows_orders_moved_through_other_workers(
+    create_user, create_staff, settings
+):
+    settings.DISPATCH_MAX_BATCH_SIZE = 2
+    reset_dispatcher()
+    first, second, third = _make_orders(create_user, 3, status="Preparing")
+    Order.objects.update(delivery_zone="lagos:island", promised_at=timezone.now())
+    assert len(get_dispatcher()) == 0
+
+    # made ready through another worker, no signal reaches this one
+    bulk_transition([third.order_id], "On Delivery", create_staff)
+    assert len(get_dispatcher()) == 1
+    # and handed to a rider there
+    elsewhere = RiderRun.objects.create(
+        zone="lagos:island", window_start=timezone.now()
+    )
+    Order.objects.filter(id=third.id).update(
+        rider_run=elsewhere, updated_at=timezone.now()
+    )
+    assert len(get_dispatcher()) == 0
+
+    bulk_transition([first.order_id, second.order_id], "On Delivery", create_staff)
+    get_dispatcher()
+    run = RiderRun.objects.exclude(id=elsewhere.id).get()
+    assert set(run.orders.values_list("order_id", flat=True)) == {
+        first.order_id,
+        second.order_id,
+    }
+    reset_dispatcher()
+
+
+@pytest.mark.django_db
+def test_dispatch_command_hands_over_orders_ready_before_it_started(create_user):
+    reset_dispatcher()
+    waited, fresh = _make_orders(create_user, 2, status="On Delivery")
+    Order.objects.update(delivery_zone="lagos:island", promised_at=timezone.now())
+    Order.objects.filter(id=waited.id).update(
+        updated_at=timezone.now() - timedelta(hours=2)
+    )
+
+    output = StringIO()
+    call_command("dispatch_orders", stdout=output)
+
+    # both share the batch the older order opened two hours ago
+    run = RiderRun.objects.get()
+    assert set(run.orders.values_list("order_id", flat=True)) == {
+        waited.order_id,
+        fresh.order_id,
+    }
+    assert "Dispatched 1 runs, 0 orders waiting" in output.getvalue()
+    reset_dispatcher()
+
+
+@pytest.mark.django_db
+def test_reorder_copies_lines_into_tray(
+    api_client, create_user, create_food, django_assert_max_num_queries
+):
+    create_food.available_quantity = 5
+    create_food.price = 30
+    create_food.save()
+    sold_out = Food.objects.create(name="sold out", price=10, available_quantity=1)
+    order = Order.objects.create(
+        user=create_user, total_amount=100, delivery_address="Somewhere"
+    )
+    OrderItem.objects.create(
+        order=order, food_item_id=create_food.id, quantity=2, unit_price=24
+    )
+    OrderItem.objects.create(order=order, food_item_id=sold_out.id, quantity=3)
+    OrderItem.objects.create(order=order, food_item_id=999999, quantity=1)
+    tray = Tray.objects.create(user=create_user)
+    TrayItem.objects.create(tray=tray, food_item_id=create_food.id, quantity=1)
+    api_client.force_authenticate(user=create_user)
+
+    # the query count does not grow with the number of lines
+    with django_assert_max_num_queries(10):
+        response = api_client.post(f"/api/v1/orders/{order.order_id}/reorder")
+
+    assert response.status_code == 200
+    data = response.data["data"]
+    assert data["items_count"] == 1
+    assert data["items"][0]["quantity"] == 3
+    assert data["items"][0]["food"]["name"] == "some food"
+    assert [line["food_item_id"] for line in data["skipped"]] == [sold_out.id, 999999]
+    assert data["price_changes"][0]["price"] == 30
+    assert TrayItem.objects.get(tray=tray).quantity == 3
+
+    response = api_client.post("/api/v1/orders/MISSING/reorder")
+    assert response.status_code == 404
+
+
+def _paid_order(user, food, quantity, promised_at=None):
+    """an Instant order as checkout leaves it, stock taken and wallet debited"""
+    order = _place_order(user, food, quantity)
+    User.debit(user.id, order.total_amount, "Food Purchase", order.order_id)
+    Order.objects.filter(id=order.id).update(
+        payment_status="Paid", payment_type="Instant", promised_at=promised_at
+    )
+    Food.objects.filter(id=food.id).update(
+        available_quantity=F("available_quantity") - quantity,
+        total_purchase=F("total_purchase") + quantity,
+    )
+    return order
+
+
+@pytest.mark.django_db
+def test_cancel_refunds_restocks_and_reverses_rollups(
+    api_client, create_user, create_food, django_capture_on_commit_callbacks
+):
+    Food.objects.filter(id=create_food.id).update(available_quantity=10)
+    User.objects.filter(id=create_user.id).update(wallet_balance=1000)
+    order = _paid_order(create_user, create_food, 2)
+    api_client.force_authenticate(user=create_user)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.post(f"/api/v1/orders/{order.order_id}/cancel")
+    assert response.status_code == 200
+    assert response.data["data"]["refunded"] == Decimal("348.00")
+
+    order.refresh_from_db()
+    assert (order.status, order.payment_status) == ("Cancelled", "Refunded")
+    assert User.objects.get(id=create_user.id).wallet_balance == Decimal("1000.00")
+    create_food.refresh_from_db()
+    assert (create_food.available_quantity, create_food.total_purchase) == (10, 0)
+    assert DailyOrders.objects.get().orders == 0
+    assert DailySales.objects.get(item_id=create_food.id).quantity == 0
+
+    # cancelling again neither refunds nor restocks twice
+    response = api_client.post(f"/api/v1/orders/{order.order_id}/cancel")
+    assert response.status_code == 400
+    assert User.objects.get(id=create_user.id).wallet_balance == Decimal("1000.00")
+
+
+@pytest.mark.django_db
+def test_admin_cancel_action_refunds_and_restocks(
+    client, create_user, create_food, django_capture_on_commit_callbacks
+):
+    Food.objects.filter(id=create_food.id).update(available_quantity=10)
+    User.objects.filter(id=create_user.id).update(wallet_balance=1000)
+    order = _paid_order(create_user, create_food, 2)
+    client.force_login(
+        User.objects.create_superuser(
+            username="admin", password="12345", email="admin@test.com"
+        )
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(
+            "/admin/orders/order/",
+            {"action": "cancel_selected_orders", "_selected_action": [order.id]},
+        )
+    assert response.status_code == 302
+
+    order.refresh_from_db()
+    assert (order.status, order.payment_status) == ("Cancelled", "Refunded")
+    assert User.objects.get(id=create_user.id).wallet_balance == Decimal("1000.00")
+    create_food.refresh_from_db()
+    assert (create_food.available_quantity, create_food.total_purchase) == (10, 0)
+
+
+@pytest.mark.django_db
+def test_cancel_slot_cancels_open_orders_of_the_slot(
+    api_client, create_user, create_staff, create_food
+):
+    Food.objects.filter(id=create_food.id).update(available_quantity=20)
+    User.objects.filter(id=create_user.id).update(wallet_balance=1000)
+    slot = timezone.now().replace(microsecond=0) + timedelta(hours=1)
+    paid = _paid_order(create_user, create_food, 1, slot)
+    unpaid = _place_order(create_user, create_food, 2)
+    Order.objects.filter(id=unpaid.id).update(promised_at=slot, status="Preparing")
+    later = _paid_order(create_user, create_food, 1, slot + timedelta(hours=1))
+    payload = {
+        "start": slot.isoformat(),
+        "end": (slot + timedelta(minutes=30)).isoformat(),
+    }
+
+    api_client.force_authenticate(user=create_user)
+    response = api_client.post("/api/v1/orders/cancel-slot", payload, format="json")
+    assert response.status_code == 403
+
+    api_client.force_authenticate(user=create_staff)
+    response = api_client.post("/api/v1/orders/cancel-slot", payload, format="json")
+    assert response.status_code == 200
+    assert sorted(response.data["data"]["cancelled"]) == sorted(
+        [paid.order_id, unpaid.order_id]
+    )
+    assert response.data["data"]["refunded"] == Decimal("324.00")
+    assert Order.objects.get(id=later.id).status == "Pending"
+    assert Order.objects.get(id=unpaid.id).payment_status != "Refunded"
+    # stock of both cancelled orders is back, the later order still holds its own
+    assert Food.objects.get(id=create_food.id).available_quantity == 21
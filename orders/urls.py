@@ -3,7 +3,20 @@ from django.urls import path, include
 from orders.views import (
     AddItemToTrayAPIView,
     CheckoutAPIView,
+    KitchenClaimAPIView,
+    KitchenCompleteAPIView,
+    KitchenFeedAPIView,
+    KitchenQueueAPIView,
+    OrderCancelAPIView,
+    OrderDetailAPIView,
+    OrderEventsView,
+    OrderExportAPIView,
+    OrderListAPIView,
+    OrderStatusUpdateAPIView,
     OrderSummaryAPIView,
+    ReorderAPIView,
+    SalesStatsAPIView,
+    SlotCancelAPIView,
     TrayItemListAPIView,
     UpdateTrayItemDecreaseAPIView,
     UpdateTrayItemQuantityAPIView,
@@ -28,5 +41,30 @@ urlpatterns = [
         name="tray-items",
     ),
     path("tray/checkout", CheckoutAPIView.as_view(), name="checkout"),
+    path("orders", OrderListAPIView.as_view(), name="orders"),
     path("orders/summary", OrderSummaryAPIView.as_view(), name="order-summary"),
+    path("orders/export", OrderExportAPIView.as_view(), name="order-export"),
+    path("orders/events", OrderEventsView.as_view(), name="order-events"),
+    path(
+        "orders/status", OrderStatusUpdateAPIView.as_view(), name="order-status-update"
+    ),
+    path("orders/cancel-slot", SlotCancelAPIView.as_view(), name="slot-cancel"),
+    path("orders/<str:order_id>", OrderDetailAPIView.as_view(), name="order-detail"),
+    path(
+        "orders/<str:order_id>/reorder", ReorderAPIView.as_view(), name="order-reorder"
+    ),
+    path(
+        "orders/<str:order_id>/cancel",
+        OrderCancelAPIView.as_view(),
+        name="order-cancel",
+    ),
+    path("admin/stats", SalesStatsAPIView.as_view(), name="sales-stats"),
+    path("kitchen/queue", KitchenQueueAPIView.as_view(), name="kitchen-queue"),
+    path("kitchen/feed", KitchenFeedAPIView.as_view(), name="kitchen-feed"),
+    path("kitchen/claim", KitchenClaimAPIView.as_view(), name="kitchen-claim"),
+    path(
+        "kitchen/<str:order_id>/complete",
+        KitchenCompleteAPIView.as_view(),
+        name="kitchen-complete",
+    ),
 ]
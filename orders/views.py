@@ -1,18 +1,51 @@
+import logging
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from foods.models import Food, FoodPackage
-from orders.serializers import TrayItemSerializer
+from orders.serializers import OrderSerializer, TrayItemSerializer
 from users.models import Tray, TrayItem, DeliveryAddress
+from utils.auth import AsyncAuthenticatedView
 from utils.response import service_response
 from utils.exceptions import handle_internal_server_exception
 from django.views.decorators.cache import never_cache
-from utils.utils import generate_ref
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from utils.utils import generate_order_ref
+from .archive import find_order
+from .cancellation import CUSTOMER_CANCELLABLE, cancel_orders, cancel_slot
+from .dispatch import delivery_zone
+from .events import event_stream, get_broker, user_channel
+from .exports import EXPORT_FORMATS, export_lines, parse_filters
+from .kitchen import changes_since, claim_next, complete, get_kitchen_queue
+from .lifecycle import InvalidTransition, bulk_transition
+from .reorder import reorder
+from .rollups import default_range, stats
+from .signals import order_placed
 from .models import Order, OrderItem
 from utils.mails import sendmail
+from utils.pagination import get_page_size, paginate_by_keyset
 
 # Create your views here.
 
+logger = logging.getLogger(__name__)
+
+# checkout attempts before a taken order reference fails the request
+ORDER_REF_ATTEMPTS = 3
+
+
+class CheckoutRejected(Exception):
+    """Stops a checkout the customer can fix, nothing of it is saved"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
 
 class AddItemToTrayAPIView(APIView):
     """Add an item to the Tray"""
@@ -200,83 +233,71 @@ class CheckoutAPIView(APIView):
 
     """
 
-    def post(self, request, *args, **kwargs):
-        """Checkout post handler"""
-        try:
-            user = request.user
-            data = request.data
-            # add data validation for address and payment_type
-            address_id = data.get("address_id")
-            address_instance = DeliveryAddress.objects.get(id=int(address_id))
-            city = address_instance.city
-            address = address_instance.address
-            payment_type = data.get("payment_type")
-            if (
-                payment_type.capitalize() != "Instant"
-                and payment_type.capitalize() != "OnDelivery"
-            ):
-                return service_response(
-                    status="error",
-                    data=None,
-                    message="Invalid payment type",
-                    status_code=400,
-                )
-            tray = Tray.objects.get(user=user)
-            if tray.items.count() == 0:
-                return service_response(
-                    status="error",
-                    data=None,
-                    message="Tray is empty, please add items to the tray",
-                    status_code=400,
-                )
-            total_amount = 0
-            order_id = generate_ref()
-            full_address = f"{city} - {address}"
+    def _place_order(
+        self,
+        user,
+        tray: Tray,
+        payment_type: str,
+        full_address: str,
+        zone: str,
+        order_id: str,
+    ) -> Order:
+        """places the tray as order order_id
+
+        Stock, wallet debit, order and tray change together, a failure
+        anywhere (a duplicate order_id included) rolls all of it back.
+        """
+        with transaction.atomic():
+            total_amount = Decimal("0")
+            # name and price of every line, stored on the order items
+            snapshots = {}
+            prep_minutes = 0
             for item in tray.items.all():
                 if item.food_item_type == "Meal":
                     food = Food.objects.get(id=item.food_item_id)
                     if item.quantity > food.available_quantity:
-                        return service_response(
-                            status="error",
-                            data=None,
-                            message=f"Not enough stock for {food.name} in this quantity",
-                            status_code=402,
+                        raise CheckoutRejected(
+                            f"Not enough stock for {food.name} in this quantity"
                         )
                     food.available_quantity -= item.quantity
                     food.save()
-                elif item.food_item_type == "Pacakge":
+                    snapshots[item.id] = (food.name, food.price)
+                    prep_minutes = max(prep_minutes, food.prep_minutes)
+                elif item.food_item_type == "Package":
                     package = FoodPackage.objects.get(id=item.food_item_id)
                     if item.quantity > package.available_quantity:
-                        return service_response(
-                            status="error",
-                            data=None,
-                            message=f"Not enough stock for {package.name} in this quantity",
-                            status_code=402,
+                        raise CheckoutRejected(
+                            f"Not enough stock for {package.name} in this quantity"
                         )
                     package.available_quantity -= item.quantity
                     package.save()
+                    snapshots[item.id] = (package.name, package.price)
+                    prep_minutes = max(prep_minutes, package.prep_minutes)
                 # TODO: Add delivery amount charge
-                total_amount += item.subtotal()
+                if item.id in snapshots:
+                    total_amount += item.quantity * snapshots[item.id][1]
             total_amount += 300
+            promised_at = timezone.now() + timedelta(
+                minutes=prep_minutes + settings.KITCHEN_DELIVERY_MINUTES
+            )
             if payment_type.capitalize() == "Instant":
                 # charge the user instantly
                 message = user.debit(user.id, total_amount, "Food Purchase", order_id)
                 if message == "Low Funds":
-                    return service_response(
-                        status="error",
-                        data=None,
-                        message="Insufficient Funds, Please fund your wallet or select pay on delivery cash or transfer!",
-                        status_code=402,
+                    raise CheckoutRejected(
+                        "Insufficient Funds, Please fund your wallet or select pay on delivery cash or transfer!"
                     )
                 elif message == "Error":
-                    return handle_internal_server_exception()
+                    raise Exception(f"Unable to debit order {order_id}")
                 elif message == "Debited":
                     # create order
                     order = Order.objects.create(
                         user=user,
                         total_amount=total_amount,
                         delivery_address=full_address,
+                        delivery_zone=zone,
                         order_id=order_id,
+                        promised_at=promised_at,
                     )
                     order.payment_status = "Paid"
                     order.payment_type = "Instant"
@@ -286,7 +307,9 @@ class CheckoutAPIView(APIView):
                     user=user,
                     total_amount=total_amount,
                     delivery_address=full_address,
+                    delivery_zone=zone,
                     order_id=order_id,
+                    promised_at=promised_at,
                 )
 
             for item in tray.items.all():
@@ -298,13 +321,62 @@ class CheckoutAPIView(APIView):
                     package = FoodPackage.objects.get(id=item.food_item_id)
                     package.increase_total_purchase(item.quantity)
                 # create the order items
+                name, unit_price = snapshots.get(item.id, ("", None))
                 OrderItem.objects.create(
                     order=order,
                     food_item_type=item.food_item_type,
                     food_item_id=item.food_item_id,
                     quantity=item.quantity,
+                    name=name,
+                    unit_price=unit_price,
                 )
             tray.items.all().delete()
+        return order
+
+    def post(self, request, *args, **kwargs):
+        """Checkout post handler"""
+        try:
+            user = request.user
+            data = request.data
+            # add data validation for address and payment_type
+            address_id = data.get("address_id")
+            address_instance = DeliveryAddress.objects.get(id=int(address_id))
+            full_address = f"{address_instance.city} - {address_instance.address}"
+            zone = delivery_zone(address_instance.state, address_instance.city)
+            payment_type = data.get("payment_type")
+            if (
+                payment_type.capitalize() != "Instant"
+                and payment_type.capitalize() != "OnDelivery"
+            ):
+                return service_response(
+                    status="error",
+                    data=None,
+                    message="Invalid payment type",
+                    status_code=400,
+                )
+            tray = Tray.objects.get(user=user)
+            if tray.items.count() == 0:
+                return service_response(
+                    status="error",
+                    data=None,
+                    message="Tray is empty, please add items to the tray",
+                    status_code=400,
+                )
+            # a reference another worker already used fails the insert, the
+            # whole checkout is rolled back and retried with a fresh one
+            for attempt in range(1, ORDER_REF_ATTEMPTS + 1):
+                order_id = generate_order_ref()
+                try:
+                    order = self._place_order(
+                        user, tray, payment_type, full_address, zone, order_id
+                    )
+                    break
+                except IntegrityError:
+                    taken = Order.objects.filter(order_id=order_id).exists()
+                    if not taken or attempt == ORDER_REF_ATTEMPTS:
+                        raise
+                    logger.warning(f"Order reference {order_id} is taken, retrying")
+            order_placed.send(sender=Order, order=order)
             data = {
                 "order_id": order.order_id,
             }
@@ -334,6 +406,13 @@ class CheckoutAPIView(APIView):
                 message="Order Successfully Placed",
                 status_code=200,
             )
+        except CheckoutRejected as e:
+            return service_response(
+                status="error",
+                data=None,
+                message=e.message,
+                status_code=402,
+            )
         except DeliveryAddress.DoesNotExist:
             return service_response(
                 status="error",
@@ -366,3 +445,431 @@ class OrderSummaryAPIView(APIView):
             )
         except Exception:
             return handle_internal_server_exception()
+
+
+class OrderDetailAPIView(APIView):
+    """Retrieve an order by its reference"""
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderSerializer
+
+    def get(self, request, *args, **kwargs):
+        """fetch a single order using the indexed order_id"""
+        try:
+            user = request.user
+            order_id = kwargs.get("order_id", "").upper()
+            # staff can look up any order, users only their own
+            order = find_order(order_id, None if user.is_staff else user)
+            serializer = self.serializer_class(order)
+            return service_response(
+                status="success",
+                data=serializer.data,
+                message="Order Fetch Successfully",
+                status_code=200,
+            )
+        except Order.DoesNotExist:
+            return service_response(
+                status="error",
+                data=None,
+                message="This Order Does Not Exist",
+                status_code=404,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class ReorderAPIView(APIView):
+    """Copy the lines of a past order into the tray"""
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = TrayItemSerializer
+
+    def post(self, request, *args, **kwargs):
+        """reorder post handler, lines that cannot be ordered are reported"""
+        try:
+            user = request.user
+            order = find_order(kwargs.get("order_id", "").upper(), user)
+            tray_items, skipped, price_changes, catalog = reorder(order, user)
+            serializer = self.serializer_class(
+                tray_items,
+                context={"request": request, "catalog": catalog},
+                many=True,
+            )
+            return service_response(
+                status="success",
+                data={
+                    "items": serializer.data,
+                    "items_count": len(tray_items),
+                    "skipped": skipped,
+                    "price_changes": price_changes,
+                },
+                message="Order Items Added To Tray",
+                status_code=200,
+            )
+        except Order.DoesNotExist:
+            return service_response(
+                status="error",
+                data=None,
+                message="This Order Does Not Exist",
+                status_code=404,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class OrderCancelAPIView(APIView):
+    """Cancel one of the user's orders while it is still pending"""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """cancel post handler, paid orders are refunded to the wallet"""
+        try:
+            order = Order.objects.only("order_id").get(
+                order_id=kwargs.get("order_id", "").upper(), user=request.user
+            )
+            cancelled, _, refunded = cancel_orders(
+                [order.order_id], request.user, CUSTOMER_CANCELLABLE
+            )
+            if not cancelled:
+                return service_response(
+                    status="error",
+                    data=None,
+                    message="This Order Can No Longer Be Cancelled",
+                    status_code=400,
+                )
+            return service_response(
+                status="success",
+                data={"order_id": order.order_id, "refunded": refunded},
+                message="Order Cancelled",
+                status_code=200,
+            )
+        except Order.DoesNotExist:
+            return service_response(
+                status="error",
+                data=None,
+                message="This Order Does Not Exist",
+                status_code=404,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class SlotCancelAPIView(APIView):
+    """Cancel every open order promised within a failed time slot"""
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """slot cancellation post handler, `start` and `end` are ISO datetimes"""
+        try:
+            start = datetime.fromisoformat(str(request.data.get("start")))
+            end = datetime.fromisoformat(str(request.data.get("end")))
+            cancelled, refunded = cancel_slot(start, end, request.user)
+            return service_response(
+                status="success",
+                data={"cancelled": cancelled, "refunded": refunded},
+                message=f"{len(cancelled)} Orders Cancelled",
+                status_code=200,
+            )
+        except ValueError:
+            return service_response(
+                status="error",
+                data=None,
+                message="start and end must be ISO 8601 datetimes",
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class OrderListAPIView(APIView):
+    """List the authenticated user's orders, newest first"""
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderSerializer
+
+    def get(self, request, *args, **kwargs):
+        """cursor paginated order history"""
+        try:
+            user = request.user
+            item_fields = [
+                "id",
+                "order",
+                "food_item_id",
+                "food_item_type",
+                "name",
+                "quantity",
+                "unit_price",
+            ]
+            orders = Order.objects.filter(user=user).prefetch_related(
+                Prefetch("items", queryset=OrderItem.objects.only(*item_fields))
+            )
+            page_size = get_page_size(request)
+            cursor = request.query_params.get("cursor")
+            rows, next_cursor = paginate_by_keyset(orders, cursor, page_size)
+            serializer = self.serializer_class(rows, many=True)
+            data = {
+                "orders": serializer.data,
+                "next_cursor": next_cursor,
+            }
+            return service_response(
+                status="success",
+                data=data,
+                message="Orders Fetch Successfully",
+                status_code=200,
+            )
+        except ValueError:
+            return service_response(
+                status="error",
+                data=None,
+                message="Invalid cursor",
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class OrderStatusUpdateAPIView(APIView):
+    """Move many orders to a new status at once"""
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """bulk status transition post handler"""
+        try:
+            order_ids = request.data.get("order_ids")
+            to_status = request.data.get("status")
+            if not isinstance(order_ids, list) or not order_ids or not to_status:
+                return service_response(
+                    status="error",
+                    data=None,
+                    message="order_ids and status are required",
+                    status_code=400,
+                )
+            order_ids = [str(ref).upper() for ref in order_ids]
+            data = {}
+            if to_status == "Cancelled":
+                # cancelling also refunds and restocks
+                moved, skipped, refunded = cancel_orders(order_ids, request.user)
+                data["refunded"] = refunded
+            else:
+                moved, skipped = bulk_transition(order_ids, to_status, request.user)
+            data.update({"updated": moved, "skipped": skipped})
+            return service_response(
+                status="success",
+                data=data,
+                message=f"{len(moved)} Orders Moved To {to_status}",
+                status_code=200,
+            )
+        except InvalidTransition as e:
+            return service_response(
+                status="error",
+                data=None,
+                message=e.message,
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class OrderEventsView(AsyncAuthenticatedView):
+    """Server-Sent Events stream of the user's order status changes
+
+    Every connection is one idle coroutine waiting on the broker, so it
+    must be served by an ASGI server (see restaurant_go/asgi.py).
+    """
+
+    async def get(self, request, *args, **kwargs):
+        """subscribe to the user's order status changes"""
+        response = StreamingHttpResponse(
+            event_stream(
+                get_broker().subscribe(user_channel(request.user.id)),
+                heartbeat=settings.ORDER_EVENTS_HEARTBEAT,
+                max_seconds=settings.ORDER_EVENTS_MAX_SECONDS,
+            ),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        # stop nginx from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class KitchenQueueAPIView(APIView):
+    """Open orders in the order the kitchen should cook them"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """kitchen queue snapshot"""
+        try:
+            queue = get_kitchen_queue()
+            # read the version first, changes made while copying show up
+            # again in the feed and are applied idempotently by the screen
+            version = queue.version
+            data = {
+                "tickets": [ticket.to_dict() for ticket in queue.snapshot()],
+                "version": version,
+            }
+            return service_response(
+                status="success",
+                data=data,
+                message="Kitchen Queue Fetch Successfully",
+                status_code=200,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class KitchenFeedAPIView(APIView):
+    """Changes to the kitchen queue since a version"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """incremental kitchen feed"""
+        try:
+            since = int(request.query_params.get("since", 0))
+            changes, version = changes_since(since)
+            data = {
+                "changes": changes,
+                "version": version,
+                # the feed no longer reaches back to `since`, reload the queue
+                "reset": changes is None,
+            }
+            return service_response(
+                status="success",
+                data=data,
+                message="Kitchen Feed Fetch Successfully",
+                status_code=200,
+            )
+        except ValueError:
+            return service_response(
+                status="error",
+                data=None,
+                message="since must be a number",
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class KitchenClaimAPIView(APIView):
+    """Claim the most urgent pending order"""
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """claim post handler"""
+        try:
+            ticket = claim_next(request.user)
+            if ticket is None:
+                return service_response(
+                    status="error",
+                    data=None,
+                    message="No Pending Orders",
+                    status_code=404,
+                )
+            return service_response(
+                status="success",
+                data=ticket.to_dict(),
+                message="Order Claimed Successfully",
+                status_code=200,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class KitchenCompleteAPIView(APIView):
+    """Hand a prepared order over to delivery"""
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """complete post handler"""
+        try:
+            order_id = kwargs.get("order_id", "").upper()
+            if not complete(order_id, request.user):
+                return service_response(
+                    status="error",
+                    data=None,
+                    message="This Order Is Not Being Prepared",
+                    status_code=400,
+                )
+            return service_response(
+                status="success",
+                data={"order_id": order_id},
+                message="Order Completed Successfully",
+                status_code=200,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class SalesStatsAPIView(APIView):
+    """Sales dashboard figures, served from the daily rollups"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """sales between `start` and `end` (YYYY-MM-DD), last 30 days by default"""
+        try:
+            start, end = default_range()
+            if request.query_params.get("start"):
+                start = date.fromisoformat(request.query_params["start"])
+            if request.query_params.get("end"):
+                end = date.fromisoformat(request.query_params["end"])
+            return service_response(
+                status="success",
+                data=stats(start, end),
+                message="Sales Stats Fetch Successfully",
+                status_code=200,
+            )
+        except ValueError:
+            return service_response(
+                status="error",
+                data=None,
+                message="start and end must be dates in the YYYY-MM-DD format",
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class OrderExportAPIView(APIView):
+    """Stream orders and their lines as CSV or NDJSON"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """export filtered by `start`, `end` (YYYY-MM-DD) and `status`
+
+        `output` picks the format, csv (default) or ndjson.
+        """
+        try:
+            export_format = request.query_params.get("output", "csv")
+            if export_format not in EXPORT_FORMATS:
+                return service_response(
+                    status="error",
+                    data=None,
+                    message="output must be csv or ndjson",
+                    status_code=400,
+                )
+            filters = parse_filters(request.query_params)
+            response = StreamingHttpResponse(
+                export_lines(export_format, **filters),
+                content_type=EXPORT_FORMATS[export_format],
+            )
+            filename = f"orders-{timezone.now():%Y%m%d%H%M%S}.{export_format}"
+            response["Content-Disposition"] = f'attachment; filename="{filename}"'
+            return response
+        except ValueError:
+            return service_response(
+                status="error",
+                data=None,
+                message="start and end must be dates in the YYYY-MM-DD format",
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
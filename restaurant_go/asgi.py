@@ -3,6 +3,10 @@ ASGI config for restaurant_go project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project with an ASGI server (e.g. ``uvicorn restaurant_go.asgi:application``)
+for the order events stream at /api/v1/orders/events, each subscribed client is
+then a single idle connection instead of a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -122,7 +122,7 @@ db_dict: Dict = {
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
         "rest_framework.authentication.TokenAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ],
@@ -146,6 +146,77 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
     "ROTATE_REFRESH_TOKENS": True,
 }
+# seconds a snapshot of the authenticated user is cached for, saving a user
+# drops it at once
+AUTH_USER_CACHE_SECONDS = 60
+
+# Node component of generated order references, every worker host must use a
+# different value between 0 and 1023. A random node is drawn when unset, a
+# reference taken by another node is then retried by checkout.
+ORDER_REF_NODE_ID = os.getenv("ORDER_REF_NODE_ID")
+
+# Order status push, a redis url shares events between workers, leave empty to
+# use the in-process broker
+ORDER_EVENTS_BROKER_URL = os.getenv("ORDER_EVENTS_BROKER_URL", "")
+ORDER_EVENTS_HEARTBEAT = 15  # seconds
+ORDER_EVENTS_MAX_SECONDS = 60 * 5
+
+# minutes promised for delivery on top of the kitchen preparation estimate
+KITCHEN_DELIVERY_MINUTES = 30
+
+# delivery batching, orders of a zone and window share a rider up to the
+# batch size, a batch never waits longer than the max wait for more orders
+DISPATCH_MAX_BATCH_SIZE = int(os.getenv("DISPATCH_MAX_BATCH_SIZE") or 5)
+DISPATCH_MAX_WAIT_MINUTES = int(os.getenv("DISPATCH_MAX_WAIT_MINUTES") or 10)
+DISPATCH_WINDOW_MINUTES = int(os.getenv("DISPATCH_WINDOW_MINUTES") or 30)
+
+# wallet ledger entries written after a snapshot before compaction takes a new one
+WALLET_SNAPSHOT_EVERY = 100
+
+# delivered and cancelled orders older than this move to the archive tables
+ORDER_ARCHIVE_MONTHS = int(os.getenv("ORDER_ARCHIVE_MONTHS") or 6)
+
+# Monnify gateway, the access token is cached until this many seconds before
+# it expires
+MONNIFY_BASE_URL = os.getenv("MONNIFY_BASE_URL_RG")
+MONNIFY_API_KEY = os.getenv("MONNIFY_API_KEY_RG")
+MONNIFY_SECRET_KEY = os.getenv("MONNIFY_SECRET_KEY_RG")
+MONNIFY_CONTRACT_CODE = os.getenv("MONNIFY_CONTRACT_CODE_RG")
+MONNIFY_TOKEN_REFRESH_MARGIN = 60
+# seconds, a slow gateway never pins a worker for longer
+MONNIFY_CONNECT_TIMEOUT = 3.05
+MONNIFY_READ_TIMEOUT = 15
+# keep-alive connections kept open to the gateway per worker process
+MONNIFY_POOL_SIZE = 10
+# seconds a gateway request may take, retries and backoff included. Failed
+# attempts are retried up to the max with jittered, doubling delays.
+MONNIFY_RETRY_BUDGET = 15
+MONNIFY_MAX_RETRIES = 2
+MONNIFY_RETRY_BACKOFF = 0.25
+MONNIFY_RETRY_BACKOFF_MAX = 2
+# this many failed attempts within the window open the gateway circuit, calls
+# then fail at once until a probe call succeeds after the reset seconds, the
+# circuit is shared by the workers through the cache configured by REDIS_URL
+MONNIFY_BREAKER_FAILURES = 5
+MONNIFY_BREAKER_WINDOW = 30
+MONNIFY_BREAKER_RESET = 30
+# set for ASGI deployments, the card and transfer funding endpoints are then
+# served by async views on the asyncio client. WSGI workers keep the sync
+# views and client.
+MONNIFY_ASYNC = os.getenv("MONNIFY_ASYNC") == "True"
+
+# payment webhooks are stored and acknowledged at once, process_webhook_events
+# applies them with this many threads, retrying a failed event up to the max
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS") or 4)
+WEBHOOK_MAX_ATTEMPTS = 5
+# seconds after which an event claimed by a dead worker is taken again
+WEBHOOK_CLAIM_TIMEOUT = 120
+
+# minutes a transfer funding waits for its webhook before
+# reconcile_pending_fundings asks the gateway, and after which an unpaid
+# one is rejected
+FUNDING_RECONCILE_AFTER = 10
+FUNDING_EXPIRY = 60 * 24
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -273,21 +344,24 @@ try:
 except Exception:
     pass
 
-# REDIS_HOST = os.getenv("REDIS_URL", None)
-# redis_url = f"redis://{REDIS_HOST}"
-# CACHES = {
-#     "default": {
-#         "BACKEND": "django_redis.cache.RedisCache",
-#         "LOCATION": (
-#             redis_url
-#             if os.getenv("REDIS_URL")
-#             else ""
-#         ),
-#         "OPTIONS": {
-#             "CLIENT_CLASS": "django_redis.client.DefaultClient",
-#         },
-#         "TIMEOUT": 0,
-#     }
-# }
-
-# print(f'Cache: {CACHES["default"]["LOCATION"]}')
+# Cache shared by every worker, the Monnify token and its refresh lock, the
+# payment circuit breaker and the authenticated user snapshots rely on it.
+# Without REDIS_URL each process keeps its own in-memory cache, which is only
+# right for a single worker.
+REDIS_URL = os.getenv("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
@@ -11,3 +11,9 @@ DATABASES = {
 
 # Disable migrations during tests
 MIGRATION_MODULES = {app: None for app in INSTALLED_APPS}
+
+# keep order events in process
+ORDER_EVENTS_BROKER_URL = ""
+
+# keep the cache in process
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
@@ -1,6 +1,17 @@
 from django.contrib import admin
 
-from users.models import Funding, Tray, TrayItem, User, WalletSummary
+from users.models import (
+    Funding,
+    ReconciliationRun,
+    Tray,
+    TrayItem,
+    User,
+    WalletDiscrepancy,
+    WalletLedgerEntry,
+    WalletSnapshot,
+    WalletSummary,
+    WebhookEvent,
+)
 
 # Register your models here.
 
@@ -9,8 +20,84 @@ class TrayAdmin(admin.ModelAdmin):
     list_display = ["user", "name", "created_at"]
 
 
+class WalletLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ["user", "seq", "kind", "amount", "balance_after", "date_created"]
+    search_fields = ["=reference", "user__username"]
+    list_filter = ["kind", "date_created"]
+    list_select_related = ["user"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class WalletSnapshotAdmin(admin.ModelAdmin):
+    list_display = ["user", "seq", "balance", "date_created"]
+    list_select_related = ["user"]
+
+
+class FundingAdmin(admin.ModelAdmin):
+    list_display = ["ref", "user", "amount", "status", "gateway", "date_created"]
+    search_fields = ["=ref", "user__username"]
+    list_filter = ["status", "date_created"]
+    # __str__ renders the username, join it instead of a query per row
+    list_select_related = ["user"]
+
+
+class WalletSummaryAdmin(admin.ModelAdmin):
+    list_display = ["user", "amount", "status", "order_id", "date_created"]
+    list_select_related = ["user"]
+
+
+class WalletDiscrepancyAdmin(admin.ModelAdmin):
+    list_display = [
+        "user",
+        "wallet_balance",
+        "expected_balance",
+        "wallet_seq",
+        "ledger_seq",
+        "run",
+    ]
+    list_filter = ["run"]
+    list_select_related = ["user"]
+
+
+class ReconciliationRunAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "users_checked",
+        "discrepancies",
+        "last_user_id",
+        "started_at",
+        "finished_at",
+    ]
+
+
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = [
+        "transaction_reference",
+        "event_type",
+        "status",
+        "attempts",
+        "received_at",
+        "processed_at",
+    ]
+    list_filter = ["status", "gateway"]
+    search_fields = ["transaction_reference"]
+
+
 admin.site.register(User)
-admin.site.register(Funding)
-admin.site.register(WalletSummary)
+admin.site.register(Funding, FundingAdmin)
+admin.site.register(WalletSummary, WalletSummaryAdmin)
+admin.site.register(WalletLedgerEntry, WalletLedgerEntryAdmin)
+admin.site.register(WalletSnapshot, WalletSnapshotAdmin)
 admin.site.register(Tray, TrayAdmin)
 admin.site.register(TrayItem)
+admin.site.register(WalletDiscrepancy, WalletDiscrepancyAdmin)
+admin.site.register(ReconciliationRun, ReconciliationRunAdmin)
+admin.site.register(WebhookEvent, WebhookEventAdmin)
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "users"
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from users.authentication import forget_user
+        from users.models import User
+
+        post_save.connect(forget_user, sender=User, dispatch_uid="users.forget_saved")
+        post_delete.connect(
+            forget_user, sender=User, dispatch_uid="users.forget_deleted"
+        )
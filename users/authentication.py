@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from users.models import User
+
+# columns the hot paths read from request.user, anything else (the wallet
+# balance in particular) is loaded on first access
+SNAPSHOT_FIELDS = [
+    "id",
+    "username",
+    "email",
+    "first_name",
+    "last_name",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+]
+
+
+def snapshot_key(user_id) -> str:
+    return f"auth:user:{user_id}"
+
+
+def forget_users(user_ids) -> None:
+    """drops the snapshots of users changed with QuerySet.update()"""
+    cache.delete_many([snapshot_key(user_id) for user_id in user_ids])
+
+
+def forget_user(sender, instance, **kwargs) -> None:
+    """post_save/post_delete receiver dropping the snapshot of a changed user
+
+    Updates, password changes and deactivation all save the user, the next
+    request reads the row again.
+    """
+    cache.delete(snapshot_key(instance.pk))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication without a users query per request
+
+    The user id comes from the token claims and the rest of `request.user`
+    from a snapshot of SNAPSHOT_FIELDS cached for AUTH_USER_CACHE_SECONDS.
+    The user is built as if loaded with only(), other columns are read from
+    the database when first used and save() writes the loaded ones only.
+
+    Saving, deleting or updating users through the manager drops their
+    snapshot. Other workers only see that with the shared cache configured
+    by REDIS_URL, with a per-process cache they trust a snapshot for up to
+    AUTH_USER_CACHE_SECONDS.
+    """
+
+    def get_user(self, validated_token) -> User:
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = snapshot_key(user_id)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            row = (
+                User.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+                .values("password", *SNAPSHOT_FIELDS)
+                .first()
+            )
+            if row is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            # only the digest simplejwt compares revoked tokens with is cached
+            snapshot = (get_md5_hash_password(row.pop("password")), row)
+            cache.set(key, snapshot, settings.AUTH_USER_CACHE_SECONDS)
+        password_hash, fields = snapshot
+
+        if not fields["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if (
+            api_settings.CHECK_REVOKE_TOKEN
+            and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_hash
+        ):
+            raise AuthenticationFailed(
+                _("The user's password has been changed."), code="password_changed"
+            )
+        return User.from_db(User.objects.db, list(fields), list(fields.values()))
@@ -0,0 +1,222 @@
+import csv
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Tuple
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
+from users.models import CREDIT, User, WalletLedgerEntry
+from utils.utils import to_money
+
+# credit rows applied per transaction
+BULK_CREDIT_CHUNK_SIZE = 500
+
+
+@dataclass
+class CreditRow:
+    """One credit to apply, `reference` makes it idempotent"""
+
+    user_id: int
+    amount: Decimal
+    reference: str
+
+
+@dataclass
+class BulkCreditReport:
+    """Outcome of a bulk credit run"""
+
+    credited: int = 0
+    amount: Decimal = Decimal("0.00")
+    # rows whose reference was already applied by a previous run
+    duplicates: int = 0
+    failures: List[Tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        total = self.credited + self.duplicates + len(self.failures)
+        return total / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "credited": self.credited,
+            "amount": self.amount,
+            "duplicates": self.duplicates,
+            "failures": [
+                {"reference": reference, "reason": reason}
+                for reference, reason in self.failures
+            ],
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def read_rows(lines: Iterable[str]) -> Iterator[Tuple[str, object]]:
+    """Parses user_id,amount,reference csv lines, a header row is optional
+
+    Yields:
+        Tuple[str, object]: the reference (or line number) and either a
+            CreditRow or the reason the line is invalid
+    """
+    for number, values in enumerate(csv.reader(lines), start=1):
+        if not values or (number == 1 and values[0].strip() == "user_id"):
+            continue
+        if len(values) < 3:
+            yield f"line {number}", "Expected user_id,amount,reference"
+            continue
+        user_id, amount, reference = (value.strip() for value in values[:3])
+        try:
+            row = CreditRow(int(user_id), to_money(amount), reference)
+        except (ValueError, InvalidOperation):
+            yield reference or f"line {number}", "Invalid user id or amount"
+            continue
+        yield reference, row
+
+
+def _validate(rows: List[CreditRow], key_prefix: str, report: BulkCreditReport):
+    """drops invalid and already applied rows, returns the rest with their keys"""
+    valid, seen = [], set()
+    for row in rows:
+        if not row.reference:
+            report.failures.append(("", f"Missing reference for user {row.user_id}"))
+        elif row.amount <= 0:
+            report.failures.append((row.reference, "Amount must be positive"))
+        elif row.reference in seen:
+            report.duplicates += 1
+        else:
+            seen.add(row.reference)
+            valid.append((row, f"{key_prefix}:{row.reference}"))
+    applied = set(
+        WalletLedgerEntry.objects.filter(
+            idempotency_key__in=[key for _, key in valid]
+        ).values_list("idempotency_key", flat=True)
+    )
+    users = set(
+        User.objects.filter(id__in={row.user_id for row, _ in valid}).values_list(
+            "id", flat=True
+        )
+    )
+    pending = []
+    for row, key in valid:
+        if key in applied:
+            report.duplicates += 1
+        elif row.user_id not in users:
+            report.failures.append((row.reference, f"User {row.user_id} not found"))
+        else:
+            pending.append((row, key))
+    return pending
+
+
+def _apply_chunk(
+    rows: List[CreditRow], description: str, key_prefix: str
+) -> BulkCreditReport:
+    report = BulkCreditReport()
+    with transaction.atomic():
+        pending = _validate(rows, key_prefix, report)
+        if not pending:
+            return report
+        per_user: Dict[int, List[Tuple[CreditRow, str]]] = {}
+        for row, key in pending:
+            per_user.setdefault(row.user_id, []).append((row, key))
+        # one UPDATE for the whole chunk, every user moves by its own total
+        User.objects.filter(id__in=per_user).update(
+            wallet_balance=F("wallet_balance")
+            + Case(
+                *[
+                    When(id=user_id, then=Value(sum(row.amount for row, _ in credits)))
+                    for user_id, credits in per_user.items()
+                ],
+                default=Value(Decimal("0.00")),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            wallet_seq=F("wallet_seq")
+            + Case(
+                *[
+                    When(id=user_id, then=Value(len(credits)))
+                    for user_id, credits in per_user.items()
+                ],
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+        )
+        entries = []
+        for user_id, balance, seq in User.objects.filter(id__in=per_user).values_list(
+            "id", "wallet_balance", "wallet_seq"
+        ):
+            credits = per_user[user_id]
+            # number the entries backwards from the new balance and sequence
+            for offset, (row, key) in enumerate(reversed(credits)):
+                entries.append(
+                    WalletLedgerEntry(
+                        user_id=user_id,
+                        seq=seq - offset,
+                        kind=CREDIT,
+                        amount=row.amount,
+                        balance_after=balance,
+                        description=description,
+                        reference=row.reference,
+                        idempotency_key=key,
+                    )
+                )
+                balance -= row.amount
+        WalletLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+    report.credited = len(pending)
+    report.amount = sum((row.amount for row, _ in pending), Decimal("0.00"))
+    return report
+
+
+def bulk_credit(
+    rows: Iterable[Tuple[str, object]],
+    description: str = "Bulk Credit",
+    key_prefix: str = "bulk",
+    chunk_size: int = BULK_CREDIT_CHUNK_SIZE,
+) -> BulkCreditReport:
+    """Credits many wallets in chunked transactions
+
+    Each chunk is one set based UPDATE of the balances followed by one batch
+    insert of ledger entries. The idempotency key of an entry is
+    `key_prefix:reference`, rows already applied by an earlier run are
+    counted as duplicates and skipped, so a failed run can simply be
+    repeated.
+
+    Args:
+        rows (Iterable[Tuple[str, object]]): output of read_rows, or
+            (reference, CreditRow) pairs
+        description (str, optional): description of the ledger entries.
+        key_prefix (str, optional): namespace of the references.
+        chunk_size (int, optional): rows per transaction.
+
+    Returns:
+        BulkCreditReport: totals, failures and throughput
+    """
+    report = BulkCreditReport()
+    started = time.perf_counter()
+    chunk: List[CreditRow] = []
+
+    def flush() -> None:
+        for attempt in range(2):
+            try:
+                result = _apply_chunk(chunk, description, key_prefix)
+                break
+            except IntegrityError:
+                # a concurrent run applied some of the references first,
+                # the retry sees them and skips them
+                if attempt:
+                    raise
+        report.credited += result.credited
+        report.amount += result.amount
+        report.duplicates += result.duplicates
+        report.failures += result.failures
+        chunk.clear()
+
+    for reference, row in rows:
+        if not isinstance(row, CreditRow):
+            report.failures.append((reference, row))
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    report.elapsed = time.perf_counter() - started
+    return report
@@ -0,0 +1,129 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Tuple, Union
+from django.conf import settings
+from django.utils import timezone
+from users.models import MONNIFY_GATEWAY, Funding
+from users.webhooks import credit_funding
+from utils import monnify
+
+logger = logging.getLogger(__name__)
+
+
+PENDING = "Pending"
+SUCCESSFUL = "Successful"
+REJECTED = "Rejected"
+
+# pending fundings looked up per page
+FUNDING_BATCH_SIZE = 100
+
+# gateway statuses of a transaction that will never be paid
+UNPAID_FINAL = ["EXPIRED", "FAILED", "CANCELLED", "ABANDONED", "REVERSED"]
+
+
+def open_funding(user, transaction_reference: str, amount) -> Funding:
+    """Records a transfer funding as pending until the payment is confirmed"""
+    return Funding.objects.create(
+        user=user,
+        ref=transaction_reference,
+        amount=amount,
+        status=PENDING,
+        gateway=MONNIFY_GATEWAY,
+    )
+
+
+Lookup = Tuple[Funding, Union[monnify.TransactionStatus, monnify.MonnifyError]]
+
+
+def _lookup(funding: Funding) -> Lookup:
+    """gateway status of a funding, errors are returned for the caller"""
+    try:
+        return funding, monnify.get_transaction(funding.ref)
+    except monnify.GatewayUnavailable:
+        raise
+    except monnify.MonnifyError as e:
+        return funding, e
+
+
+def _resolve(funding: Funding, result, expired_before) -> str:
+    """applies the gateway status of one funding, returns its new status"""
+    if isinstance(result, monnify.TransactionStatus) and result.paid:
+        # the webhook path, a notification processed meanwhile makes it a no-op
+        credit_funding(
+            funding.user_id,
+            result.transaction_reference,
+            result.amount_paid,
+            funding.gateway,
+        )
+        return SUCCESSFUL
+    if isinstance(result, monnify.MonnifyError) and result.status_code != 404:
+        logger.error(f"Unable to look funding {funding.ref} up due to {result.message}")
+        return PENDING
+    unpaid = isinstance(result, monnify.TransactionStatus) and (
+        result.payment_status in UNPAID_FINAL
+    )
+    if unpaid or funding.date_created < expired_before:
+        Funding.objects.filter(id=funding.id, status=PENDING).update(status=REJECTED)
+        return REJECTED
+    return PENDING
+
+
+def reconcile_pending_fundings(
+    batch_size: int = FUNDING_BATCH_SIZE,
+    concurrency: Union[int, None] = None,
+) -> Dict[str, int]:
+    """Confirms pending fundings with the gateway, for lost webhooks
+
+    Fundings pending for more than FUNDING_RECONCILE_AFTER minutes are paged
+    through by id, and each page is looked up on the gateway `concurrency`
+    at a time. Paid ones are credited through credit_funding like a
+    webhook, so a notification arriving later credits nothing. Fundings
+    the gateway closed unpaid, or still pending after FUNDING_EXPIRY
+    minutes, are rejected.
+
+    The run stops early while the gateway circuit is open, what is left
+    stays pending for the next run.
+
+    Args:
+        batch_size (int, optional): fundings looked up per page.
+        concurrency (Union[int, None], optional): gateway lookups at once.
+            Defaults to settings.MONNIFY_POOL_SIZE.
+
+    Returns:
+        Dict[str, int]: number of fundings per resulting status
+    """
+    concurrency = concurrency or settings.MONNIFY_POOL_SIZE
+    now = timezone.now()
+    expired_before = now - timedelta(minutes=settings.FUNDING_EXPIRY)
+    pending = (
+        Funding.objects.filter(
+            status=PENDING,
+            date_created__lte=now - timedelta(minutes=settings.FUNDING_RECONCILE_AFTER),
+        )
+        .select_related("user")
+        .order_by("id")
+    )
+    counts = {SUCCESSFUL: 0, REJECTED: 0, PENDING: 0}
+    last_id = 0
+    with ThreadPoolExecutor(concurrency) as pool:
+        while True:
+            batch: List[Funding] = list(pending.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return counts
+            last_id = batch[-1].id
+            try:
+                # lookups only in the threads, the database is written here
+                results = list(pool.map(_lookup, batch))
+            except monnify.GatewayUnavailable as e:
+                logger.warning(f"Stopped reconciling fundings, {e.message}")
+                counts[PENDING] += len(batch)
+                return counts
+            for funding, result in results:
+                try:
+                    counts[_resolve(funding, result, expired_before)] += 1
+                except Exception as e:
+                    logger.error(
+                        f"Unable to reconcile funding {funding.ref} due to {e}"
+                    )
+                    counts[PENDING] += 1
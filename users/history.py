@@ -0,0 +1,123 @@
+from datetime import datetime
+from typing import List, Tuple, Union
+from django.db.models import Q
+from users.models import (
+    CREDIT,
+    FUNDING_DESCRIPTION,
+    Funding,
+    WalletLedgerEntry,
+)
+from utils.pagination import decode_cursor, encode_cursor
+
+# order of rows sharing a timestamp, higher ranks come first
+FUNDING_RANK = 0
+LEDGER_RANK = 1
+
+
+def _before(cursor: Union[list, None], rank: int) -> Q:
+    """rows of a source that sort after the cursor, newest first"""
+    if cursor is None:
+        return Q()
+    moment, cursor_rank, pk = cursor
+    older = Q(date_created__lt=moment)
+    if rank < cursor_rank:
+        return older | Q(date_created=moment)
+    if rank == cursor_rank:
+        return older | Q(date_created=moment, id__lt=pk)
+    return older
+
+
+def _parse_cursor(cursor: Union[str, None]) -> Union[list, None]:
+    if not cursor:
+        return None
+    values = decode_cursor(cursor)
+    try:
+        return [datetime.fromisoformat(values[0]), int(values[1]), int(values[2])]
+    except (IndexError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def wallet_history(
+    user_id: int, cursor: Union[str, None], page_size: int
+) -> Tuple[List[dict], Union[str, None]]:
+    """One page of a user's wallet movements, newest first
+
+    Ledger entries and fundings are read with one keyset query each over
+    their (user, date_created) index and merged, so every page costs two
+    queries however far back the client scrolls. Successful fundings are
+    also credited to the ledger, those credits are left out so each
+    funding shows once, with its status.
+
+    Args:
+        user_id (int): the wallet owner
+        cursor (Union[str, None]): cursor returned with the previous page
+        page_size (int): number of rows per page
+
+    Raises:
+        ValueError: the cursor is malformed
+
+    Returns:
+        Tuple[List[dict], Union[str, None]]: rows of the page and the next cursor
+    """
+    after = _parse_cursor(cursor)
+    entries = (
+        WalletLedgerEntry.objects.filter(user_id=user_id)
+        .exclude(kind=CREDIT, description=FUNDING_DESCRIPTION)
+        .filter(_before(after, LEDGER_RANK))
+        .order_by("-date_created", "-id")
+        .values(
+            "id",
+            "kind",
+            "amount",
+            "balance_after",
+            "description",
+            "reference",
+            "date_created",
+        )[: page_size + 1]
+    )
+    fundings = (
+        Funding.objects.filter(user_id=user_id)
+        .filter(_before(after, FUNDING_RANK))
+        .order_by("-date_created", "-id")
+        .values("id", "amount", "status", "ref", "gateway", "date_created")[
+            : page_size + 1
+        ]
+    )
+    rows = [
+        {
+            "rank": LEDGER_RANK,
+            "id": entry["id"],
+            "type": entry["kind"].lower(),
+            "amount": entry["amount"],
+            "status": "Successful",
+            "description": entry["description"],
+            "reference": entry["reference"],
+            "balance_after": entry["balance_after"],
+            "date_created": entry["date_created"],
+        }
+        for entry in entries
+    ] + [
+        {
+            "rank": FUNDING_RANK,
+            "id": funding["id"],
+            "type": "funding",
+            "amount": funding["amount"],
+            "status": funding["status"],
+            "description": f"Wallet funding via {funding['gateway']}",
+            "reference": funding["ref"],
+            "balance_after": None,
+            "date_created": funding["date_created"],
+        }
+        for funding in fundings
+    ]
+    rows.sort(
+        key=lambda row: (row["date_created"], row["rank"], row["id"]), reverse=True
+    )
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([last["date_created"], last["rank"], last["id"]])
+    for row in rows:
+        del row["rank"]
+    return rows, next_cursor
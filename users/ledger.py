@@ -0,0 +1,194 @@
+import logging
+from decimal import Decimal
+from typing import Iterator, List, Tuple, Union
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Case,
+    DecimalField,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    When,
+)
+from users.models import DEBIT, User, WalletLedgerEntry, WalletSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+# users looked at per query while compacting
+COMPACT_BATCH_SIZE = 500
+
+
+def signed_sum():
+    """SQL sum of entry amounts, debits counted negative"""
+    return Sum(
+        Case(
+            When(kind=DEBIT, then=-F("amount")),
+            default=F("amount"),
+            output_field=MONEY,
+        )
+    )
+
+
+def latest_snapshot(user_id: int) -> Tuple[int, Decimal]:
+    """seq and balance of the latest snapshot, (0, 0) before the first one"""
+    snapshot = (
+        WalletSnapshot.objects.filter(user_id=user_id)
+        .order_by("-seq")
+        .values_list("seq", "balance")
+        .first()
+    )
+    return snapshot or (0, Decimal("0.00"))
+
+
+def current_balance(user_id: int) -> Decimal:
+    """Balance from the latest snapshot plus the entries written after it
+
+    Compaction keeps the entries past the snapshot below
+    WALLET_SNAPSHOT_EVERY, so this is two indexed queries whatever the
+    length of the history. `User.wallet_balance` holds the same value and
+    is what requests read.
+    """
+    seq, balance = latest_snapshot(user_id)
+    moved = WalletLedgerEntry.objects.filter(user_id=user_id, seq__gt=seq).aggregate(
+        total=signed_sum()
+    )["total"]
+    return balance + (moved or Decimal("0.00"))
+
+
+def _compact_user(user_id: int, min_entries: int) -> Tuple[int, bool]:
+    """snapshot one wallet, returns (snapshots written, balance matched)"""
+    with transaction.atomic():
+        # postings update this row, locking it holds them back meanwhile
+        balance, wallet_seq = (
+            User.objects.select_for_update()
+            .values_list("wallet_balance", "wallet_seq")
+            .get(id=user_id)
+        )
+        written = 0
+        snapshot = (
+            WalletSnapshot.objects.filter(user_id=user_id)
+            .order_by("-seq")
+            .values_list("seq", "balance")
+            .first()
+        )
+        if snapshot is None:
+            # opening balance, whatever the wallet held before the ledger
+            moved = WalletLedgerEntry.objects.filter(user_id=user_id).aggregate(
+                total=signed_sum()
+            )["total"] or Decimal("0.00")
+            snapshot = (0, balance - moved)
+            WalletSnapshot.objects.create(
+                user_id=user_id, seq=snapshot[0], balance=snapshot[1]
+            )
+            written += 1
+        if wallet_seq - snapshot[0] < min_entries:
+            return written, True
+        computed = current_balance(user_id)
+        if computed != balance:
+            logger.error(
+                f"Wallet {user_id} ledger gives {computed} but balance is {balance}"
+            )
+            return written, False
+        WalletSnapshot.objects.create(user_id=user_id, seq=wallet_seq, balance=balance)
+        return written + 1, True
+
+
+def compact(
+    min_entries: Union[int, None] = None, batch_size: int = COMPACT_BATCH_SIZE
+) -> Tuple[int, List[int]]:
+    """Snapshots every wallet with `min_entries` entries past its snapshot
+
+    Wallets without a snapshot first get an opening one at seq 0. A wallet
+    whose ledger does not add up to its balance is left alone and reported.
+
+    Args:
+        min_entries (Union[int, None], optional): entries needed for a new snapshot.
+            Defaults to settings.WALLET_SNAPSHOT_EVERY.
+        batch_size (int, optional): users fetched per query.
+
+    Returns:
+        Tuple[int, List[int]]: snapshots written and ids of mismatched wallets
+    """
+    if min_entries is None:
+        min_entries = settings.WALLET_SNAPSHOT_EVERY
+    last_snapshot = (
+        WalletSnapshot.objects.filter(user_id=OuterRef("pk"))
+        .order_by("-seq")
+        .values("seq")[:1]
+    )
+    candidates = (
+        User.objects.annotate(snapshot_seq=Subquery(last_snapshot))
+        .filter(
+            Q(snapshot_seq__isnull=True, wallet_seq__gt=0)
+            | Q(snapshot_seq__isnull=True, wallet_balance__gt=0)
+            | Q(wallet_seq__gte=F("snapshot_seq") + min_entries)
+        )
+        .order_by("id")
+    )
+    written, mismatched, last_id = 0, [], 0
+    while True:
+        ids = list(
+            candidates.filter(id__gt=last_id).values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return written, mismatched
+        for user_id in ids:
+            count, matched = _compact_user(user_id, min_entries)
+            written += count
+            if not matched:
+                mismatched.append(user_id)
+        last_id = ids[-1]
+
+
+def replay(user_id: int) -> Iterator[Tuple[WalletLedgerEntry, Decimal]]:
+    """Every ledger entry of a user in order, with the balance it leads to
+
+    The replay starts from the opening snapshot, so the running balance of
+    each entry can be compared with its recorded `balance_after`.
+    """
+    opening = (
+        WalletSnapshot.objects.filter(user_id=user_id, seq=0)
+        .values_list("balance", flat=True)
+        .first()
+    )
+    balance = opening or Decimal("0.00")
+    entries = WalletLedgerEntry.objects.filter(user_id=user_id).order_by("seq")
+    for entry in entries.iterator(chunk_size=2000):
+        balance += entry.signed_amount
+        yield entry, balance
+
+
+def audit(user_id: int) -> List[str]:
+    """Replays a wallet and lists everything that does not add up
+
+    Returns:
+        List[str]: problems found, empty when the history is consistent
+    """
+    problems = []
+    snapshots = dict(
+        WalletSnapshot.objects.filter(user_id=user_id).values_list("seq", "balance")
+    )
+    expected_seq = 1
+    balance = snapshots.get(0, Decimal("0.00"))
+    for entry, balance in replay(user_id):
+        if entry.seq != expected_seq:
+            problems.append(f"entry #{expected_seq} is missing before #{entry.seq}")
+        expected_seq = entry.seq + 1
+        if entry.balance_after != balance:
+            problems.append(
+                f"entry #{entry.seq} records {entry.balance_after}, replay gives {balance}"
+            )
+        if entry.seq in snapshots and snapshots[entry.seq] != balance:
+            problems.append(
+                f"snapshot #{entry.seq} holds {snapshots[entry.seq]}, replay gives {balance}"
+            )
+    wallet = User.objects.values_list("wallet_balance", flat=True).get(id=user_id)
+    if wallet != balance:
+        problems.append(f"wallet holds {wallet}, replay gives {balance}")
+    return problems
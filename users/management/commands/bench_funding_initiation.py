@@ -0,0 +1,98 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from utils import monnify, monnify_async
+from utils.benchmarks import Timer
+from utils.monnify_stub import stub_server
+
+
+def _request(number: int) -> monnify.TransactionRequest:
+    return monnify.TransactionRequest(
+        amount=Decimal("2000"),
+        customer_name="bench",
+        customer_email="bench@test.com",
+        payment_reference=f"BENCH{number}",
+        payment_description="Wallet Funding",
+        payment_methods=["ACCOUNT_TRANSFER"],
+    )
+
+
+def _initiate(number: int) -> monnify.TransferAccount:
+    """a bank transfer funding, as MonnifyTransferAPIView starts it"""
+    transaction = monnify.init_transaction(_request(number))
+    return monnify.init_bank_transfer(transaction.transaction_reference, "035")
+
+
+async def _ainitiate(number: int) -> monnify.TransferAccount:
+    """a bank transfer funding, as MonnifyTransferView starts it"""
+    transaction = await monnify_async.init_transaction(_request(number))
+    return await monnify_async.init_bank_transfer(
+        transaction.transaction_reference, "035"
+    )
+
+
+async def _ainitiate_all(fundings: int) -> int:
+    try:
+        await asyncio.gather(*[_ainitiate(number) for number in range(fundings)])
+        return monnify_async.get_client().connections_opened
+    finally:
+        await monnify_async.reset_client()
+
+
+class Command(BaseCommand):
+    help = (
+        "Start concurrent bank transfer fundings against a local Monnify "
+        "stand-in, from one sync worker with a thread pool and from one "
+        "async worker"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fundings", type=int, default=400)
+        parser.add_argument(
+            "--threads", type=int, default=8, help="threads of the sync worker"
+        )
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            default=50,
+            help="gateway connections of the async worker",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.05, help="seconds per response"
+        )
+
+    def _report(self, label, fundings, elapsed, connections, threads) -> None:
+        self.stdout.write(
+            f"{label}: {fundings / elapsed:.0f} fundings/s, "
+            f"{connections} gateway connections, {threads} threads"
+        )
+
+    def handle(self, *args, **options):
+        fundings = options["fundings"]
+        with stub_server(latency=options["latency"]) as stub:
+            settings.MONNIFY_BASE_URL = stub.base_url
+            cache.delete(monnify.TOKEN_CACHE_KEY)
+            monnify.reset_session()
+            # log in outside the timings
+            monnify.get_access_token()
+
+            connections = stub.connections
+            with Timer() as timer:
+                with ThreadPoolExecutor(options["threads"]) as pool:
+                    list(pool.map(_initiate, range(fundings)))
+            self._report(
+                "sync worker",
+                fundings,
+                timer.elapsed,
+                stub.connections - connections,
+                options["threads"],
+            )
+
+            settings.MONNIFY_ASYNC = True
+            settings.MONNIFY_POOL_SIZE = options["pool_size"]
+            with Timer() as timer:
+                opened = asyncio.run(_ainitiate_all(fundings))
+            self._report("async worker", fundings, timer.elapsed, opened, 1)
@@ -0,0 +1,71 @@
+import io
+import time
+from contextlib import redirect_stdout
+from unittest import mock
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+from orders.views import TrayItemListAPIView
+from users.authentication import CachedJWTAuthentication
+from users.models import Tray, User
+from utils.benchmarks import Timer, benchmark_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Request /tray/items with a JWT, authenticating by a users query and "
+        "by the cached user snapshot"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument(
+            "--db-latency",
+            type=float,
+            default=0.0,
+            help="milliseconds added to every query, as a remote database would",
+        )
+
+    def _run(self, label, authentication, client, requests) -> None:
+        with mock.patch.object(
+            TrayItemListAPIView, "authentication_classes", [authentication]
+        ):
+            # the view prints the tray items
+            with redirect_stdout(io.StringIO()):
+                client.get("/api/v1/tray/items")
+                queries = []
+                # the query log is reset per request, count the executions
+                with connection.execute_wrapper(
+                    lambda execute, sql, *args: queries.append(sql)
+                    or execute(sql, *args)
+                ):
+                    client.get("/api/v1/tray/items")
+                with Timer() as timer:
+                    for _ in range(requests):
+                        response = client.get("/api/v1/tray/items")
+        assert response.status_code == 200, response.content
+        self.stdout.write(
+            f"{label:<10} {requests / timer.elapsed:8.0f} requests/s  "
+            f"{len(queries)} queries per request"
+        )
+
+    def handle(self, *args, **options):
+        delay = options["db_latency"] / 1000
+
+        def remote(execute, sql, *args):
+            time.sleep(delay)
+            return execute(sql, *args)
+
+        with benchmark_database(), connection.execute_wrapper(remote):
+            user = User.objects.create_user(
+                username="bench", password="bench", email="bench@example.com"
+            )
+            Tray.objects.get_or_create(user=user)
+            client = APIClient()
+            client.credentials(
+                HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}"
+            )
+            self._run("users row", JWTAuthentication, client, options["requests"])
+            self._run("snapshot", CachedJWTAuthentication, client, options["requests"])
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from requests.auth import HTTPBasicAuth
+from utils import monnify
+from utils.benchmarks import Timer
+from utils.monnify_stub import stub_server
+
+
+def _legacy_lookup(reference: str) -> None:
+    """login then lookup with bare requests calls, as the views used to"""
+    base_url = settings.MONNIFY_BASE_URL
+    response = requests.post(
+        f"{base_url}/api/v1/auth/login",
+        auth=HTTPBasicAuth(
+            f"{settings.MONNIFY_API_KEY}", f"{settings.MONNIFY_SECRET_KEY}"
+        ),
+    )
+    token = response.json()["responseBody"]["accessToken"]
+    requests.get(
+        f"{base_url}/api/v2/transactions/{reference}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Look transactions up against a local Monnify stand-in, with bare "
+        "requests calls and with the pooled client"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument(
+            "--latency", type=float, default=0.005, help="seconds per response"
+        )
+
+    def _run(self, label, lookup, stub, options) -> None:
+        calls = options["calls"]
+        logins, connections = stub.logins, stub.connections
+        with Timer() as timer:
+            with ThreadPoolExecutor(options["threads"]) as pool:
+                list(pool.map(lookup, ["MNFY|BENCH"] * calls))
+        self.stdout.write(
+            f"{label}: {calls / timer.elapsed:.0f} lookups/s, "
+            f"{stub.logins - logins} logins, "
+            f"{stub.connections - connections} connections opened"
+        )
+
+    def handle(self, *args, **options):
+        with stub_server(latency=options["latency"]) as stub:
+            stub.pay("MNFY|BENCH", 1000)
+            settings.MONNIFY_BASE_URL = stub.base_url
+            cache.delete(monnify.TOKEN_CACHE_KEY)
+            monnify.reset_session()
+            self._run("bare requests", _legacy_lookup, stub, options)
+            self._run("pooled client", monnify.get_transaction, stub, options)
+            monnify.reset_session()
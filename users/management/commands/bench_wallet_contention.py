@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from users.models import WalletLedgerEntry
+from utils.benchmarks import Timer, benchmark_database
+
+User = get_user_model()
+
+
+def _legacy_debit(id, amount, description, order_id) -> str:
+    """read, check and save in Python, as debit did with a float balance"""
+    with transaction.atomic():
+        user = User.objects.select_for_update().get(id=id)
+        if user.wallet_balance < amount:
+            return "Low Funds"
+        user.wallet_balance -= amount
+        user.save(update_fields=["wallet_balance"])
+        return "Debited"
+
+
+class Command(BaseCommand):
+    help = "Debit one wallet from many threads at once and check the balance"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--debits", type=int, default=100, help="per thread")
+        parser.add_argument("--amount", default="0.10")
+        parser.add_argument(
+            "--balance",
+            default="100.00",
+            help="starting balance, keep it below threads * debits * amount "
+            "so some debits must be refused",
+        )
+        parser.add_argument(
+            "--legacy",
+            action="store_true",
+            help="also run the old read-modify-save debit for comparison",
+        )
+
+    def _run(self, label, debit, options) -> None:
+        amount = Decimal(options["amount"])
+        balance = Decimal(options["balance"])
+        user = User.objects.create_user(
+            email=f"{label}@example.com",
+            username=label,
+            password="bench",
+            wallet_balance=balance,
+        )
+        results = {"Debited": 0, "Low Funds": 0, "Error": 0}
+        lock = threading.Lock()
+        start = threading.Barrier(options["threads"])
+
+        def worker(number: int) -> None:
+            start.wait()
+            try:
+                for index in range(options["debits"]):
+                    try:
+                        result = debit(user.id, amount, "bench", f"{number}-{index}")
+                    except Exception:
+                        result = "Error"
+                    with lock:
+                        results[result] += 1
+            finally:
+                connections.close_all()
+
+        with Timer() as timer:
+            with ThreadPoolExecutor(options["threads"]) as pool:
+                list(pool.map(worker, range(options["threads"])))
+        final = User.objects.values_list("wallet_balance", flat=True).get(id=user.id)
+        expected = balance - results["Debited"] * amount
+        total = sum(results.values())
+        self.stdout.write(
+            f"{label:<8} {total / timer.elapsed:8.0f} debits/s  "
+            f"debited {results['Debited']}  refused {results['Low Funds']}  "
+            f"errors {results['Error']}  balance {final} expected {expected}  "
+            f"entries {WalletLedgerEntry.objects.filter(user_id=user.id).count()}"
+        )
+        if final != expected or final < 0:
+            self.stderr.write(self.style.ERROR(f"{label}: balance does not add up"))
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self._run("atomic", User.debit, options)
+            if options["legacy"]:
+                self._run("legacy", _legacy_debit, options)
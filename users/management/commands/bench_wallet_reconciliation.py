@@ -0,0 +1,72 @@
+import random
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from users.models import CREDIT, DEBIT, User, WalletLedgerEntry
+from users.reconciliation import RECONCILE_CHUNK_SIZE, reconcile
+from utils.benchmarks import Timer, benchmark_database, current_rss_mb
+
+
+class Command(BaseCommand):
+    help = "Reconcile synthetic wallets in a throw away database and report memory use"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000_000)
+        parser.add_argument("--entries", type=int, default=2, help="per user")
+        parser.add_argument("--chunk-size", type=int, default=RECONCILE_CHUNK_SIZE)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def _seed(self, count: int, per_user: int, batch_size: int) -> int:
+        """wallets with a credit then debits, one in a thousand drifted"""
+        rng = random.Random(11)
+        drifted = 0
+        for first in range(1, count + 1, batch_size):
+            users, entries = [], []
+            for pk in range(first, min(first + batch_size, count + 1)):
+                balance = Decimal("0.00")
+                for seq in range(1, per_user + 1):
+                    kind = CREDIT if seq == 1 else DEBIT
+                    amount = Decimal(rng.randint(100, 5000)) / (1 if seq == 1 else 10)
+                    balance += amount if kind == CREDIT else -amount
+                    entries.append(
+                        WalletLedgerEntry(
+                            user_id=pk,
+                            seq=seq,
+                            kind=kind,
+                            amount=amount,
+                            balance_after=balance,
+                        )
+                    )
+                if pk % 1000 == 0:
+                    balance += 1
+                    drifted += 1
+                users.append(
+                    User(
+                        id=pk,
+                        username=f"bench{pk}",
+                        email=f"bench{pk}@example.com",
+                        wallet_balance=balance,
+                        wallet_seq=per_user,
+                    )
+                )
+            User.objects.bulk_create(users)
+            WalletLedgerEntry.objects.bulk_create(entries)
+        return drifted
+
+    def handle(self, *args, **options):
+        count = options["users"]
+        with benchmark_database():
+            with Timer() as seeding:
+                drifted = self._seed(count, options["entries"], options["batch_size"])
+            self.stdout.write(f"seeded {count} wallets in {seeding.elapsed:.1f}s")
+            rss_before = current_rss_mb()
+            with Timer() as checking:
+                run = reconcile(options["chunk_size"])
+            rss_after = current_rss_mb()
+        self.stdout.write(
+            f"checked {run.users_checked} wallets in {checking.elapsed:.1f}s "
+            f"({run.users_checked / checking.elapsed:.0f} wallets/s), "
+            f"{run.discrepancies} discrepancies, {drifted} expected"
+        )
+        self.stdout.write(
+            f"rss before/after reconciliation: {rss_before:.1f} / {rss_after:.1f} MB"
+        )
@@ -0,0 +1,43 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from users.bulk_credit import BULK_CREDIT_CHUNK_SIZE, bulk_credit, read_rows
+
+
+class Command(BaseCommand):
+    help = "Credit wallets from a user_id,amount,reference csv file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="csv file, use - for stdin")
+        parser.add_argument("--description", default="Bulk Credit")
+        parser.add_argument(
+            "--prefix",
+            default="bulk",
+            help="namespace of the references, a reference is applied once per prefix",
+        )
+        parser.add_argument("--chunk-size", type=int, default=BULK_CREDIT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            source = (
+                sys.stdin
+                if options["path"] == "-"
+                else open(options["path"], newline="", encoding="utf-8")
+            )
+        except OSError as e:
+            raise CommandError(f"Unable to read {options['path']}: {e}")
+        with source:
+            report = bulk_credit(
+                read_rows(source),
+                description=options["description"],
+                key_prefix=options["prefix"],
+                chunk_size=options["chunk_size"],
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Credited {report.credited} wallets with {report.amount} in "
+                f"{report.elapsed:.2f}s ({report.rows_per_second:.0f} rows/s), "
+                f"{report.duplicates} already applied"
+            )
+        )
+        for reference, reason in report.failures:
+            self.stdout.write(self.style.ERROR(f"{reference}: {reason}"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from users.ledger import COMPACT_BATCH_SIZE, compact
+
+
+class Command(BaseCommand):
+    help = "Snapshot wallet balances so balance reads only replay recent entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-entries",
+            type=int,
+            help="entries past the last snapshot, defaults to WALLET_SNAPSHOT_EVERY",
+        )
+        parser.add_argument("--batch-size", type=int, default=COMPACT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        written, mismatched = compact(options["min_entries"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} wallet snapshots"))
+        if mismatched:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"{len(mismatched)} wallets do not match their ledger: "
+                    + ", ".join(str(user_id) for user_id in mismatched)
+                )
+            )
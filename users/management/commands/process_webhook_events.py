@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from users.webhooks import WEBHOOK_BATCH_SIZE, process_pending
+
+
+class Command(BaseCommand):
+    help = "Verify stored payment webhooks with the gateway and credit the wallets"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, help="events applied at once")
+        parser.add_argument("--batch-size", type=int, default=WEBHOOK_BATCH_SIZE)
+        parser.add_argument(
+            "--loop",
+            type=float,
+            help="keep running, waiting this many seconds between passes",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # a long running loop is never a request, drop connections the
+            # database closed or that outlived CONN_MAX_AGE like one would
+            close_old_connections()
+            counts = process_pending(options["workers"], options["batch_size"])
+            if any(counts.values()) or not options["loop"]:
+                self.stdout.write(
+                    ", ".join(f"{count} {status}" for status, count in counts.items())
+                )
+            if not options["loop"]:
+                return
+            time.sleep(options["loop"])
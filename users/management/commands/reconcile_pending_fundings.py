@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from users.fundings import FUNDING_BATCH_SIZE, reconcile_pending_fundings
+
+
+class Command(BaseCommand):
+    help = (
+        "Ask the gateway about transfer fundings still pending, credit the paid "
+        "ones whose webhook was lost and reject the expired ones"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=FUNDING_BATCH_SIZE)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="gateway lookups at once, defaults to MONNIFY_POOL_SIZE",
+        )
+
+    def handle(self, *args, **options):
+        counts = reconcile_pending_fundings(
+            options["batch_size"], options["concurrency"]
+        )
+        self.stdout.write(
+            ", ".join(f"{count} {status}" for status, count in counts.items())
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from users.reconciliation import RECONCILE_CHUNK_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare every wallet balance with its ledger and record the differences, "
+        "run compact_wallet_ledger first so pre-ledger balances have an opening "
+        "snapshot"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=RECONCILE_CHUNK_SIZE)
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="start over instead of resuming the unfinished run",
+        )
+        parser.add_argument(
+            "--max-chunks",
+            type=int,
+            help="stop after this many chunks, the next run resumes",
+        )
+
+    def handle(self, *args, **options):
+        run = reconcile(
+            options["chunk_size"], options["restart"], options["max_chunks"]
+        )
+        message = (
+            f"Run {run.id}: {run.users_checked} wallets checked, "
+            f"{run.discrepancies} discrepancies"
+        )
+        if run.finished_at is None:
+            self.stdout.write(f"{message}, stopped at user {run.last_user_id}")
+        elif run.discrepancies:
+            self.stdout.write(self.style.ERROR(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
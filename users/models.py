@@ -1,4 +1,5 @@
-from typing import Any
+from decimal import Decimal
+from typing import Any, Set, Union
 from django.db import models
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.contrib.auth.models import PermissionsMixin
@@ -9,6 +10,9 @@ import logging
 from django.core.validators import MinValueValidator
 import traceback
 from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
 from phonenumber_field.modelfields import PhoneNumberField
 from django.utils import timezone
 import random
@@ -16,11 +20,32 @@ import string
 from constants.constant import food_types, state_choices, city_choices
 from foods.models import Food, FoodItem, FoodPackage
 from utils.decorators import str_meta
+from utils.utils import to_money
 
 logger = logging.getLogger(__name__)
 
 
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs: Any) -> int:
+        """
+        This method updates the users like QuerySet.update, and drops the
+        cached authentication snapshots of the users it changes, since
+        update() sends no post_save.
+        """
+        from users.authentication import SNAPSHOT_FIELDS, forget_users
+
+        if not set(kwargs).intersection(SNAPSHOT_FIELDS + ["password"]):
+            return super().update(**kwargs)
+        user_ids = list(self.values_list("id", flat=True))
+        updated = super().update(**kwargs)
+        # after commit, a request in between would cache the old row again
+        transaction.on_commit(lambda: forget_users(user_ids))
+        return updated
+
+
 class CustomUserManager(UserManager):
+    def get_queryset(self) -> UserQuerySet:
+        return UserQuerySet(self.model, using=self._db)
 
     # email validator static method
     @staticmethod
@@ -34,6 +59,41 @@ class CustomUserManager(UserManager):
             logger.error(traceback.format_exc())
             raise ValidationError({"email": _("Please enter a valid email address.")})
 
+    # case-insensitive identity lookups, compared as LOWER(column) = value so
+    # the users_email_lower_idx and users_username_lower_idx indexes are used,
+    # iexact compiles to LIKE or UPPER() and scans the table instead
+    @staticmethod
+    def email_is(email: str) -> Exact:
+        return Exact(Lower("email"), email.lower())
+
+    @staticmethod
+    def username_is(username: str) -> Exact:
+        return Exact(Lower("username"), username.lower())
+
+    def with_email(self, email: Union[str, None]) -> models.QuerySet:
+        """Users with the email address, ignoring case"""
+        return self.filter(self.email_is(email)) if email else self.none()
+
+    def with_username(self, username: Union[str, None]) -> models.QuerySet:
+        """Users with the username, ignoring case"""
+        return self.filter(self.username_is(username)) if username else self.none()
+
+    def taken(self, email: str, username: str) -> Set[str]:
+        """
+        This method returns which of "email" and "username" another user
+        already has, ignoring case, in a single query.
+        """
+        email, username = email.lower(), username.lower()
+        taken = set()
+        for user_email, user_username in self.filter(
+            Q(self.email_is(email)) | Q(self.username_is(username))
+        ).values_list("email", "username"):
+            if user_email.lower() == email:
+                taken.add("email")
+            if user_username.lower() == username:
+                taken.add("username")
+        return taken
+
     # create user method
     def create_user(
         self, email: str, username: str, password: str = "", **extra_fields: Any
@@ -54,6 +114,10 @@ class CustomUserManager(UserManager):
             return user
 
 
+# columns written by post_entry only
+WALLET_FIELDS = ("wallet_balance", "wallet_seq")
+
+
 class User(AbstractUser, PermissionsMixin):
     """
     This class represents a user in the system.
@@ -75,10 +139,11 @@ class User(AbstractUser, PermissionsMixin):
     last_name = models.CharField(
         verbose_name=_("Last name"), max_length=30, null=True, blank=True
     )
-    wallet_balance = models.FloatField(
-        default=0.00,
-        null=True,
-        validators=[MinValueValidator(0.0)],
+    wallet_balance = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal("0.00"),
+        validators=[MinValueValidator(Decimal("0.00"))],
     )
     phone_number = PhoneNumberField(blank=True, null=True)
     profile_pic = models.ImageField(
@@ -95,11 +160,18 @@ class User(AbstractUser, PermissionsMixin):
         max_length=11, null=True, blank=True, help_text=_("User BVN Number")
     )
     reset_token = models.CharField(max_length=6, null=True, blank=True)
+    # sequence number of the latest wallet ledger entry of the user
+    wallet_seq = models.PositiveBigIntegerField(default=0, editable=False)
 
     class Meta:
         db_table = "users"
         verbose_name = _("User")
         verbose_name_plural = _("Users")
+        indexes = [
+            # login, registration and the webhooks look users up ignoring case
+            models.Index(Lower("email"), name="users_email_lower_idx"),
+            models.Index(Lower("username"), name="users_username_lower_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.username} - {self.email}"
@@ -117,51 +189,89 @@ class User(AbstractUser, PermissionsMixin):
         self.last_name = last_name
         self.save()
 
-    def _create_wallet_summary(
-        self,
-        amount: str,
+    def save(self, *args, **kwargs):
+        """Saves the user without its wallet columns
+
+        The balance and ledger sequence only move through post_entry's
+        UPDATE. Writing them back from an instance loaded earlier would
+        revert credits landed meanwhile and rewind wallet_seq onto existing
+        ledger entries, so they are saved only when update_fields names them.
+        """
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # like Model.save, columns deferred by only() are not written
+            skipped = self.get_deferred_fields().union(WALLET_FIELDS)
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def post_entry(
+        cls,
+        id,
+        kind: str,
+        amount,
         description: str,
-        previous_balance: str,
-        after_balance: str,
-        status: str,
-        order_id: str,
-    ) -> None:
-        """Create a new wallet summary instance.
+        reference: str,
+        idempotency_key: Union[str, None] = None,
+    ) -> Union["WalletLedgerEntry", None]:
+        """Moves a wallet balance and appends the matching ledger entry
+
+        The balance, the user's ledger sequence and, for debits, the funds
+        check are one conditional UPDATE. The entry is written in the same
+        transaction, a repeated idempotency_key raises IntegrityError and
+        rolls the balance change back with it.
 
         Args:
-            amount (str): amount paid or debited
-            description (str): wallet summary description
-            previous_balance (str): previous wallet balance of the user
-            after_balance (str): newly updated wallet balance of the user
-            status (str): status of the wallet summary
-            product_type (str): product type of the wallet summary
-            tran_id (str): order id
+            id (int): user's id
+            kind (str): Credit or Debit
+            amount (Union[Decimal, float, str]): positive amount
+            description (str): description
+            reference (str): order id or payment reference
+            idempotency_key (Union[str, None], optional): unique key of the
+                operation. Defaults to None.
 
         Returns:
-            None: None
+            Union[WalletLedgerEntry, None]: the entry, None when funds are low
         """
-        try:
-            WalletSummary.objects.create(
-                user=self,
+        amount = to_money(amount)
+        users = cls.objects.filter(id=id)
+        if kind == DEBIT:
+            users = users.filter(wallet_balance__gte=amount)
+            change = F("wallet_balance") - amount
+        else:
+            change = F("wallet_balance") + amount
+        with transaction.atomic():
+            if not users.update(wallet_balance=change, wallet_seq=F("wallet_seq") + 1):
+                return None
+            # the UPDATE holds the row until commit, this read is exact
+            balance, seq = cls.objects.values_list("wallet_balance", "wallet_seq").get(
+                id=id
+            )
+            return WalletLedgerEntry.objects.create(
+                user_id=id,
+                seq=seq,
+                kind=kind,
                 amount=amount,
+                balance_after=balance,
                 description=description,
-                previous_balance=previous_balance,
-                after_balance=after_balance,
-                status=status,
-                order_id=order_id,
+                reference=reference,
+                idempotency_key=idempotency_key,
             )
-        except Exception as e:
-            logger.error(e)
-            logger.error(traceback.format_exc())
 
     @classmethod
     def debit(cls, id, amount, description, order_id) -> str:
         """Debits a user
 
+        The balance check and the debit are one conditional UPDATE, so two
+        concurrent debits can never both spend the same funds and no row lock
+        is held while Python code runs.
+
         Args:
             id (int): user's id
-            amount (float): amount
-            product_type (str): product type
+            amount (Union[Decimal, float, str]): amount
             description (str): description
             order_id (str): order id
 
@@ -169,22 +279,12 @@ class User(AbstractUser, PermissionsMixin):
             str: message description
         """
         try:
-            with transaction.atomic():
-                user = cls.objects.select_for_update().get(id=id)
-                previous_balance = user.wallet_balance
-                if previous_balance < amount or amount < 0:
-                    return "Low Funds"
-                user.wallet_balance -= float(amount)
-                user._create_wallet_summary(
-                    amount=amount,
-                    description=description,
-                    previous_balance=previous_balance,
-                    after_balance=(previous_balance - float(amount)),
-                    status="Successful",
-                    order_id=order_id,
-                )
-                user.save()
-                return "Debited"
+            amount = to_money(amount)
+            if amount < 0:
+                return "Low Funds"
+            if cls.post_entry(id, DEBIT, amount, description, order_id) is None:
+                return "Low Funds"
+            return "Debited"
         except Exception as e:
             logger.error(e)
             traceback.print_exc()
@@ -197,29 +297,17 @@ class User(AbstractUser, PermissionsMixin):
 
         Args:
             id (user id): user's id
-            amount (_type_): amount to be deposited
-            product_type (_type_): product type of the deposit
-            description (_type_): description of the deposit
-            order_id (_type_): order id
+            amount (Union[Decimal, float, str]): amount to be deposited
+            description (str): description of the deposit
+            order_id (str): order id
 
         Returns:
             bool: True or False
         """
         try:
-            with transaction.atomic():
-                user = cls.objects.select_for_update().get(id=id)
-                previous_balance = user.wallet_balance
-                user.wallet_balance += float(amount)
-                user._create_wallet_summary(
-                    amount=amount,
-                    description=description,
-                    previous_balance=previous_balance,
-                    after_balance=(previous_balance + float(amount)),
-                    status="Successful",
-                    order_id=order_id,
-                )
-                user.save()
-                return True
+            if cls.post_entry(id, CREDIT, amount, description, order_id) is None:
+                raise cls.DoesNotExist(f"User {id} does not exist")
+            return True
         except Exception as e:
             logger.error(e)
             traceback.print_exc()
@@ -227,6 +315,12 @@ class User(AbstractUser, PermissionsMixin):
             return False
 
 
+# description of the ledger credits written for a successful funding
+FUNDING_DESCRIPTION = "Wallet Funding"
+
+# gateway name stored on fundings and webhook events
+MONNIFY_GATEWAY = "Monnify"
+
 statuses = (
     ("Successful", "Successful"),
     ("Pending", "Pending"),
@@ -243,24 +337,79 @@ class Funding(models.Model):
         null=True,
         related_name="funding_history",
     )
+    # unique, a redelivered notification cannot record the same payment twice
     ref = models.CharField(
-        max_length=50, null=True, blank=True, verbose_name=_("Payment Reference")
+        max_length=50,
+        null=True,
+        blank=True,
+        unique=True,
+        verbose_name=_("Payment Reference"),
+    )
+    amount = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal("0.00"), null=True, blank=True
     )
-    amount = models.FloatField(default=0.00, null=True, blank=True)
     status = models.CharField(
         max_length=50, null=True, blank=True, choices=statuses, default="Pending"
     )
-    gateway = models.CharField(max_length=50, null=True, blank=True, default="Monnify")
+    gateway = models.CharField(
+        max_length=50, null=True, blank=True, default=MONNIFY_GATEWAY
+    )
     date_created = models.DateTimeField(default=timezone.now)
 
     class Meta:
         verbose_name_plural = "Fundings  Transactions"
         verbose_name = "Funding Transaction"
+        indexes = [
+            models.Index(
+                fields=["user", "date_created"], name="funding_user_created_idx"
+            ),
+            # reconcile_pending_fundings pages through pending ones by id
+            models.Index(fields=["status", "id"], name="funding_status_id_idx"),
+        ]
 
     def __str__(self):
         return f"Funding Transaction with {self.ref} for {self.user.username}"
 
 
+webhook_statuses = (
+    ("Pending", "Pending"),
+    ("Processing", "Processing"),
+    ("Processed", "Processed"),
+    ("Ignored", "Ignored"),
+    ("Failed", "Failed"),
+)
+
+
+class WebhookEvent(models.Model):
+    """A gateway notification, stored as received and applied later"""
+
+    gateway = models.CharField(max_length=50, default=MONNIFY_GATEWAY)
+    event_type = models.CharField(max_length=100, blank=True, default="")
+    transaction_reference = models.CharField(max_length=100, db_index=True)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=20, choices=webhook_statuses, default="Pending"
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    # worker holding the event and when it took it, stale claims are retaken
+    claimed_by = models.CharField(max_length=32, blank=True, default="")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.gateway} {self.event_type} {self.transaction_reference}"
+
+    class Meta:
+        verbose_name = "Webhook Event"
+        verbose_name_plural = "Webhook Events"
+        db_table = "webhook_events"
+        indexes = [
+            models.Index(fields=["status", "id"], name="webhook_events_status_idx"),
+        ]
+
+
 status_choice = (
     ("Successful", "Successful"),
     ("Pending", "Pending"),
@@ -268,6 +417,7 @@ status_choice = (
 )
 
 
+# legacy wallet history, new movements are written to WalletLedgerEntry
 class WalletSummary(models.Model):
     user = models.ForeignKey(
         User,
@@ -303,6 +453,143 @@ class WalletSummary(models.Model):
         verbose_name = "Wallet Summary"
 
 
+CREDIT = "Credit"
+DEBIT = "Debit"
+
+ledger_kinds = (
+    (CREDIT, "Credit"),
+    (DEBIT, "Debit"),
+)
+
+
+class WalletLedgerEntry(models.Model):
+    """Append only record of every wallet movement
+
+    Entries are numbered per user without gaps, `balance_after` is the
+    wallet balance right after the entry was applied.
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.PROTECT, related_name="ledger_entries"
+    )
+    seq = models.PositiveBigIntegerField()
+    kind = models.CharField(max_length=10, choices=ledger_kinds)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=14, decimal_places=2)
+    description = models.CharField(max_length=200, blank=True, default="")
+    # order id or payment reference the entry belongs to
+    reference = models.CharField(max_length=100, blank=True, default="")
+    idempotency_key = models.CharField(
+        max_length=150, unique=True, null=True, blank=True
+    )
+    date_created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        return f"{self.user_id} #{self.seq} {self.kind} {self.amount}"
+
+    @property
+    def signed_amount(self) -> Decimal:
+        return self.amount if self.kind == CREDIT else -self.amount
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Wallet ledger entries cannot be changed")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Wallet ledger entries cannot be deleted")
+
+    class Meta:
+        verbose_name = "Wallet Ledger Entry"
+        verbose_name_plural = "Wallet Ledger Entries"
+        db_table = "wallet_ledger"
+        indexes = [
+            models.Index(
+                fields=["user", "date_created"], name="wallet_ledger_user_created_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "seq"], name="wallet_ledger_user_seq_unique"
+            ),
+        ]
+
+
+class WalletSnapshot(models.Model):
+    """Balance of a wallet once the entries up to `seq` are applied"""
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="wallet_snapshots"
+    )
+    seq = models.PositiveBigIntegerField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    date_created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        return f"{self.user_id} #{self.seq} {self.balance}"
+
+    class Meta:
+        verbose_name = "Wallet Snapshot"
+        verbose_name_plural = "Wallet Snapshots"
+        db_table = "wallet_snapshots"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "seq"], name="wallet_snapshot_user_seq_unique"
+            ),
+        ]
+
+
+class ReconciliationRun(models.Model):
+    """Progress of a wallet reconciliation, resumed from `last_user_id`"""
+
+    last_user_id = models.BigIntegerField(default=0)
+    users_checked = models.PositiveIntegerField(default=0)
+    discrepancies = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"Reconciliation {self.id} - {self.users_checked} users"
+
+    class Meta:
+        verbose_name = "Reconciliation Run"
+        verbose_name_plural = "Reconciliation Runs"
+        db_table = "reconciliation_runs"
+
+
+class WalletDiscrepancy(models.Model):
+    """Wallet whose balance does not match its ledger"""
+
+    run = models.ForeignKey(
+        ReconciliationRun, on_delete=models.CASCADE, related_name="wallet_discrepancies"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="wallet_discrepancies"
+    )
+    wallet_balance = models.DecimalField(max_digits=14, decimal_places=2)
+    expected_balance = models.DecimalField(max_digits=14, decimal_places=2)
+    wallet_seq = models.PositiveBigIntegerField()
+    ledger_seq = models.PositiveBigIntegerField()
+    date_created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        return f"{self.user_id} holds {self.wallet_balance}, expected {self.expected_balance}"
+
+    @property
+    def difference(self) -> Decimal:
+        return self.wallet_balance - self.expected_balance
+
+    class Meta:
+        verbose_name = "Wallet Discrepancy"
+        verbose_name_plural = "Wallet Discrepancies"
+        db_table = "wallet_discrepancies"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["run", "user"], name="wallet_discrepancy_run_user_unique"
+            ),
+        ]
+
+
 # Tray model another word for Cart in terms of Restaurant
 @str_meta
 class Tray(models.Model):
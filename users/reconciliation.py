@@ -0,0 +1,159 @@
+import logging
+from decimal import Decimal
+from typing import Dict, List, Tuple, Union
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from users.ledger import signed_sum
+from users.models import (
+    ReconciliationRun,
+    User,
+    WalletDiscrepancy,
+    WalletLedgerEntry,
+    WalletSnapshot,
+)
+from utils.utils import to_money
+
+logger = logging.getLogger(__name__)
+
+
+# users checked per chunk
+RECONCILE_CHUNK_SIZE = 1000
+
+ZERO = Decimal("0.00")
+
+
+def start_run(restart: bool = False) -> ReconciliationRun:
+    """Resumes the unfinished reconciliation or starts a new one"""
+    run = (
+        ReconciliationRun.objects.filter(finished_at__isnull=True).order_by("id").last()
+    )
+    if run is not None and not restart:
+        return run
+    if run is not None:
+        run.finished_at = timezone.now()
+        run.save(update_fields=["finished_at"])
+    return ReconciliationRun.objects.create()
+
+
+def _expected(first_id: int, last_id: int) -> Dict[int, Tuple[Decimal, int]]:
+    """expected balance and last ledger seq of the users in an id range"""
+    openings = dict(
+        WalletSnapshot.objects.filter(
+            seq=0, user_id__gte=first_id, user_id__lte=last_id
+        ).values_list("user_id", "balance")
+    )
+    ledger = {
+        # SQLite sums decimals as floats, round back to kobo
+        row["user_id"]: (to_money(row["total"]), row["last_seq"])
+        for row in WalletLedgerEntry.objects.filter(
+            user_id__gte=first_id, user_id__lte=last_id
+        )
+        .order_by()
+        .values("user_id")
+        .annotate(total=signed_sum(), last_seq=Max("seq"))
+    }
+    expected = {}
+    for user_id in set(openings) | set(ledger):
+        total, last_seq = ledger.get(user_id, (ZERO, 0))
+        expected[user_id] = (openings.get(user_id, ZERO) + total, last_seq)
+    return expected
+
+
+def _confirm(user_id: int) -> Union[Tuple[Decimal, Decimal, int, int], None]:
+    """rechecks one wallet with its row locked, postings may have raced the chunk"""
+    with transaction.atomic():
+        balance, wallet_seq = (
+            User.objects.select_for_update()
+            .values_list("wallet_balance", "wallet_seq")
+            .get(id=user_id)
+        )
+        expected, ledger_seq = _expected(user_id, user_id).get(user_id, (ZERO, 0))
+    if (balance, wallet_seq) == (expected, ledger_seq):
+        return None
+    return balance, expected, wallet_seq, ledger_seq
+
+
+def reconcile_chunk(
+    run: ReconciliationRun, chunk_size: int = RECONCILE_CHUNK_SIZE
+) -> int:
+    """Checks the next chunk of users and records the wallets that differ
+
+    Balances come from one query on the users and the expected values from
+    two aggregate queries over the ledger and the opening snapshots of the
+    same id range, so memory depends on the chunk size only.
+
+    Returns:
+        int: number of users checked, 0 once every user was checked
+    """
+    users = list(
+        User.objects.filter(id__gt=run.last_user_id)
+        .order_by("id")
+        .values_list("id", "wallet_balance", "wallet_seq")[:chunk_size]
+    )
+    if not users:
+        return 0
+    expected = _expected(users[0][0], users[-1][0])
+    found: List[WalletDiscrepancy] = []
+    for user_id, balance, wallet_seq in users:
+        if (balance, wallet_seq) == expected.get(user_id, (ZERO, 0)):
+            continue
+        mismatch = _confirm(user_id)
+        if mismatch is None:
+            continue
+        balance, expected_balance, wallet_seq, ledger_seq = mismatch
+        found.append(
+            WalletDiscrepancy(
+                run=run,
+                user_id=user_id,
+                wallet_balance=balance,
+                expected_balance=expected_balance,
+                wallet_seq=wallet_seq,
+                ledger_seq=ledger_seq,
+            )
+        )
+    with transaction.atomic():
+        # a chunk interrupted before this point is checked again on resume
+        WalletDiscrepancy.objects.bulk_create(found, ignore_conflicts=True)
+        run.last_user_id = users[-1][0]
+        run.users_checked += len(users)
+        run.discrepancies += len(found)
+        run.save(update_fields=["last_user_id", "users_checked", "discrepancies"])
+    for discrepancy in found:
+        logger.error(
+            f"Wallet {discrepancy.user_id} holds {discrepancy.wallet_balance}, "
+            f"ledger gives {discrepancy.expected_balance}"
+        )
+    return len(users)
+
+
+def reconcile(
+    chunk_size: int = RECONCILE_CHUNK_SIZE,
+    restart: bool = False,
+    max_chunks: Union[int, None] = None,
+) -> ReconciliationRun:
+    """Compares every wallet balance with its ledger
+
+    The expected balance of a wallet is its opening snapshot plus the signed
+    sum of its ledger entries, and its ledger seq must match the number of
+    the latest entry.
+
+    Args:
+        chunk_size (int, optional): users checked per chunk.
+        restart (bool, optional): drop the unfinished run instead of
+            resuming it. Defaults to False.
+        max_chunks (Union[int, None], optional): stop after this many chunks,
+            the next call resumes. Defaults to None.
+
+    Returns:
+        ReconciliationRun: the run, finished unless max_chunks was hit
+    """
+    run = start_run(restart)
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        if not reconcile_chunk(run, chunk_size):
+            run.finished_at = timezone.now()
+            run.save(update_fields=["finished_at"])
+            break
+        chunks += 1
+    return run
@@ -29,6 +29,8 @@ class UserSerializer(ModelSerializer):
             "phone_number",
             "email_verified",
         )
+        # validate() checks the username ignoring case along with the email
+        extra_kwargs = {"username": {"validators": []}}
 
     def validate_password1(self, password1):
         """Validate user's inputed password on signup
@@ -62,9 +64,10 @@ class UserSerializer(ModelSerializer):
         username = data.get("username")
         password1 = data.get("password1")
         password2 = data.get("password2")
-        if User.objects.filter(email__iexact=email):
+        taken = User.objects.taken(email, username)
+        if "email" in taken:
             raise ValidationException(_("The email address is already in use"))
-        if User.objects.filter(username__iexact=username):
+        if "username" in taken:
             raise ValidationException(_("Username is taken!"))
         if password1 != password2:
             errors["password1"] = _("The two passwords do not match")
@@ -96,14 +99,14 @@ class LoginSerializer(ModelSerializer):
         password = attrs.get("password")
         username = attrs.get("username")
         if email:
-            user = User.objects.filter(email__iexact=email).first()
+            user = User.objects.with_email(email).first()
             if user and user.check_password(password):
                 attrs["user"] = user
                 return attrs
             else:
                 raise serializers.ValidationError({"error": "Invalid credentials"})
         else:
-            user = User.objects.filter(username__iexact=username).first()
+            user = User.objects.with_username(username).first()
             if user and user.check_password(password):
                 attrs["user"] = user
                 return attrs
@@ -176,3 +179,19 @@ class AddressSerializer(serializers.HyperlinkedModelSerializer):
         request = self.context.get("request")
         base_url = request.build_absolute_uri("/")[:-1]
         return f"{base_url}/users_addresses/{obj.pk}/"
+
+
+class WalletHistorySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    type = serializers.CharField()
+    # numbers rather than the default strings, clients chart them
+    amount = serializers.DecimalField(
+        max_digits=14, decimal_places=2, coerce_to_string=False
+    )
+    status = serializers.CharField()
+    description = serializers.CharField()
+    reference = serializers.CharField(allow_null=True)
+    balance_after = serializers.DecimalField(
+        max_digits=14, decimal_places=2, coerce_to_string=False, allow_null=True
+    )
+    date_created = serializers.DateTimeField()
@@ -1,12 +1,41 @@
+import hashlib
+import hmac
+import json
 import pytest
+import threading
+import time
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connections
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
 from unittest import mock
-from rest_framework.test import APIRequestFactory
+from rest_framework.test import APIClient, APIRequestFactory
 from .views import CreateUserAPIView
 from .serializers import UserSerializer
 from utils.utils import send_otp
-from utils.exceptions import handle_internal_server_exception
+from utils.exceptions import ValidationException, handle_internal_server_exception
 from django.core.cache import cache
-from .models import User
+from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import snapshot_key
+from .bulk_credit import bulk_credit, read_rows
+from .ledger import audit, compact, current_balance
+from .models import (
+    CREDIT,
+    Funding,
+    User,
+    WalletDiscrepancy,
+    WalletLedgerEntry,
+    WalletSnapshot,
+    WebhookEvent,
+)
+from .fundings import reconcile_pending_fundings
+from .reconciliation import reconcile
+from .webhooks import credit_funding, process_pending, record_event
+from utils import monnify
+from utils.monnify_stub import stub_server
 from utils.response import service_response
 
 
@@ -45,3 +74,485 @@ def test_post_valid_data(request_factory, user_data, mocker):
     response = view(request)
     assert response.status_code == 201
     assert "Registration Successful" in response.data.get("message")
+
+
+@pytest.fixture
+def wallet_user():
+    return User.objects.create_user(
+        username="wallet",
+        password="12345",
+        email="wallet@test.com",
+        wallet_balance=Decimal("0.30"),
+    )
+
+
+@pytest.mark.django_db
+def test_wallet_arithmetic_is_exact(wallet_user):
+    assert User.deposit(wallet_user.id, 0.1, "Wallet Funding", "REF1")
+    assert User.debit(wallet_user.id, 0.2, "Food Purchase", "ORDER1") == "Debited"
+    assert User.debit(wallet_user.id, "0.20", "Food Purchase", "ORDER2") == "Debited"
+
+    wallet_user.refresh_from_db()
+    assert wallet_user.wallet_balance == Decimal("0.00")
+    entry = WalletLedgerEntry.objects.get(reference="ORDER2")
+    assert (entry.seq, entry.kind, entry.balance_after) == (3, "Debit", Decimal("0.00"))
+
+
+@pytest.mark.django_db
+def test_debit_refuses_overdraft_without_saving_the_row(wallet_user):
+    stale = User.objects.get(id=wallet_user.id)
+    User.objects.filter(id=wallet_user.id).update(first_name="Ada")
+
+    assert User.debit(wallet_user.id, "0.31", "Food Purchase", "ORDER1") == "Low Funds"
+    assert User.debit(wallet_user.id, "-1", "Food Purchase", "ORDER2") == "Low Funds"
+    assert stale.debit(stale.id, "0.30", "Food Purchase", "ORDER3") == "Debited"
+
+    wallet_user.refresh_from_db()
+    # only the balance column is written, other changes survive
+    assert wallet_user.first_name == "Ada"
+    assert wallet_user.wallet_balance == Decimal("0.00")
+    assert WalletLedgerEntry.objects.filter(user=wallet_user).count() == 1
+
+
+@pytest.mark.django_db
+def test_saving_a_stale_user_keeps_the_wallet_columns(wallet_user):
+    stale = User.objects.get(id=wallet_user.id)
+    assert User.deposit(wallet_user.id, "1.00", "Wallet Funding", "REF1")
+
+    stale.first_name = "Ada"
+    stale.save()
+    assert User.deposit(wallet_user.id, "1.00", "Wallet Funding", "REF2")
+
+    wallet_user.refresh_from_db()
+    assert wallet_user.first_name == "Ada"
+    assert (wallet_user.wallet_balance, wallet_user.wallet_seq) == (Decimal("2.30"), 2)
+
+
+@pytest.mark.django_db
+def test_ledger_snapshots_and_replay(wallet_user, settings):
+    settings.WALLET_SNAPSHOT_EVERY = 3
+    for index in range(4):
+        User.deposit(wallet_user.id, "1.00", "Wallet Funding", f"REF{index}")
+    User.debit(wallet_user.id, "0.50", "Food Purchase", "ORDER1")
+
+    written, mismatched = compact()
+    # opening balance at seq 0, then one at the latest entry
+    assert (written, mismatched) == (2, [])
+    assert list(
+        WalletSnapshot.objects.filter(user=wallet_user).values_list("seq", "balance")
+    ) == [(0, Decimal("0.30")), (5, Decimal("3.80"))]
+    User.deposit(wallet_user.id, "0.20", "Wallet Funding", "REF9")
+    assert compact() == (0, [])
+    assert current_balance(wallet_user.id) == Decimal("4.00")
+    assert audit(wallet_user.id) == []
+
+    User.objects.filter(id=wallet_user.id).update(wallet_balance=Decimal("9.00"))
+    assert audit(wallet_user.id) == ["wallet holds 9.00, replay gives 4.00"]
+    with pytest.raises(ValueError):
+        WalletLedgerEntry.objects.first().delete()
+
+
+@pytest.mark.django_db
+def test_wallet_history_merges_ledger_and_fundings(
+    wallet_user, django_assert_num_queries
+):
+    User.deposit(wallet_user.id, "5.00", "Wallet Funding", "FUND1")
+    Funding.objects.create(
+        user=wallet_user, ref="FUND1", amount="5.00", status="Successful"
+    )
+    for index in range(3):
+        User.debit(wallet_user.id, "1.00", "Food Purchase", f"ORDER{index}")
+    Funding.objects.create(user=wallet_user, ref="FUND2", amount="2.50")
+    client = APIClient()
+    client.force_authenticate(user=wallet_user)
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        # the authenticated user is forced, one query per source
+        with django_assert_num_queries(2):
+            response = client.get("/api/v1/wallet/history", params)
+        assert response.status_code == 200
+        pages.append(response.data["data"]["transactions"])
+        cursor = response.data["data"]["next_cursor"]
+        if cursor is None:
+            break
+
+    rows = [row for page in pages for row in page]
+    assert [row["reference"] for row in rows] == [
+        "FUND2",
+        "ORDER2",
+        "ORDER1",
+        "ORDER0",
+        "FUND1",
+    ]
+    assert rows[0]["type"] == "funding" and rows[0]["status"] == "Pending"
+    assert rows[1]["amount"] == Decimal("1.00")
+    assert rows[1]["balance_after"] == Decimal("2.30")
+    response = client.get("/api/v1/wallet/history", {"cursor": "bad"})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_bulk_credit_is_set_based_and_idempotent(
+    wallet_user, django_assert_num_queries
+):
+    other = User.objects.create_user(
+        username="other", password="12345", email="other@test.com"
+    )
+    lines = [
+        "user_id,amount,reference",
+        f"{wallet_user.id},1.00,PROMO-1",
+        f"{other.id},2.50,PROMO-2",
+        f"{wallet_user.id},0.70,PROMO-3",
+        f"{wallet_user.id},0.70,PROMO-3",
+        "999999,1.00,PROMO-4",
+        f"{other.id},abc,PROMO-5",
+    ]
+
+    # savepoint, existing keys, users, balance update, read back, entry insert
+    # and release, whatever the number of rows in the chunk
+    with django_assert_num_queries(7):
+        report = bulk_credit(read_rows(lines), description="Promo")
+
+    assert (report.credited, report.amount, report.duplicates) == (
+        3,
+        Decimal("4.20"),
+        1,
+    )
+    assert [reference for reference, _ in report.failures] == ["PROMO-5", "PROMO-4"]
+    wallet_user.refresh_from_db()
+    assert (wallet_user.wallet_balance, wallet_user.wallet_seq) == (Decimal("2.00"), 2)
+    assert audit(other.id) == []
+    assert list(
+        WalletLedgerEntry.objects.filter(user=wallet_user)
+        .order_by("seq")
+        .values_list("seq", "balance_after")
+    ) == [(1, Decimal("1.30")), (2, Decimal("2.00"))]
+
+    again = bulk_credit(read_rows(lines))
+    assert (again.credited, again.duplicates) == (0, 4)
+    assert User.objects.get(id=other.id).wallet_balance == Decimal("2.50")
+
+
+@pytest.mark.django_db
+def test_bulk_credit_endpoint_and_command(wallet_user, tmp_path):
+    staff = User.objects.create_user(
+        username="ops", password="12345", email="ops@test.com", is_staff=True
+    )
+    client = APIClient()
+    client.force_authenticate(user=staff)
+    upload = SimpleUploadedFile(
+        "credits.csv", f"{wallet_user.id},1.00,REFUND-1\n".encode(), "text/csv"
+    )
+    response = client.post("/api/v1/wallet/bulk-credit", {"file": upload})
+    assert response.status_code == 200
+    assert response.data["data"]["credited"] == 1
+
+    path = tmp_path / "credits.csv"
+    path.write_text(f"{wallet_user.id},1.00,REFUND-1\n{wallet_user.id},2,REFUND-2\n")
+    output = StringIO()
+    call_command("bulk_credit_wallets", str(path), stdout=output)
+    assert "Credited 1 wallets with 2.00" in output.getvalue()
+    assert "1 already applied" in output.getvalue()
+    assert User.objects.get(id=wallet_user.id).wallet_balance == Decimal("3.30")
+
+    client.force_authenticate(user=wallet_user)
+    assert client.post("/api/v1/wallet/bulk-credit").status_code == 403
+
+
+@pytest.mark.django_db
+def test_reconciliation_finds_drift_and_resumes(wallet_user):
+    other = User.objects.create_user(
+        username="other", password="12345", email="other@test.com"
+    )
+    User.deposit(wallet_user.id, "1.00", "Wallet Funding", "REF1")
+    User.deposit(other.id, "2.00", "Wallet Funding", "REF2")
+    User.debit(other.id, "0.50", "Food Purchase", "ORDER1")
+    # the 0.30 held before the ledger becomes the opening snapshot
+    compact()
+    User.objects.filter(id=other.id).update(wallet_balance=Decimal("5.00"))
+
+    run = reconcile(chunk_size=1, max_chunks=1)
+    assert (run.users_checked, run.discrepancies, run.finished_at) == (1, 0, None)
+    resumed = reconcile(chunk_size=1)
+    assert resumed.id == run.id
+    assert (resumed.users_checked, resumed.discrepancies) == (2, 1)
+    assert resumed.finished_at is not None
+
+    discrepancy = WalletDiscrepancy.objects.get(run=run)
+    assert discrepancy.user_id == other.id
+    assert discrepancy.difference == Decimal("3.50")
+    assert (discrepancy.wallet_seq, discrepancy.ledger_seq) == (2, 2)
+
+    output = StringIO()
+    call_command("reconcile_wallets", stdout=output)
+    assert "2 wallets checked, 1 discrepancies" in output.getvalue()
+
+
+def _signed_webhook(client, payload, secret="webhook-secret"):
+    body = json.dumps(payload).encode()
+    signature = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+    return client.post(
+        "/api/v1/funding/webhook",
+        body,
+        content_type="application/json",
+        HTTP_MONNIFY_SIGNATURE=signature,
+    )
+
+
+def _paid_event(reference, email):
+    return {
+        "eventType": "SUCCESSFUL_TRANSACTION",
+        "eventData": {
+            "transactionReference": reference,
+            "customer": {"email": email},
+        },
+    }
+
+
+@pytest.mark.django_db
+def test_webhook_is_stored_and_acknowledged_without_gateway_calls(
+    wallet_user, monkeypatch
+):
+    monkeypatch.setenv("MONNIFY_SECRET_KEY_RG", "webhook-secret")
+    monkeypatch.setattr("users.views.machine", "local")
+    client = APIClient()
+
+    with mock.patch("utils.monnify.get_transaction") as lookup:
+        response = _signed_webhook(client, _paid_event("MNFY|1", wallet_user.email))
+        forged = _signed_webhook(client, _paid_event("MNFY|2", "x@y.z"), "guess")
+
+    assert response.status_code == 200
+    assert forged.status_code == 403
+    lookup.assert_not_called()
+    event = WebhookEvent.objects.get()
+    assert (event.transaction_reference, event.status) == ("MNFY|1", "Pending")
+
+
+@pytest.mark.django_db
+def test_webhook_worker_loop_refreshes_stale_connections():
+    stop = KeyboardInterrupt()
+    with mock.patch(
+        "users.management.commands.process_webhook_events.close_old_connections"
+    ) as refresh, mock.patch("time.sleep", side_effect=[None, stop]):
+        with pytest.raises(KeyboardInterrupt):
+            call_command("process_webhook_events", loop=1, stdout=StringIO())
+
+    assert refresh.call_count == 2
+
+
+@pytest.mark.django_db
+def test_webhook_events_are_verified_and_applied_once(wallet_user, settings):
+    with stub_server() as stub:
+        settings.MONNIFY_BASE_URL = stub.base_url
+        monnify.reset_session()
+        stub.pay("MNFY|PAID", 1000)
+        stub.transactions["MNFY|OPEN"] = {
+            "transactionReference": "MNFY|OPEN",
+            "paymentStatus": "PENDING",
+        }
+        record_event(_paid_event("MNFY|PAID", wallet_user.email))
+        record_event(_paid_event("MNFY|PAID", wallet_user.email))
+        record_event(_paid_event("MNFY|OPEN", wallet_user.email))
+        record_event(_paid_event("MNFY|GONE", wallet_user.email))
+
+        counts = process_pending(workers=1)
+    monnify.reset_session()
+
+    # the unknown reference is a gateway 404, retried by the next run
+    assert counts == {"Processed": 2, "Ignored": 1, "Pending": 1, "Failed": 0}
+    assert User.objects.get(id=wallet_user.id).wallet_balance == Decimal("995.30")
+    paid = Funding.objects.get(ref="MNFY|PAID")
+    assert (paid.amount, paid.gateway) == (Decimal("995.00"), "Monnify")
+    assert set(WebhookEvent.objects.values_list("gateway", flat=True)) == {"Monnify"}
+    gone = WebhookEvent.objects.get(transaction_reference="MNFY|GONE")
+    assert (gone.status, gone.attempts) == ("Pending", 1)
+    assert process_pending(workers=1)["Pending"] == 1
+
+
+@pytest.mark.django_db
+def test_open_gateway_circuit_keeps_events_pending_without_an_attempt(
+    wallet_user, settings
+):
+    breaker = monnify.get_breaker()
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    record_event(_paid_event("MNFY|PAID", wallet_user.email))
+
+    try:
+        counts = process_pending(workers=1)
+    finally:
+        breaker.reset()
+
+    assert counts["Pending"] == 1
+    event = WebhookEvent.objects.get()
+    assert (event.status, event.attempts) == ("Pending", 0)
+    assert event.last_error.startswith("Payment gateway unavailable")
+
+
+@pytest.mark.django_db
+def test_pending_fundings_are_reconciled_with_the_gateway(wallet_user, settings):
+    settings.FUNDING_RECONCILE_AFTER = 0
+    client = APIClient()
+    client.force_authenticate(user=wallet_user)
+    with stub_server() as stub:
+        settings.MONNIFY_BASE_URL = stub.base_url
+        monnify.reset_session()
+        paid, expired, stale, waiting = [
+            client.post(
+                "/api/v1/funding/transfer", {"amount": 1000}, format="json"
+            ).data["data"]["tran_ref"]
+            for _ in range(4)
+        ]
+        stub.pay(paid, 1000)
+        stub.transactions[expired]["paymentStatus"] = "EXPIRED"
+        Funding.objects.filter(ref=stale).update(
+            date_created=timezone.now() - timedelta(days=2)
+        )
+        # the funding belongs to the user, not to the email they paid with
+        User.objects.filter(id=wallet_user.id).update(email="moved@test.com")
+
+        counts = reconcile_pending_fundings(batch_size=2, concurrency=2)
+        again = reconcile_pending_fundings()
+        # the lost webhook turns up after all
+        record_event(_paid_event(paid, "moved@test.com"))
+        process_pending(workers=1)
+    monnify.reset_session()
+
+    assert counts == {"Successful": 1, "Rejected": 2, "Pending": 1}
+    assert again == {"Successful": 0, "Rejected": 0, "Pending": 1}
+    assert dict(Funding.objects.values_list("ref", "status")) == {
+        paid: "Successful",
+        expired: "Rejected",
+        stale: "Rejected",
+        waiting: "Pending",
+    }
+    assert Funding.objects.get(ref=paid).amount == Decimal("995.00")
+    assert User.objects.get(id=wallet_user.id).wallet_balance == Decimal("995.30")
+
+
+@pytest.mark.django_db
+def test_late_webhook_settles_a_rejected_funding(wallet_user, settings):
+    settings.FUNDING_RECONCILE_AFTER = 0
+    settings.FUNDING_EXPIRY = 0
+    client = APIClient()
+    client.force_authenticate(user=wallet_user)
+    with stub_server() as stub:
+        settings.MONNIFY_BASE_URL = stub.base_url
+        monnify.reset_session()
+        ref = client.post(
+            "/api/v1/funding/transfer", {"amount": 1000}, format="json"
+        ).data["data"]["tran_ref"]
+        assert reconcile_pending_fundings() == {
+            "Successful": 0,
+            "Rejected": 1,
+            "Pending": 0,
+        }
+        # paid after the funding expired
+        stub.pay(ref, 1000)
+        record_event(_paid_event(ref, wallet_user.email))
+        process_pending(workers=1)
+        record_event(_paid_event(ref, wallet_user.email))
+        process_pending(workers=1)
+    monnify.reset_session()
+
+    assert Funding.objects.get(ref=ref).status == "Successful"
+    assert User.objects.get(id=wallet_user.id).wallet_balance == Decimal("995.30")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_redeliveries_credit_once(settings):
+    user = User.objects.create_user(
+        username="payer", password="12345", email="payer@test.com"
+    )
+    replays = 50
+    start = threading.Barrier(replays)
+    results = []
+
+    def replay() -> None:
+        try:
+            start.wait()
+            while True:
+                try:
+                    results.append(credit_funding(user.id, "MNFY|DUP", Decimal("1000")))
+                    return
+                except OperationalError:
+                    # SQLite locks the whole database, wait for the writer
+                    time.sleep(0.01)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=replay) for _ in range(replays)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False] * (replays - 1) + [True]
+    assert Funding.objects.filter(ref="MNFY|DUP").count() == 1
+    assert WalletLedgerEntry.objects.filter(user=user).count() == 1
+    assert User.objects.get(id=user.id).wallet_balance == Decimal("995.00")
+
+
+@pytest.mark.django_db
+def test_jwt_user_snapshot_is_cached_until_the_user_changes(
+    wallet_user, django_assert_num_queries
+):
+    token = RefreshToken.for_user(wallet_user).access_token
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    client.get("/api/v1/wallet")
+    User.post_entry(wallet_user.id, CREDIT, Decimal("10.00"), "Test", "T1")
+
+    # the snapshot answers authentication, the balance is still read fresh
+    with django_assert_num_queries(1):
+        response = client.get("/api/v1/wallet")
+    assert response.data["data"]["wallet_balance"] == Decimal("10.30")
+
+    wallet_user.set_password("changed")
+    wallet_user.save()
+    assert cache.get(snapshot_key(wallet_user.id)) is None
+
+    wallet_user.is_active = False
+    wallet_user.save(update_fields=["is_active"])
+    assert client.get("/api/v1/wallet").status_code == 401
+
+
+@pytest.mark.django_db
+def test_jwt_user_snapshot_is_dropped_by_queryset_updates(
+    wallet_user, django_capture_on_commit_callbacks
+):
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(wallet_user).access_token}"
+    )
+    assert client.get("/api/v1/wallet").status_code == 200
+
+    # wallet postings leave the snapshot alone
+    User.post_entry(wallet_user.id, CREDIT, Decimal("1.00"), "Test", "T1")
+    assert cache.get(snapshot_key(wallet_user.id)) is not None
+
+    with django_capture_on_commit_callbacks(execute=True):
+        User.objects.filter(id=wallet_user.id).update(is_active=False)
+    assert client.get("/api/v1/wallet").status_code == 401
+
+
+@pytest.mark.django_db
+def test_identity_lookups_ignore_case_through_the_lower_indexes(
+    user_data, django_assert_num_queries
+):
+    user = User.objects.create_user(
+        username="TestUser", password="12345", email="TrueBone002@Gmail.com"
+    )
+
+    with django_assert_num_queries(1):
+        with pytest.raises(ValidationException, match="email address"):
+            UserSerializer(data=user_data).is_valid()
+    assert User.objects.taken("other@test.com", "TESTUSER") == {"username"}
+    assert User.objects.taken("other@test.com", "other") == set()
+
+    assert User.objects.with_email("truebone002@gmail.com").get() == user
+    assert User.objects.with_username(None).first() is None
+    plan = User.objects.with_email(user_data["email"]).explain()
+    assert "users_email_lower_idx" in plan
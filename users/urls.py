@@ -1,10 +1,14 @@
+from django.conf import settings
 from django.urls import path, include
 from .views import (
     AddressViewSet,
     CreateUserAPIView,
     MonnifyCardChargeAPIView,
+    MonnifyCardChargeView,
     MonnifyPaymentWebhook,
     MonnifyTransferAPIView,
+    MonnifyTransferView,
+    PaymentGatewayStatusAPIView,
     UserViewSet,
     VerifyOTP,
     ResendOTP,
@@ -14,6 +18,8 @@ from .views import (
     ChangePasswordView,
     UpdatePasswordView,
     status,
+    WalletBulkCreditView,
+    WalletHistoryView,
     WalletView,
 )
 from rest_framework_simplejwt.views import (
@@ -96,6 +102,13 @@ decorated_refresh = swagger_auto_schema(
     },
 )(TokenRefreshView.as_view())
 
+if settings.MONNIFY_ASYNC:
+    card_funding_view = MonnifyCardChargeView.as_view()
+    transfer_funding_view = MonnifyTransferView.as_view()
+else:
+    card_funding_view = MonnifyCardChargeAPIView.as_view()
+    transfer_funding_view = MonnifyTransferAPIView.as_view()
+
 urlpatterns = [
     path("register", CreateUserAPIView.as_view(), name="register"),
     path("otp/verify", VerifyOTP.as_view(), name="verify-otp"),
@@ -110,9 +123,18 @@ urlpatterns = [
         UpdatePasswordView.as_view(),
         name="Update-Authenticated-user-password",
     ),
-    path("funding/card", MonnifyCardChargeAPIView.as_view(), name="funding-card"),
-    path("funding/transfer", MonnifyTransferAPIView.as_view(), name="funding-tranfer"),
+    path("funding/card", card_funding_view, name="funding-card"),
+    path("funding/transfer", transfer_funding_view, name="funding-tranfer"),
     path("funding/webhook", MonnifyPaymentWebhook.as_view(), name="funding-webhook"),
+    path(
+        "funding/gateway",
+        PaymentGatewayStatusAPIView.as_view(),
+        name="funding-gateway",
+    ),
     path("", include(router.urls)),
     path("wallet", WalletView.as_view(), name="wallet"),
+    path("wallet/history", WalletHistoryView.as_view(), name="wallet-history"),
+    path(
+        "wallet/bulk-credit", WalletBulkCreditView.as_view(), name="wallet-bulk-credit"
+    ),
 ]
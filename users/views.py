@@ -1,6 +1,9 @@
 import hmac
+import io
 import json
-from typing import Union
+import math
+from typing import List, Union
+from asgiref.sync import sync_to_async
 from django.db import IntegrityError
 from django.http import HttpResponse, HttpResponseForbidden
 from django.utils.translation import gettext_lazy as _
@@ -13,31 +16,39 @@ from .serializers import (
     UserSerializer,
     ChangePasswordSerializer,
     UpdatePasswordSerializer,
+    WalletHistorySerializer,
 )
 from django.core.cache import cache
-from utils.exceptions import handle_internal_server_exception
-from utils.response import service_response
+from utils.auth import AsyncAuthenticatedView
+from utils.exceptions import (
+    handle_internal_server_exception,
+    handle_internal_server_exception_json,
+)
+from utils.response import json_response, service_response
 from drf_yasg.utils import swagger_auto_schema
-from .models import DeliveryAddress, Tray, User, Funding
+from .models import DeliveryAddress, Tray, User
+from .bulk_credit import bulk_credit, read_rows
+from .history import wallet_history
+from .fundings import open_funding
+from .webhooks import record_event
 from drf_yasg import openapi
 from .swagger_serializer import ResponseSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 from datetime import datetime
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 import logging
 import traceback
 import os
-import requests
-from requests.auth import HTTPBasicAuth
 import uuid
 import hashlib
-import urllib.parse
 from dotenv import load_dotenv
 from rest_framework import viewsets
 from utils.serializers import serialize_model
 from rest_framework.exceptions import MethodNotAllowed
 from utils.exceptions import ValidationException
+from utils import monnify, monnify_async
+from utils.pagination import get_page_size
 
 load_dotenv()
 
@@ -47,12 +58,6 @@ logger = logging.getLogger(__name__)
 
 machine = os.getenv("MACHINE")
 
-base_url = os.getenv("MONNIFY_BASE_URL_RG")
-api_key = os.getenv("MONNIFY_API_KEY_RG")
-secret_key = os.getenv("MONNIFY_SECRET_KEY_RG")
-contract_code = os.getenv("MONNIFY_CONTRACT_CODE_RG")
-auth_url = f"{base_url}/api/v1/auth/login"
-
 
 class CreateUserAPIView(APIView):
     """
@@ -162,7 +167,7 @@ class ResendOTP(APIView):
         try:
             email: Union[str, None] = request.data.get("email")
             # find the user by email
-            user: User = User.objects.get(email__iexact=email)
+            user: User = User.objects.with_email(email).get()
             username = user.username
             # send the otp to the email
             otp = send_otp(email, username)
@@ -397,55 +402,115 @@ class UpdatePasswordView(APIView):
             return handle_internal_server_exception()
 
 
-class MonnifyCardChargeAPIView(APIView):
-    """Charge User with their card details through monnify"""
+def is_americanexpress(card_number: str) -> bool:
+    """checks if card is american express type
 
-    permission_classes = (IsAuthenticated,)
+    Args:
+        card_number (str): card number
+
+    Returns:
+        bool: True or false
+    """
+    if card_number.startswith("37") or card_number.startswith("34"):
+        return True
+    return False
 
-    def post(self, request, *args, **kwargs):
-        """Charge user with card details"""
 
-        def is_americanexpress(card_number: str) -> bool:
-            """checks if card is american express type
+def is_luhns_valid(card_number: str) -> bool:
+    """Luhns Algorithm to validate card number
 
-            Args:
-                card_number (str): card number
+    Args:
+        card_number (str): card number
 
-            Returns:
-                bool: True or false
-            """
-            if card_number.startswith("37") or card_number.startswith("34"):
-                return True
+    Returns:
+        bool: True or false
+    """
+    try:
+        if not (16 <= len(card_number) <= 19):
             return False
+        # convert to digitis
+        digits = list(map(int, card_number[::-1]))
+        total_sum = 0
+        for i, digit in enumerate(digits):
+            if i % 2 == 1:
+                digit *= 2
+                if digit > 9:
+                    digit -= 9
+            total_sum += digit
+        return total_sum % 10 == 0
+
+    except Exception as e:
+        logger.error(f"{e}")
+        traceback.print_exc()
+        return False
+
+
+def card_error(
+    card_number: str, cvv: str, expiry_month: str, expiry_year: str
+) -> Union[str, None]:
+    """Checks card details before they are sent to monnify
+
+    Returns:
+        Union[str, None]: the error message, None for a valid card
+    """
+    card_date = datetime(int(expiry_year), int(expiry_month), 1)
+    # bypass validation for dev mode
+    if machine == "local":
+        return None
+    if card_date < datetime.now():
+        return "Card has Expired"
+    if len(cvv) != (4 if is_americanexpress(card_number) else 3):
+        return "Invalid CVV"
+    if not is_luhns_valid(card_number):
+        return "Invalid Card Number"
+    return None
+
+
+def funding_request(
+    user, amount, payment_methods: List[str]
+) -> monnify.TransactionRequest:
+    """wallet funding transaction of a user"""
+    return monnify.TransactionRequest(
+        amount=amount,
+        customer_name=f"{user.username}",
+        customer_email=f"{user.email}",
+        payment_reference=str(uuid.uuid4())[:8],
+        payment_description=f"Restaurant Go Wallet Funding by {user.username} at {datetime.now()}",
+        payment_methods=payment_methods,
+    )
 
-        def is_luhns_valid(card_number: str) -> bool:
-            """Luhns Algorithm to validate card number
 
-            Args:
-                card_number (str): card number
+def transfer_details(account: monnify.TransferAccount) -> dict:
+    """account details the customer pays a wallet funding into"""
+    # 0.5% charge fee
+    fee = round(float(account.amount) * 0.005)
+    return {
+        "account_number": account.account_number,
+        "account_name": account.account_name,
+        "bank_name": account.bank_name,
+        "bank_code": account.bank_code,
+        "charges_fee": fee,
+        "expiry_time": account.expires_on,
+        "ussd": account.ussd,
+        "tran_ref": account.transaction_reference,
+        "amount": account.amount,
+    }
 
-            Returns:
-                bool: True or false
-            """
-            try:
-                if not (16 <= len(card_number) <= 19):
-                    return False
-                # convert to digitis
-                digits = list(map(int, card_number[::-1]))
-                total_sum = 0
-                for i, digit in enumerate(digits):
-                    if i % 2 == 1:
-                        digit *= 2
-                        if digit > 9:
-                            digit -= 9
-                    total_sum += digit
-                return total_sum % 10 == 0
-
-            except Exception as e:
-                logger.error(f"{e}")
-                traceback.print_exc()
-                return False
 
+def gateway_unavailable(error: monnify.GatewayUnavailable, respond=service_response):
+    """503 telling the client when to try again, the gateway circuit is open"""
+    response = respond(status="error", message=error.message, status_code=503)
+    response["Retry-After"] = str(math.ceil(error.retry_after))
+    return response
+
+
+class MonnifyCardChargeAPIView(APIView):
+    """Charge User with their card details through monnify"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        """Charge user with card details"""
         try:
             card_number = request.data.get("card_number")
             expiry_month = request.data.get("expiry_month")
@@ -454,97 +519,36 @@ class MonnifyCardChargeAPIView(APIView):
             cvv = request.data.get("cvv")
             user = request.user
             amount = request.data.get("amount")
-            card_date = datetime(int(expiry_year), int(expiry_month), 1)
-            today = datetime.now()
-            # bypass validation for dev mode
-            if machine != "local":
-                if card_date < today:
-                    return service_response(
-                        status="error", message="Card has Expired", status_code=400
-                    )
-                is_express = is_americanexpress(card_number)
-                is_luhn_valid = is_luhns_valid(card_number)
-                if is_express:
-                    if len(cvv) != 4:
-                        return service_response(
-                            status="error", message="Invalid CVV", status_code=400
-                        )
-                else:
-                    if len(cvv) != 3:
-                        return service_response(
-                            status="error", message="Invalid CVV", status_code=400
-                        )
-                if not is_luhn_valid:
-                    return service_response(
-                        status="error", message="Invalid Card Number", status_code=400
-                    )
-                # monnify card charge
+            error = card_error(card_number, cvv, expiry_month, expiry_year)
+            if error:
+                return service_response(status="error", message=error, status_code=400)
+            # monnify card charge
             if amount:
-                response = requests.post(
-                    auth_url, auth=HTTPBasicAuth(f"{api_key}", f"{secret_key}")
+                transaction = monnify.init_transaction(
+                    funding_request(user, amount, ["CARD"])
                 )
-                token = response.json()["responseBody"]["accessToken"]
-
-                referrence_id = str(uuid.uuid4())[:8]
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": "Bearer {}".format(token),
-                }
-                body = {
-                    "amount": float(amount),
-                    "customerName": f"{user.username}",
-                    "customerEmail": f"{user.email}",
-                    "paymentReference": f"{referrence_id}",
-                    "paymentDescription": f"Restaurant Go Wallet Funding by {user.username} at {datetime.now()}",
-                    "currencyCode": "NGN",
-                    "contractCode": f"{contract_code}",
-                    # "redirectUrl": f"{redirect_url}",
-                    "paymentMethods": ["CARD"],
-                }
-                data = json.dumps(body)
-                url = f"{base_url}/api/v1/merchant/transactions/init-transaction"
-                response = requests.post(url, headers=headers, data=data)
-                res = response.json()
-                print(res)
-                tran_ref = res["responseBody"]["transactionReference"]
-                init_tran_url = f"{base_url}/api/v1/merchant/cards/charge"
-                charge_body = {
-                    "transactionReference": tran_ref,
-                    "collectionChannel": "API_NOTIFICATION",
-                    "card": {
-                        "number": card_number,
-                        "expiryMonth": expiry_month,
-                        "expiryYear": expiry_year,
-                        "pin": pin,
-                        "cvv": cvv,
-                    },
-                }
-                charge_data = json.dumps(charge_body)
-                payment_response = requests.post(
-                    init_tran_url, data=charge_data, headers=headers
+                charge = monnify.charge_card(
+                    transaction.transaction_reference,
+                    monnify.Card(card_number, expiry_month, expiry_year, pin, cvv),
                 )
-                res = payment_response.json()
-                print(res)
-                req_success = res.get("requestSuccessful")
-                res_message = res.get("responseMessage")
-                if req_success and res_message == "success":
-                    res_body = res.get("responseBody")
-                    if res_body["status"] == "SUCCESS":
-                        response = {
-                            "status": "success",
-                            "message": "Card Charge Successful",
-                            "data": res_body,
-                        }
-                        return service_response(
-                            status="success",
-                            message="Card Charge Successful",
-                            data=res_body,
-                            status_code=200,
-                        )
+                if charge.successful:
+                    return service_response(
+                        status="success",
+                        message="Card Charge Successful",
+                        data=charge.body,
+                        status_code=200,
+                    )
                 return service_response(
                     status="error", message="Card Charge Failed", status_code=400
                 )
 
+        except monnify.GatewayUnavailable as e:
+            return gateway_unavailable(e)
+        except monnify.MonnifyError as e:
+            logger.error(f"Card charge failed due to {e.message}")
+            return service_response(
+                status="error", message="Card Charge Failed", status_code=502
+            )
         except Exception:
             return handle_internal_server_exception()
 
@@ -555,78 +559,132 @@ class MonnifyTransferAPIView(APIView):
     def post(self, request, *args, **kwargs):
         try:
             user = request.user
-            print(user)
-            data = request.data
-            amount = data.get("amount")
+            amount = request.data.get("amount")
             if amount:
-                response = requests.post(
-                    auth_url, auth=HTTPBasicAuth(f"{api_key}", f"{secret_key}")
+                transaction = monnify.init_transaction(
+                    funding_request(user, amount, ["ACCOUNT_TRANSFER"])
                 )
-                print(api_key, secret_key)
-                print(response.json())
-                token = response.json()["responseBody"]["accessToken"]
-                referrence_id = str(uuid.uuid4())[:8]
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": "Bearer {}".format(token),
-                }
-                body = {
-                    "amount": float(amount),
-                    "customerName": f"{user.username}",
-                    "customerEmail": f"{user.email}",
-                    "paymentReference": f"{referrence_id}",
-                    "paymentDescription": f"Restaurant Go Wallet Funding by {user.username} at {datetime.now()}",
-                    "currencyCode": "NGN",
-                    "contractCode": f"{contract_code}",
-                    # "redirectUrl": f"{redirect_url}",
-                    "paymentMethods": ["ACCOUNT_TRANSFER"],
-                }
-                data = json.dumps(body)
-                url = f"{base_url}/api/v1/merchant/transactions/init-transaction"
-                response = requests.post(url, headers=headers, data=data)
-                res = response.json()
-                print(res)
-                # checkout_url = res["responseBody"]["checkoutUrl"]
-                tran_ref = res["responseBody"]["transactionReference"]
-                init_tran_url = f"{base_url}/api/v1/merchant/bank-transfer/init-payment"
-                print(init_tran_url)
-                body = {"transactionReference": f"{tran_ref}", "bankCode": "035"}
-                init_data = json.dumps(body)
-                payment_response = requests.post(
-                    init_tran_url, data=init_data, headers=headers
+                account = monnify.init_bank_transfer(
+                    transaction.transaction_reference, "035"
                 )
-                res = payment_response.json()
-                print(res)
-                res_body = res.get("responseBody")
-                expiry_time = res_body["expiresOn"]
-                amount = res_body["amount"]
-                # 0.5% charge fee
-                fee = round(float(amount) * 0.005)
-                acct_details = {
-                    "account_number": res_body["accountNumber"],
-                    "account_name": res_body["accountName"],
-                    "bank_name": res_body["bankName"],
-                    "bank_code": res_body["bankCode"],
-                    "charges_fee": fee,
-                    "expiry_time": expiry_time,
-                    "ussd": res_body["ussdPayment"],
-                    "tran_ref": res_body["transactionReference"],
-                    "amount": amount,
-                }
+                open_funding(user, account.transaction_reference, account.amount)
                 return service_response(
                     status="success",
                     message="Account details generated successfully",
-                    data=acct_details,
+                    data=transfer_details(account),
                     status_code=200,
                 )
             else:
                 return service_response(
                     status="error", message="Amount is required", status_code=400
                 )
+        except monnify.GatewayUnavailable as e:
+            return gateway_unavailable(e)
+        except monnify.MonnifyError as e:
+            logger.error(f"Bank transfer setup failed due to {e.message}")
+            return service_response(
+                status="error",
+                message="Payment gateway unavailable, please try again",
+                status_code=502,
+            )
         except Exception:
             return handle_internal_server_exception()
 
 
+class MonnifyCardChargeView(AsyncAuthenticatedView):
+    """MonnifyCardChargeAPIView for ASGI workers
+
+    The gateway calls are awaited on the pooled async client, so a worker
+    keeps serving other requests while a charge is in flight.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        """Charge user with card details"""
+        try:
+            data = self.parse_body(request)
+            card_number = data.get("card_number")
+            expiry_month = data.get("expiry_month")
+            expiry_year = data.get("expiry_year")
+            pin = data.get("pin")
+            cvv = data.get("cvv")
+            amount = data.get("amount")
+            error = card_error(card_number, cvv, expiry_month, expiry_year)
+            if error:
+                return json_response(status="error", message=error, status_code=400)
+            if not amount:
+                return json_response(
+                    status="error", message="Amount is required", status_code=400
+                )
+            transaction = await monnify_async.init_transaction(
+                funding_request(request.user, amount, ["CARD"])
+            )
+            charge = await monnify_async.charge_card(
+                transaction.transaction_reference,
+                monnify.Card(card_number, expiry_month, expiry_year, pin, cvv),
+            )
+            if charge.successful:
+                return json_response(
+                    status="success",
+                    message="Card Charge Successful",
+                    data=charge.body,
+                    status_code=200,
+                )
+            return json_response(
+                status="error", message="Card Charge Failed", status_code=400
+            )
+        except ValidationException as e:
+            return json_response(status="error", message=e.message, status_code=400)
+        except monnify.GatewayUnavailable as e:
+            return gateway_unavailable(e, json_response)
+        except monnify.MonnifyError as e:
+            logger.error(f"Card charge failed due to {e.message}")
+            return json_response(
+                status="error", message="Card Charge Failed", status_code=502
+            )
+        except Exception:
+            return handle_internal_server_exception_json()
+
+
+class MonnifyTransferView(AsyncAuthenticatedView):
+    """MonnifyTransferAPIView for ASGI workers"""
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            amount = self.parse_body(request).get("amount")
+            if not amount:
+                return json_response(
+                    status="error", message="Amount is required", status_code=400
+                )
+            transaction = await monnify_async.init_transaction(
+                funding_request(request.user, amount, ["ACCOUNT_TRANSFER"])
+            )
+            account = await monnify_async.init_bank_transfer(
+                transaction.transaction_reference, "035"
+            )
+            await sync_to_async(open_funding)(
+                request.user, account.transaction_reference, account.amount
+            )
+            return json_response(
+                status="success",
+                message="Account details generated successfully",
+                data=transfer_details(account),
+                status_code=200,
+            )
+        except ValidationException as e:
+            return json_response(status="error", message=e.message, status_code=400)
+        except monnify.GatewayUnavailable as e:
+            return gateway_unavailable(e, json_response)
+        except monnify.MonnifyError as e:
+            logger.error(f"Bank transfer setup failed due to {e.message}")
+            return json_response(
+                status="error",
+                message="Payment gateway unavailable, please try again",
+                status_code=502,
+            )
+        except Exception:
+            return handle_internal_server_exception_json()
+
+
 class MonnifyPaymentWebhook(APIView):
     """Monnify webhook controller for payment notifications"""
 
@@ -639,8 +697,6 @@ class MonnifyPaymentWebhook(APIView):
             monnify_hashkey = request.META["HTTP_MONNIFY_SIGNATURE"]
             forwarded_for = "{}".format(request.META.get("REMOTE_ADDR"))
             monnify_secret = os.getenv("MONNIFY_SECRET_KEY_RG")
-            monnify_api_key = os.getenv("MONNIFY_API_KEY_RG")
-            monnify_base_url = os.getenv("MONNIFY_BASE_URL_RG")
             if machine == "local":
                 ip = "127.0.0.1"
             else:
@@ -648,70 +704,10 @@ class MonnifyPaymentWebhook(APIView):
             secret = bytes(monnify_secret, "utf-8")
             hashkey = hmac.new(secret, request.body, hashlib.sha512).hexdigest()
             if hashkey == monnify_hashkey and forwarded_for == ip:
-                res = requests.post(
-                    f"{monnify_base_url}/api/v1/auth/login",
-                    auth=HTTPBasicAuth(f"{monnify_api_key}", f"{monnify_secret}"),
-                )
-                data = json.loads(res.text)
-
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": "Bearer {}".format(
-                        data["responseBody"]["accessToken"]
-                    ),
-                }
-                response = requests.get(
-                    "{}/api/v2/transactions/{}".format(
-                        monnify_base_url,
-                        urllib.parse.quote(dat["eventData"]["transactionReference"]),
-                    ),
-                    headers=headers,
-                )
-
-                resp = json.loads(response.text)
-
-                if (
-                    response.status_code == 200 and resp["requestSuccessful"] == True
-                ) and (
-                    resp["responseMessage"] == "success"
-                    and resp["responseBody"]["paymentStatus"] == "PAID"
-                ):
-                    user_email = dat["eventData"]["customer"]["email"]
-                    user = User.objects.get(email__iexact=user_email)
-                    amount = float(resp["responseBody"]["amountPaid"])
-                    our_fee = round(float(amount) * 0.005)
-
-                    paynow = float(amount) - float(our_fee)
-
-                    ref = resp["responseBody"]["transactionReference"]
-
-                    if not Funding.objects.filter(ref=ref).exists():
-                        try:
-                            user.deposit(
-                                user.id,
-                                paynow,
-                                "Wallet Funding",
-                                ref,
-                            )
-                            Funding.objects.create(
-                                user=user,
-                                ref=ref,
-                                amount=paynow,
-                                status="Successful",
-                                gateway="monnify",
-                            )
-                            return HttpResponse(status=200)
-                        except Exception as e:
-                            logger.error(f"{e}")
-                            traceback.print_exc()
-                            return HttpResponse(status=500)
-
-                    else:
-                        pass
-
-                else:
-                    return HttpResponse(status=400)
-
+                # acknowledge at once, process_webhook_events verifies the
+                # transaction with Monnify and credits the wallet
+                record_event(dat)
+                return HttpResponse(status=200)
             else:
                 return HttpResponseForbidden("Permission denied.")
 
@@ -721,6 +717,24 @@ class MonnifyPaymentWebhook(APIView):
             return HttpResponse(status=500)
 
 
+class PaymentGatewayStatusAPIView(APIView):
+    """Circuit breaker state and counters of the payment gateway"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """gateway circuit metrics, shared by every worker"""
+        try:
+            return service_response(
+                status="success",
+                data=monnify.get_breaker().metrics(),
+                message="Gateway Status Fetch Successfully",
+                status_code=200,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
@@ -899,8 +913,10 @@ class WalletView(APIView):
                     message="User not authenticated",
                     status_code=401,
                 )
-            user = request.user
-            wallet_balance = user.wallet_balance
+            # request.user is a cached snapshot, the balance is read fresh
+            wallet_balance = User.objects.values_list("wallet_balance", flat=True).get(
+                id=request.user.id
+            )
             return service_response(
                 status="success",
                 message="Wallet balance retrieved",
@@ -911,6 +927,130 @@ class WalletView(APIView):
             return handle_internal_server_exception()
 
 
+class WalletHistoryView(APIView):
+    """View to list the user wallet movements"""
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = WalletHistorySerializer
+
+    @swagger_auto_schema(
+        operation_description="List the user wallet debits, credits and fundings, newest first",
+        manual_parameters=[
+            openapi.Parameter(
+                "cursor",
+                openapi.IN_QUERY,
+                description="next_cursor of the previous page",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "limit",
+                openapi.IN_QUERY,
+                description="rows per page, at most 100",
+                type=openapi.TYPE_INTEGER,
+            ),
+        ],
+        responses={
+            status.HTTP_200_OK: openapi.Response(
+                description="Wallet history retrieved",
+                schema=ResponseSerializer(),
+            ),
+            status.HTTP_400_BAD_REQUEST: openapi.Response(
+                description="Invalid cursor",
+                schema=ResponseSerializer(),
+            ),
+        },
+    )
+    def get(self, request, *args, **kwargs) -> Response:
+        """Get a page of the user wallet history"""
+        try:
+            rows, next_cursor = wallet_history(
+                request.user.id,
+                request.query_params.get("cursor"),
+                get_page_size(request),
+            )
+            return service_response(
+                status="success",
+                message="Wallet history retrieved",
+                data={
+                    "transactions": self.serializer_class(rows, many=True).data,
+                    "next_cursor": next_cursor,
+                },
+                status_code=200,
+            )
+        except ValueError:
+            return service_response(
+                status="error",
+                message="Invalid cursor",
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
+class WalletBulkCreditView(APIView):
+    """Staff view crediting many wallets at once"""
+
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_description="Credit wallets from an uploaded user_id,amount,reference csv file",
+        manual_parameters=[
+            openapi.Parameter(
+                "file",
+                openapi.IN_FORM,
+                description="csv file with user_id,amount,reference rows",
+                type=openapi.TYPE_FILE,
+                required=True,
+            ),
+            openapi.Parameter(
+                "description",
+                openapi.IN_FORM,
+                description="description of the ledger entries",
+                type=openapi.TYPE_STRING,
+            ),
+        ],
+        responses={
+            status.HTTP_200_OK: openapi.Response(
+                description="Wallets credited",
+                schema=ResponseSerializer(),
+            ),
+            status.HTTP_400_BAD_REQUEST: openapi.Response(
+                description="No csv file uploaded",
+                schema=ResponseSerializer(),
+            ),
+        },
+    )
+    def post(self, request, *args, **kwargs) -> Response:
+        """Apply the uploaded credits, references already applied are skipped"""
+        try:
+            upload = request.FILES.get("file")
+            if upload is None:
+                return service_response(
+                    status="error",
+                    message="Upload a csv file in the file field",
+                    status_code=400,
+                )
+            lines = io.TextIOWrapper(upload.file, encoding="utf-8", newline="")
+            report = bulk_credit(
+                read_rows(lines),
+                description=request.data.get("description") or "Bulk Credit",
+            )
+            return service_response(
+                status="success",
+                message=f"{report.credited} Wallets Credited",
+                data=report.to_dict(),
+                status_code=200,
+            )
+        except UnicodeDecodeError:
+            return service_response(
+                status="error",
+                message="The file must be utf-8 encoded csv",
+                status_code=400,
+            )
+        except Exception:
+            return handle_internal_server_exception()
+
+
 class AddressViewSet(viewsets.ModelViewSet):
     """Address management viewset"""
 
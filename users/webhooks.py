@@ -0,0 +1,238 @@
+import logging
+import queue
+import threading
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, List, Union
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from users.models import (
+    CREDIT,
+    FUNDING_DESCRIPTION,
+    MONNIFY_GATEWAY,
+    Funding,
+    User,
+    WebhookEvent,
+)
+from utils import monnify
+from utils.utils import to_money
+
+logger = logging.getLogger(__name__)
+
+
+PENDING = "Pending"
+PROCESSING = "Processing"
+PROCESSED = "Processed"
+IGNORED = "Ignored"
+FAILED = "Failed"
+
+# events claimed per query
+WEBHOOK_BATCH_SIZE = 100
+
+# share of a funding kept as charges
+FUNDING_FEE_RATE = Decimal("0.005")
+
+
+def record_event(payload: dict, gateway: str = MONNIFY_GATEWAY) -> WebhookEvent:
+    """Stores a verified notification as received, one INSERT"""
+    event_data = payload.get("eventData") or {}
+    return WebhookEvent.objects.create(
+        gateway=gateway,
+        event_type=str(payload.get("eventType") or ""),
+        transaction_reference=str(event_data.get("transactionReference") or ""),
+        payload=payload,
+    )
+
+
+def _claimable(after_id: int) -> Q:
+    stale = timezone.now() - timedelta(seconds=settings.WEBHOOK_CLAIM_TIMEOUT)
+    return Q(id__gt=after_id) & (
+        Q(status=PENDING) | Q(status=PROCESSING, claimed_at__lt=stale)
+    )
+
+
+def claim_batch(
+    worker: str, after_id: int = 0, limit: int = WEBHOOK_BATCH_SIZE
+) -> List[WebhookEvent]:
+    """Claims the next pending events for a worker
+
+    The claim is one conditional UPDATE, events another worker claimed in
+    the meantime are left out. Events held by a worker that died are taken
+    again after WEBHOOK_CLAIM_TIMEOUT seconds.
+    """
+    ids = list(
+        WebhookEvent.objects.filter(_claimable(after_id))
+        .order_by("id")
+        .values_list("id", flat=True)[:limit]
+    )
+    if not ids:
+        return []
+    WebhookEvent.objects.filter(_claimable(after_id), id__in=ids).update(
+        status=PROCESSING, claimed_by=worker, claimed_at=timezone.now()
+    )
+    return list(
+        WebhookEvent.objects.filter(
+            id__in=ids, claimed_by=worker, status=PROCESSING
+        ).order_by("id")
+    )
+
+
+def credit_funding(
+    user_id: int,
+    reference: str,
+    amount_paid: Decimal,
+    gateway: str = MONNIFY_GATEWAY,
+) -> bool:
+    """Credits a paid funding to the wallet, less the charges
+
+    The pending Funding row of a transfer is marked successful, or a row
+    inserted for a payment started elsewhere, and the wallet credited in
+    the same transaction. A row the reconciler rejected as expired is
+    settled too, the customer paid late but paid. Only one of concurrent
+    redeliveries can move the row out of pending or insert the unique
+    reference, the others fail and roll back instead of passing an
+    exists() check and crediting twice.
+
+    Returns:
+        bool: False when the reference was credited before
+    """
+    amount = to_money(amount_paid)
+    credit = amount - to_money(round(amount * FUNDING_FEE_RATE))
+    try:
+        with transaction.atomic():
+            settled = Funding.objects.filter(
+                ref=reference, user_id=user_id, status__in=["Pending", "Rejected"]
+            ).update(amount=credit, status="Successful")
+            if not settled:
+                Funding.objects.create(
+                    user_id=user_id,
+                    ref=reference,
+                    amount=credit,
+                    status="Successful",
+                    gateway=gateway,
+                )
+            entry = User.post_entry(
+                user_id,
+                CREDIT,
+                credit,
+                FUNDING_DESCRIPTION,
+                reference,
+                idempotency_key=f"funding:{reference}",
+            )
+            if entry is None:
+                raise User.DoesNotExist(f"User {user_id} does not exist")
+    except IntegrityError:
+        return False
+    return True
+
+
+def apply_event(event: WebhookEvent) -> str:
+    """Verifies a claimed event with the gateway and applies it
+
+    The notification body is never trusted for the amount, the transaction
+    is looked up on the gateway first. Gateway errors leave the event
+    pending for the next run until WEBHOOK_MAX_ATTEMPTS is reached, an
+    open gateway circuit leaves it pending without using an attempt.
+
+    Returns:
+        str: the new status of the event
+    """
+    error, attempted = "", True
+    try:
+        status = monnify.get_transaction(event.transaction_reference)
+        if not status.paid:
+            outcome = IGNORED
+        else:
+            customer = (event.payload.get("eventData") or {}).get("customer") or {}
+            email = customer.get("email") or status.customer_email
+            credit_funding(
+                User.objects.with_email(email).values_list("id", flat=True).get(),
+                status.transaction_reference,
+                status.amount_paid,
+                event.gateway,
+            )
+            outcome = PROCESSED
+    except User.DoesNotExist:
+        outcome, error = FAILED, "No user with the customer email"
+    except monnify.GatewayUnavailable as e:
+        # the gateway was not called, the attempt does not count
+        outcome, error, attempted = PENDING, e.message, False
+    except Exception as e:
+        error = getattr(e, "message", None) or str(e)
+        retry = event.attempts + 1 < settings.WEBHOOK_MAX_ATTEMPTS
+        outcome = PENDING if retry else FAILED
+        logger.error(f"Webhook event {event.id} failed due to {error}")
+    WebhookEvent.objects.filter(id=event.id, claimed_by=event.claimed_by).update(
+        status=outcome,
+        attempts=F("attempts") + int(attempted),
+        last_error=error,
+        claimed_by="",
+        processed_at=timezone.now() if outcome in (PROCESSED, IGNORED) else None,
+    )
+    return outcome
+
+
+def process_pending(
+    workers: Union[int, None] = None, batch_size: int = WEBHOOK_BATCH_SIZE
+) -> Dict[str, int]:
+    """Applies every pending event once, `workers` at a time
+
+    Events are claimed in batches and handed to a fixed number of threads,
+    so a burst of notifications never opens more than `workers` gateway
+    calls or database connections. An event that fails is retried by the
+    next run, not this one.
+
+    Args:
+        workers (Union[int, None], optional): concurrent events.
+            Defaults to settings.WEBHOOK_WORKERS.
+        batch_size (int, optional): events claimed per query.
+
+    Returns:
+        Dict[str, int]: number of events per resulting status
+    """
+    workers = workers or settings.WEBHOOK_WORKERS
+    worker = uuid.uuid4().hex
+    counts = {PROCESSED: 0, IGNORED: 0, PENDING: 0, FAILED: 0}
+    lock = threading.Lock()
+
+    def run(events: "queue.Queue[WebhookEvent]") -> None:
+        while True:
+            try:
+                event = events.get_nowait()
+            except queue.Empty:
+                return
+            outcome = apply_event(event)
+            with lock:
+                counts[outcome] += 1
+
+    last_id = 0
+    while True:
+        batch = claim_batch(worker, last_id, batch_size)
+        if not batch:
+            return counts
+        last_id = batch[-1].id
+        events: "queue.Queue[WebhookEvent]" = queue.Queue()
+        for event in batch:
+            events.put(event)
+        if workers == 1:
+            run(events)
+            continue
+        threads = [
+            threading.Thread(target=_with_own_connection, args=(run, events))
+            for _ in range(min(workers, len(batch)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def _with_own_connection(target, *args) -> None:
+    """runs `target` in a worker thread, closing its connections afterwards"""
+    try:
+        target(*args)
+    finally:
+        connections.close_all()
@@ -0,0 +1,66 @@
+import os
+import resource
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from django.db import connection
+from django.test.utils import override_settings
+
+# project apps ship without migrations, their tables are created directly
+LOCAL_APPS = ("users", "foods", "orders")
+
+
+@contextmanager
+def benchmark_database(verbosity: int = 0) -> Iterator[None]:
+    """Runs a benchmark against a throw away test database
+
+    SQLite gets a temporary file instead of the usual in-memory database so
+    that the rows a benchmark creates do not count towards its memory use.
+    """
+    old_name = connection.settings_dict["NAME"]
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    old_test_name = test_settings.get("NAME")
+    temp_dir = None
+    if connection.vendor == "sqlite" and not old_test_name:
+        temp_dir = tempfile.TemporaryDirectory()
+        test_settings["NAME"] = os.path.join(temp_dir.name, "benchmark.sqlite3")
+    try:
+        with override_settings(MIGRATION_MODULES={app: None for app in LOCAL_APPS}):
+            connection.creation.create_test_db(
+                verbosity=verbosity, autoclobber=True, serialize=False
+            )
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+    finally:
+        test_settings["NAME"] = old_test_name
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+
+def current_rss_mb() -> float:
+    """resident set size of this process in MB"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # peak instead of current where /proc is missing (macOS reports bytes)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+class Timer:
+    """context manager measuring wall clock time"""
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.started
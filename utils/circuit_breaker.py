@@ -0,0 +1,154 @@
+import logging
+import time
+from typing import Dict, Union
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency the breaker holds open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker with its state in the shared cache
+
+    Every worker sees the same state as long as the cache is shared between
+    them, the redis cache configured by REDIS_URL. With a per-process cache
+    each worker trips its own circuit. `failure_threshold` failures within
+    `window` seconds open the circuit, calls then fail fast for
+    `reset_timeout` seconds. After that a single call is let through as a
+    probe: its success closes the circuit, its failure opens it again.
+
+    A healthy circuit costs one cache read per call, successes are not
+    written.
+
+        probe = breaker.allow()
+        try:
+            ...
+        except Exception:
+            breaker.record_failure(probe)
+            raise
+        breaker.record_success(probe)
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int, window: int, reset_timeout: int
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+
+    def _key(self, *parts: str) -> str:
+        return ":".join(["breaker", self.name, *parts])
+
+    def _count(self, *parts: str, timeout: Union[int, None] = None) -> int:
+        """increments a shared counter, creating it first"""
+        key = self._key(*parts)
+        cache.add(key, 0, timeout)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # expired between add and incr
+            cache.set(key, 1, timeout)
+            return 1
+
+    def _transition(self, state: str) -> None:
+        self._count("transitions", state)
+        log = logger.info if state == CLOSED else logger.warning
+        log(f"Circuit {self.name} is now {state}")
+
+    @staticmethod
+    def _state(opened_until: Union[float, None]) -> str:
+        if opened_until is None:
+            return CLOSED
+        return OPEN if time.time() < opened_until else HALF_OPEN
+
+    def state(self) -> str:
+        return self._state(cache.get(self._key("opened_until")))
+
+    def allow(self) -> bool:
+        """Checks the circuit before a call
+
+        Raises:
+            CircuitOpen: the circuit is open, or half open with another
+                worker probing
+
+        Returns:
+            bool: True when the call is the probe of a half open circuit
+        """
+        opened_until = cache.get(self._key("opened_until"))
+        if opened_until is None:
+            return False
+        now = time.time()
+        if now >= opened_until and cache.add(self._key("probe"), 1, self.reset_timeout):
+            self._transition(HALF_OPEN)
+            return True
+        self._count("rejected")
+        raise CircuitOpen(self.name, max(opened_until - now, 0))
+
+    def record_success(self, probe: bool = False) -> None:
+        if probe:
+            cache.delete_many(
+                [self._key("opened_until"), self._key("failures"), self._key("probe")]
+            )
+            self._transition(CLOSED)
+
+    def record_failure(self, probe: bool = False) -> None:
+        opened_until = time.time() + self.reset_timeout
+        if probe:
+            cache.set(self._key("opened_until"), opened_until, None)
+            cache.delete(self._key("probe"))
+            self._transition(OPEN)
+            return
+        failures = self._count("failures", timeout=self.window)
+        # add, so only one of the workers failing together opens it
+        if failures >= self.failure_threshold and cache.add(
+            self._key("opened_until"), opened_until, None
+        ):
+            self._transition(OPEN)
+
+    def reset(self) -> None:
+        """Closes the circuit and clears its counters"""
+        cache.delete_many(
+            [
+                self._key("opened_until"),
+                self._key("failures"),
+                self._key("probe"),
+                self._key("rejected"),
+            ]
+            + [self._key("transitions", state) for state in STATES]
+        )
+
+    def metrics(self) -> Dict[str, Union[str, int, float, None, Dict[str, int]]]:
+        """State and counters of the circuit, shared by every worker"""
+        transitions = {state: self._key("transitions", state) for state in STATES}
+        opened, failures, rejected = (
+            self._key("opened_until"),
+            self._key("failures"),
+            self._key("rejected"),
+        )
+        values = cache.get_many([opened, failures, rejected, *transitions.values()])
+        opened_until = values.get(opened)
+        return {
+            "name": self.name,
+            "state": self._state(opened_until),
+            "opened_until": opened_until,
+            "recent_failures": values.get(failures, 0),
+            "rejected_calls": values.get(rejected, 0),
+            "transitions": {
+                state: values.get(key, 0) for state, key in transitions.items()
+            },
+        }
@@ -1,5 +1,6 @@
 import logging
 import traceback
+from django.http import JsonResponse
 from rest_framework.response import Response
 
 logger = logging.getLogger(__name__)
@@ -16,6 +17,19 @@ def handle_internal_server_exception() -> Response:
     return Response({"status": "error", "message": "Something went wrong"}, status=500)
 
 
+def handle_internal_server_exception_json() -> JsonResponse:
+    """handle_internal_server_exception for plain django views
+
+    Returns:
+        JsonResponse: Http response
+    """
+    traceback.print_exc()
+    logger.error(traceback.format_exc())
+    return JsonResponse(
+        {"status": "error", "message": "Something went wrong"}, status=500
+    )
+
+
 class ValidationException(Exception):
     """Custom exception for validation errors"""
 
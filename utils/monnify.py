@@ -0,0 +1,550 @@
+import json
+import logging
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Union
+from urllib.parse import quote
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.exceptions import NewConnectionError
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_CACHE_KEY = "monnify:access_token"
+REFRESH_LOCK_KEY = "monnify:access_token:refresh"
+# a worker that died mid refresh releases the lock after this many seconds
+REFRESH_LOCK_TIMEOUT = 10
+# how long a worker waits for another one to finish the refresh
+REFRESH_WAIT_SECONDS = 5.0
+REFRESH_POLL_SECONDS = 0.05
+
+# answers showing the gateway struggling, they count against its circuit
+FAILURE_STATUSES = (429, 500, 502, 503, 504)
+# answers an idempotent request is retried after
+RETRY_STATUSES = (429, 502, 503, 504)
+# answers after which the gateway has not processed the request
+UNPROCESSED_STATUSES = (429, 503)
+
+# one refresh at a time within the process, the cache lock covers the others
+_refresh_lock = threading.Lock()
+
+
+class MonnifyError(Exception):
+    """Raised when the gateway cannot be reached or rejects a request
+
+    `delivered` is False when the request never reached the gateway.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Union[int, None] = None,
+        delivered: bool = True,
+    ):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.delivered = delivered
+
+
+class GatewayUnavailable(MonnifyError):
+    """Raised without calling the gateway while its circuit is open"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            "Payment gateway unavailable, please try again in "
+            f"{math.ceil(retry_after)} seconds",
+            503,
+            delivered=False,
+        )
+        self.retry_after = retry_after
+
+
+@dataclass
+class TransactionRequest:
+    """A payment to initialise, amounts are in naira"""
+
+    amount: Decimal
+    customer_name: str
+    customer_email: str
+    payment_reference: str
+    payment_description: str
+    payment_methods: List[str]
+    currency_code: str = "NGN"
+
+    def to_json(self) -> dict:
+        return {
+            "amount": float(self.amount),
+            "customerName": self.customer_name,
+            "customerEmail": self.customer_email,
+            "paymentReference": self.payment_reference,
+            "paymentDescription": self.payment_description,
+            "currencyCode": self.currency_code,
+            "contractCode": f"{settings.MONNIFY_CONTRACT_CODE}",
+            "paymentMethods": self.payment_methods,
+        }
+
+
+@dataclass
+class Transaction:
+    """An initialised transaction"""
+
+    transaction_reference: str
+    payment_reference: str = ""
+    checkout_url: str = ""
+
+
+@dataclass
+class Card:
+    number: str
+    expiry_month: str
+    expiry_year: str
+    pin: str
+    cvv: str
+
+    def to_json(self) -> dict:
+        return {
+            "number": self.number,
+            "expiryMonth": self.expiry_month,
+            "expiryYear": self.expiry_year,
+            "pin": self.pin,
+            "cvv": self.cvv,
+        }
+
+
+@dataclass
+class CardCharge:
+    """Outcome of a card charge, `body` is the gateway response body"""
+
+    status: str
+    body: dict = field(default_factory=dict)
+
+    @property
+    def successful(self) -> bool:
+        return self.status == "SUCCESS"
+
+
+@dataclass
+class TransferAccount:
+    """Account the customer pays a bank transfer into"""
+
+    account_number: str
+    account_name: str
+    bank_name: str
+    bank_code: str
+    amount: Decimal
+    expires_on: str
+    ussd: str
+    transaction_reference: str
+
+
+@dataclass
+class TransactionStatus:
+    """Status of a transaction, as the gateway reports it"""
+
+    transaction_reference: str
+    payment_status: str
+    amount_paid: Decimal
+    customer_email: str
+
+    @property
+    def paid(self) -> bool:
+        return self.payment_status == "PAID"
+
+
+_session: Union[requests.Session, None] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Process wide session, gateway connections are kept alive and reused"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=settings.MONNIFY_POOL_SIZE,
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def reset_session() -> None:
+    """Closes the pooled connections, the next call opens a new session"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_breaker() -> CircuitBreaker:
+    """Circuit of the gateway, its state is shared by every worker"""
+    return CircuitBreaker(
+        "monnify",
+        settings.MONNIFY_BREAKER_FAILURES,
+        settings.MONNIFY_BREAKER_WINDOW,
+        settings.MONNIFY_BREAKER_RESET,
+    )
+
+
+def allow_call(breaker: CircuitBreaker) -> bool:
+    """breaker.allow raising GatewayUnavailable, returns whether the call probes"""
+    try:
+        return breaker.allow()
+    except CircuitOpen as e:
+        raise GatewayUnavailable(e.retry_after)
+
+
+def is_failure(status_code: Union[int, None], error: Union[MonnifyError, None]) -> bool:
+    """whether an outcome shows the gateway struggling, 4xx answers do not"""
+    return error is not None or status_code in FAILURE_STATUSES
+
+
+def retry_delay(
+    attempt: int,
+    deadline: float,
+    idempotent: bool,
+    status_code: Union[int, None] = None,
+    error: Union[MonnifyError, None] = None,
+) -> Union[float, None]:
+    """Seconds to wait before retrying a failed attempt, None to give up
+
+    Delays are full jitter exponential backoff so workers failing together
+    do not retry together. Nothing is retried past the request deadline.
+    A call that is not idempotent, a card charge, is only retried when the
+    gateway cannot have processed it.
+    """
+    if attempt >= settings.MONNIFY_MAX_RETRIES:
+        return None
+    if error is not None:
+        retryable = idempotent or not error.delivered
+    else:
+        retryable = status_code in (
+            RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES
+        )
+    if not retryable:
+        return None
+    delay = random.uniform(
+        0,
+        min(
+            settings.MONNIFY_RETRY_BACKOFF_MAX,
+            settings.MONNIFY_RETRY_BACKOFF * 2**attempt,
+        ),
+    )
+    if time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+
+def read_timeout(deadline: float) -> float:
+    """read timeout of an attempt, never past the request deadline"""
+    return max(min(settings.MONNIFY_READ_TIMEOUT, deadline - time.monotonic()), 0.01)
+
+
+def _attempt(method: str, path: str, **kwargs) -> requests.Response:
+    """one bounded request on the pooled session"""
+    try:
+        return get_session().request(
+            method, f"{settings.MONNIFY_BASE_URL}{path}", **kwargs
+        )
+    except requests.RequestException as e:
+        raise MonnifyError(
+            f"Monnify {method.upper()} {path} failed: {e}", delivered=_delivered(e)
+        )
+
+
+def _delivered(error: requests.RequestException) -> bool:
+    """False when the request provably never reached the gateway"""
+    if isinstance(error, requests.ConnectTimeout):
+        return False
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return not isinstance(reason, NewConnectionError)
+
+
+def _send(
+    method: str, path: str, idempotent: bool = True, **kwargs
+) -> requests.Response:
+    """Sends a request through the circuit breaker, retrying within a budget
+
+    Attempts, backoff included, end within MONNIFY_RETRY_BUDGET seconds.
+
+    Raises:
+        GatewayUnavailable: the circuit is open
+        MonnifyError: the gateway could not be reached in time
+    """
+    breaker = get_breaker()
+    deadline = time.monotonic() + settings.MONNIFY_RETRY_BUDGET
+    attempt = 0
+    while True:
+        probe = allow_call(breaker)
+        response, error = None, None
+        try:
+            response = _attempt(
+                method,
+                path,
+                timeout=(settings.MONNIFY_CONNECT_TIMEOUT, read_timeout(deadline)),
+                **kwargs,
+            )
+        except MonnifyError as e:
+            error = e
+        status_code = None if response is None else response.status_code
+        if not is_failure(status_code, error):
+            breaker.record_success(probe)
+            return response
+        breaker.record_failure(probe)
+        delay = retry_delay(attempt, deadline, idempotent, status_code, error)
+        if delay is None:
+            if error is not None:
+                raise error
+            return response
+        logger.warning(
+            f"Retrying Monnify {method.upper()} {path} in {delay:.2f}s "
+            f"after {error.message if error else status_code}"
+        )
+        attempt += 1
+        time.sleep(delay)
+
+
+def _login() -> Dict[str, Union[str, int]]:
+    """POSTs the api key and secret to the login endpoint"""
+    response = _send(
+        "post",
+        LOGIN_PATH,
+        auth=HTTPBasicAuth(
+            f"{settings.MONNIFY_API_KEY}", f"{settings.MONNIFY_SECRET_KEY}"
+        ),
+    )
+    return _body(response)
+
+
+def _refresh() -> str:
+    """logs in and caches the token until shortly before it expires"""
+    body = _login()
+    token = body["accessToken"]
+    ttl = int(body.get("expiresIn") or 0) - settings.MONNIFY_TOKEN_REFRESH_MARGIN
+    if ttl > 0:
+        cache.set(TOKEN_CACHE_KEY, token, ttl)
+    logger.info(f"Monnify access token refreshed, cached for {max(ttl, 0)}s")
+    return token
+
+
+def get_access_token(force_refresh: bool = False) -> str:
+    """Returns a Monnify bearer token, logging in only when the cached one expired
+
+    The token lives in the shared cache, so every worker uses the same one.
+    That takes REDIS_URL, with the per-process fallback cache every worker
+    refreshes its own token. Refreshing is single flight: the worker that
+    wins the cache lock logs
+    in while the others wait for the new token instead of stampeding the
+    login endpoint. A worker that waited too long logs in on its own rather
+    than failing the payment.
+
+    Args:
+        force_refresh (bool, optional): ignore the cached token, after the
+            gateway rejected it. Defaults to False.
+
+    Returns:
+        str: the access token
+    """
+    if force_refresh:
+        cache.delete(TOKEN_CACHE_KEY)
+    token = cache.get(TOKEN_CACHE_KEY)
+    if token:
+        return token
+    with _refresh_lock:
+        token = cache.get(TOKEN_CACHE_KEY)
+        if token:
+            return token
+        if cache.add(REFRESH_LOCK_KEY, 1, REFRESH_LOCK_TIMEOUT):
+            try:
+                return _refresh()
+            finally:
+                cache.delete(REFRESH_LOCK_KEY)
+        deadline = time.monotonic() + REFRESH_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(REFRESH_POLL_SECONDS)
+            token = cache.get(TOKEN_CACHE_KEY)
+            if token:
+                return token
+        logger.warning("Timed out waiting for the Monnify token refresh")
+        return _refresh()
+
+
+def auth_headers(force_refresh: bool = False) -> Dict[str, str]:
+    """JSON headers carrying the cached bearer token"""
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {get_access_token(force_refresh)}",
+    }
+
+
+def call(
+    method: str, path: str, idempotent: bool = True, **kwargs
+) -> requests.Response:
+    """Calls the Monnify API with the cached token
+
+    Requests go through the pooled session with connect and read timeouts,
+    behind the gateway circuit breaker, and failed attempts are retried
+    within MONNIFY_RETRY_BUDGET seconds. A 401 means the token was
+    revoked or expired early, the call is retried once with a fresh token.
+
+    Args:
+        method (str): http method
+        path (str): api path, starting with a slash
+        idempotent (bool, optional): the call may be repeated after a
+            timeout. Defaults to True.
+
+    Raises:
+        GatewayUnavailable: the circuit is open
+        MonnifyError: the gateway could not be reached in time
+
+    Returns:
+        requests.Response: the gateway response
+    """
+    response = _send(method, path, idempotent, headers=auth_headers(), **kwargs)
+    if response.status_code == 401:
+        response = _send(
+            method,
+            path,
+            idempotent,
+            headers=auth_headers(force_refresh=True),
+            **kwargs,
+        )
+    return response
+
+
+LOGIN_PATH = "/api/v1/auth/login"
+INIT_TRANSACTION_PATH = "/api/v1/merchant/transactions/init-transaction"
+CARD_CHARGE_PATH = "/api/v1/merchant/cards/charge"
+BANK_TRANSFER_PATH = "/api/v1/merchant/bank-transfer/init-payment"
+
+
+def transaction_path(transaction_reference: str) -> str:
+    return f"/api/v2/transactions/{quote(transaction_reference, safe='')}"
+
+
+def parse_body(status_code: int, content: bytes) -> dict:
+    """Response body of a successful call, shared by the sync and async clients
+
+    Raises:
+        MonnifyError: the gateway rejected the request
+    """
+    try:
+        payload = json.loads(content)
+    except ValueError:
+        raise MonnifyError(
+            f"Monnify returned a non JSON response ({status_code})", status_code
+        )
+    if status_code >= 400 or not payload.get("requestSuccessful"):
+        raise MonnifyError(
+            payload.get("responseMessage") or f"Monnify error {status_code}",
+            status_code,
+        )
+    return payload.get("responseBody") or {}
+
+
+def _body(response: requests.Response) -> dict:
+    """response body of a successful call"""
+    return parse_body(response.status_code, response.content)
+
+
+def charge_payload(transaction_reference: str, card: Card) -> dict:
+    return {
+        "transactionReference": transaction_reference,
+        "collectionChannel": "API_NOTIFICATION",
+        "card": card.to_json(),
+    }
+
+
+def transfer_payload(transaction_reference: str, bank_code: str) -> dict:
+    return {"transactionReference": transaction_reference, "bankCode": bank_code}
+
+
+def transaction_from(body: dict) -> Transaction:
+    return Transaction(
+        transaction_reference=body["transactionReference"],
+        payment_reference=body.get("paymentReference", ""),
+        checkout_url=body.get("checkoutUrl", ""),
+    )
+
+
+def card_charge_from(body: dict) -> CardCharge:
+    return CardCharge(status=body.get("status", ""), body=body)
+
+
+def transfer_account_from(body: dict) -> TransferAccount:
+    return TransferAccount(
+        account_number=body["accountNumber"],
+        account_name=body["accountName"],
+        bank_name=body["bankName"],
+        bank_code=body["bankCode"],
+        amount=Decimal(str(body["amount"])),
+        expires_on=body["expiresOn"],
+        ussd=body.get("ussdPayment", ""),
+        transaction_reference=body["transactionReference"],
+    )
+
+
+def transaction_status_from(body: dict) -> TransactionStatus:
+    return TransactionStatus(
+        transaction_reference=body["transactionReference"],
+        payment_status=body.get("paymentStatus", ""),
+        amount_paid=Decimal(str(body.get("amountPaid") or 0)),
+        customer_email=(body.get("customer") or {}).get("email", ""),
+    )
+
+
+def init_transaction(request: TransactionRequest) -> Transaction:
+    """Initialises a transaction the customer then pays by card or transfer"""
+    return transaction_from(
+        _body(call("post", INIT_TRANSACTION_PATH, json=request.to_json()))
+    )
+
+
+def charge_card(transaction_reference: str, card: Card) -> CardCharge:
+    """Charges a card for an initialised transaction"""
+    return card_charge_from(
+        _body(
+            call(
+                "post",
+                CARD_CHARGE_PATH,
+                idempotent=False,
+                json=charge_payload(transaction_reference, card),
+            )
+        )
+    )
+
+
+def init_bank_transfer(transaction_reference: str, bank_code: str) -> TransferAccount:
+    """Account details the customer transfers the amount of a transaction to"""
+    return transfer_account_from(
+        _body(
+            call(
+                "post",
+                BANK_TRANSFER_PATH,
+                json=transfer_payload(transaction_reference, bank_code),
+            )
+        )
+    )
+
+
+def get_transaction(transaction_reference: str) -> TransactionStatus:
+    """Looks a transaction up, the source of truth for webhook notifications"""
+    return transaction_status_from(
+        _body(call("get", transaction_path(transaction_reference)))
+    )
@@ -0,0 +1,365 @@
+import asyncio
+import functools
+import json
+import ssl
+import time
+import weakref
+from typing import Dict, List, Tuple, Union
+from urllib.parse import urlsplit
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from utils import monnify
+from utils.monnify import (
+    Card,
+    CardCharge,
+    MonnifyError,
+    Transaction,
+    TransactionRequest,
+    TransactionStatus,
+    TransferAccount,
+)
+
+
+class _StaleConnection(Exception):
+    """the gateway closed a kept-alive connection before answering"""
+
+
+Stream = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AsyncMonnifyClient:
+    """HTTP/1.1 client for the Monnify API on one event loop
+
+    At most `pool_size` requests are in flight, each on a kept-alive
+    connection taken from the idle pool, so a worker serving many funding
+    requests at once never opens more than `pool_size` connections to
+    the gateway. Every connect and response read is bounded by the
+    MONNIFY timeouts.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int,
+        connect_timeout: float,
+        read_timeout: float,
+    ):
+        parts = urlsplit(base_url)
+        secure = parts.scheme == "https"
+        self.host = parts.hostname or ""
+        self.port = parts.port or (443 if secure else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.ssl = ssl.create_default_context() if secure else None
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.connections_opened = 0
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle: List[Stream] = []
+
+    async def _connect(self) -> Stream:
+        stream = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+            self.connect_timeout,
+        )
+        self.connections_opened += 1
+        return stream
+
+    async def _read_response(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[int, bytes, bool]:
+        """status, body and whether the connection can be reused"""
+        status_line = await reader.readline()
+        if not status_line:
+            raise _StaleConnection("connection closed before a response")
+        version, status_code = status_line.decode("latin-1").split(" ", 2)[:2]
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = (
+            version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        )
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if not size:
+                    # trailers end with an empty line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b"".join(chunks)
+        elif "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        else:
+            content, keep_alive = await reader.read(), False
+        return int(status_code), content, keep_alive
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: Union[dict, None] = None,
+        headers: Union[Dict[str, str], None] = None,
+        read_timeout: Union[float, None] = None,
+        idempotent: bool = True,
+    ) -> Tuple[int, bytes]:
+        """Sends one request on a pooled connection
+
+        A kept-alive connection the gateway closed while idle is replaced
+        and the request sent again. Once the request was written the gateway
+        may have processed it, so a request that is not idempotent is only
+        sent again when the connection was found closed before writing.
+
+        Args:
+            read_timeout (Union[float, None], optional): overrides the read
+                timeout of the client. Defaults to None.
+            idempotent (bool, optional): the request may be sent twice.
+                Defaults to True.
+
+        Raises:
+            MonnifyError: the gateway could not be reached in time
+
+        Returns:
+            Tuple[int, bytes]: status code and body
+        """
+        payload = json.dumps(body).encode() if body is not None else b""
+        lines = [
+            f"{method.upper()} {self.base_path}{path} HTTP/1.1",
+            f"Host: {self.host}",
+            "Accept: application/json",
+            f"Content-Length: {len(payload)}",
+        ]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                try:
+                    reader, writer = (
+                        self._idle.pop() if reused else await self._connect()
+                    )
+                except (OSError, asyncio.TimeoutError) as e:
+                    raise MonnifyError(
+                        f"Monnify {method.upper()} {path} failed: {e!r}",
+                        delivered=False,
+                    )
+                written = False
+                try:
+                    if reader.at_eof() or writer.is_closing():
+                        raise _StaleConnection("connection closed while idle")
+                    written = True
+                    writer.write(message)
+                    await writer.drain()
+                    status_code, content, keep_alive = await asyncio.wait_for(
+                        self._read_response(reader), read_timeout or self.read_timeout
+                    )
+                except BaseException as e:
+                    # a connection is never pooled mid response
+                    writer.close()
+                    stale = isinstance(e, (_StaleConnection, ConnectionError))
+                    if reused and stale and (idempotent or not written):
+                        continue
+                    if isinstance(
+                        e, (_StaleConnection, OSError, EOFError, asyncio.TimeoutError)
+                    ):
+                        raise MonnifyError(
+                            f"Monnify {method.upper()} {path} failed: {e!r}"
+                        )
+                    raise
+                if keep_alive:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status_code, content
+
+    async def aclose(self) -> None:
+        """Closes the idle connections"""
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+# one client per event loop, streams cannot be shared between loops
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncMonnifyClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_client() -> AsyncMonnifyClient:
+    """Client of the running event loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncMonnifyClient(
+            settings.MONNIFY_BASE_URL,
+            settings.MONNIFY_POOL_SIZE,
+            settings.MONNIFY_CONNECT_TIMEOUT,
+            settings.MONNIFY_READ_TIMEOUT,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def reset_client() -> None:
+    """Closes the client of the running loop, the next call opens a new one"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def get_access_token(force_refresh: bool = False) -> str:
+    """Cached bearer token, shared with the sync client
+
+    The refresh is rare and stays single flight across workers, so it
+    runs the sync refresh in a thread instead of duplicating the lock.
+    """
+    if not force_refresh:
+        token = await cache.aget(monnify.TOKEN_CACHE_KEY)
+        if token:
+            return token
+    return await sync_to_async(monnify.get_access_token, thread_sensitive=False)(
+        force_refresh
+    )
+
+
+async def _send(
+    method: str,
+    path: str,
+    body: Union[dict, None],
+    headers: Dict[str, str],
+    idempotent: bool,
+) -> Tuple[int, bytes]:
+    """monnify._send on the async client, same breaker and retry budget
+
+    The breaker lives in the cache, its checks run in a thread. A healthy
+    circuit needs one check per attempt.
+    """
+    client = get_client()
+    breaker = monnify.get_breaker()
+    deadline = time.monotonic() + settings.MONNIFY_RETRY_BUDGET
+    attempt = 0
+    while True:
+        probe = await sync_to_async(monnify.allow_call, thread_sensitive=False)(breaker)
+        response, error = None, None
+        try:
+            response = await client.request(
+                method,
+                path,
+                body,
+                headers,
+                monnify.read_timeout(deadline),
+                idempotent,
+            )
+        except MonnifyError as e:
+            error = e
+        status_code = None if response is None else response[0]
+        if not monnify.is_failure(status_code, error):
+            if probe:
+                await sync_to_async(breaker.record_success, thread_sensitive=False)(
+                    probe
+                )
+            return response
+        await sync_to_async(breaker.record_failure, thread_sensitive=False)(probe)
+        delay = monnify.retry_delay(attempt, deadline, idempotent, status_code, error)
+        if delay is None:
+            if error is not None:
+                raise error
+            return response
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def call(
+    method: str, path: str, body: Union[dict, None] = None, idempotent: bool = True
+) -> dict:
+    """Calls the Monnify API with the cached token, see monnify.call
+
+    Raises:
+        GatewayUnavailable: the circuit is open
+        MonnifyError: the gateway could not be reached or rejected the request
+
+    Returns:
+        dict: the response body
+    """
+    headers = {"Authorization": f"Bearer {await get_access_token()}"}
+    status_code, content = await _send(method, path, body, headers, idempotent)
+    if status_code == 401:
+        headers = {"Authorization": f"Bearer {await get_access_token(True)}"}
+        status_code, content = await _send(method, path, body, headers, idempotent)
+    return monnify.parse_body(status_code, content)
+
+
+def _sync_fallback(sync_function):
+    """Runs the sync client instead when the deployment is not ASGI
+
+    Under WSGI every async view runs on a loop of its own, a pool per loop
+    would open and drop a connection per request. Without MONNIFY_ASYNC
+    the call goes to the pooled sync client, on the request thread.
+    """
+
+    def decorator(coroutine_function):
+        @functools.wraps(coroutine_function)
+        async def wrapper(*args):
+            if not settings.MONNIFY_ASYNC:
+                return await sync_to_async(sync_function)(*args)
+            return await coroutine_function(*args)
+
+        return wrapper
+
+    return decorator
+
+
+@_sync_fallback(monnify.init_transaction)
+async def init_transaction(request: TransactionRequest) -> Transaction:
+    """Initialises a transaction the customer then pays by card or transfer"""
+    return monnify.transaction_from(
+        await call("post", monnify.INIT_TRANSACTION_PATH, request.to_json())
+    )
+
+
+@_sync_fallback(monnify.charge_card)
+async def charge_card(transaction_reference: str, card: Card) -> CardCharge:
+    """Charges a card for an initialised transaction"""
+    return monnify.card_charge_from(
+        await call(
+            "post",
+            monnify.CARD_CHARGE_PATH,
+            monnify.charge_payload(transaction_reference, card),
+            idempotent=False,
+        )
+    )
+
+
+@_sync_fallback(monnify.init_bank_transfer)
+async def init_bank_transfer(
+    transaction_reference: str, bank_code: str
+) -> TransferAccount:
+    """Account details the customer transfers the amount of a transaction to"""
+    return monnify.transfer_account_from(
+        await call(
+            "post",
+            monnify.BANK_TRANSFER_PATH,
+            monnify.transfer_payload(transaction_reference, bank_code),
+        )
+    )
+
+
+@_sync_fallback(monnify.get_transaction)
+async def get_transaction(transaction_reference: str) -> TransactionStatus:
+    """Looks a transaction up"""
+    return monnify.transaction_status_from(
+        await call("get", monnify.transaction_path(transaction_reference))
+    )
@@ -0,0 +1,196 @@
+import json
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Set
+from urllib.parse import unquote
+
+
+class MonnifyStub:
+    """State of a local stand-in for the Monnify API, for tests and benchmarks
+
+    Only the endpoints the app uses are served. Transactions start PENDING
+    and become PAID once charged or marked with `pay`.
+    """
+
+    def __init__(self, latency: float = 0.0, token_ttl: int = 3600):
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.base_url = ""
+        self.logins = 0
+        # connections accepted, one per request without keep-alive
+        self.connections = 0
+        self.requests = 0
+        # the next this many requests are answered 503, as a degraded gateway
+        self.unavailable = 0
+        self.transactions: Dict[str, dict] = {}
+        # bearer tokens issued by login, anything else is rejected with a 401
+        self.tokens: Set[str] = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def pay(self, reference: str, amount, email: str = "") -> None:
+        with self.lock:
+            transaction = self.transactions.setdefault(
+                reference, {"transactionReference": reference, "amount": amount}
+            )
+            transaction.update(paymentStatus="PAID", amountPaid=amount)
+            if email:
+                transaction["customer"] = {"email": email}
+
+
+def _handler(stub: MonnifyStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # headers and body are separate writes, without this a reused
+            # connection waits on delayed ACKs
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with stub.lock:
+                stub.connections += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, body=None, message: str = "success"):
+            payload = json.dumps(
+                {
+                    "requestSuccessful": status < 400,
+                    "responseMessage": message,
+                    "responseBody": body,
+                }
+            ).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _authorized(self) -> bool:
+            token = self.headers.get("Authorization", "")[len("Bearer ") :]
+            return token in stub.tokens
+
+        def _json(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _wait(self) -> bool:
+            """waits the latency, False when the request is answered 503"""
+            # a stopping server answers at once so the test is not held up
+            if stub.latency:
+                stub.stopped.wait(stub.latency)
+            with stub.lock:
+                stub.requests += 1
+                if not stub.unavailable:
+                    return True
+                stub.unavailable -= 1
+            self._reply(503, None, "Service Unavailable")
+            return False
+
+        def do_POST(self):
+            body = self._json()
+            if not self._wait():
+                return
+            if self.path == "/api/v1/auth/login":
+                token = uuid.uuid4().hex
+                with stub.lock:
+                    stub.logins += 1
+                    stub.tokens.add(token)
+                return self._reply(
+                    200, {"accessToken": token, "expiresIn": stub.token_ttl}
+                )
+            if not self._authorized():
+                return self._reply(401, None, "Unauthorized")
+            if self.path == "/api/v1/merchant/transactions/init-transaction":
+                reference = f"MNFY|{uuid.uuid4().hex[:12].upper()}"
+                with stub.lock:
+                    stub.transactions[reference] = {
+                        "transactionReference": reference,
+                        "paymentStatus": "PENDING",
+                        "amount": body.get("amount"),
+                        "amountPaid": 0,
+                        "customer": {"email": body.get("customerEmail", "")},
+                    }
+                return self._reply(
+                    200,
+                    {
+                        "transactionReference": reference,
+                        "paymentReference": body.get("paymentReference"),
+                        "checkoutUrl": f"{stub.base_url}/checkout/{reference}",
+                    },
+                )
+            transaction = stub.transactions.get(body.get("transactionReference"))
+            if transaction is None:
+                return self._reply(404, None, "Transaction not found")
+            if self.path == "/api/v1/merchant/cards/charge":
+                stub.pay(transaction["transactionReference"], transaction["amount"])
+                return self._reply(
+                    200,
+                    {
+                        "status": "SUCCESS",
+                        "transactionReference": transaction["transactionReference"],
+                        "authorizedAmount": transaction["amount"],
+                    },
+                )
+            if self.path == "/api/v1/merchant/bank-transfer/init-payment":
+                return self._reply(
+                    200,
+                    {
+                        "accountNumber": "0000000000",
+                        "accountName": "Restaurant Go",
+                        "bankName": "Wema Bank",
+                        "bankCode": body.get("bankCode"),
+                        "amount": transaction["amount"],
+                        "expiresOn": "2099-01-01 00:00:00",
+                        "ussdPayment": "*945*000#",
+                        "transactionReference": transaction["transactionReference"],
+                    },
+                )
+            return self._reply(404, None, "Not found")
+
+        def do_GET(self):
+            if not self._wait():
+                return
+            prefix = "/api/v2/transactions/"
+            if not self._authorized():
+                return self._reply(401, None, "Unauthorized")
+            if not self.path.startswith(prefix):
+                return self._reply(404, None, "Not found")
+            transaction = stub.transactions.get(unquote(self.path[len(prefix) :]))
+            if transaction is None:
+                return self._reply(404, None, "Transaction not found")
+            return self._reply(200, transaction)
+
+    return Handler
+
+
+@contextmanager
+def stub_server(latency: float = 0.0, token_ttl: int = 3600) -> Iterator[MonnifyStub]:
+    """Runs the stand-in on a free local port for the duration of the block
+
+        with stub_server(latency=0.05) as stub:
+            settings.MONNIFY_BASE_URL = stub.base_url
+
+    Args:
+        latency (float, optional): seconds every response is delayed by.
+        token_ttl (int, optional): expiresIn of the issued tokens.
+
+    Yields:
+        MonnifyStub: the server state, `base_url` points at it
+    """
+    stub = MonnifyStub(latency, token_ttl)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(stub))
+    server.daemon_threads = True
+    stub.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield stub
+    finally:
+        stub.stopped.set()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,98 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Tuple, Union
+from django.db.models import Q, QuerySet
+
+DEFAULT_PAGE_SIZE = 15
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Encode the sort key of the last row on a page into an opaque cursor
+
+    Args:
+        values (List[Any]): sort key values, datetimes are stored in iso format
+
+    Returns:
+        str: url safe cursor
+    """
+    payload = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Decode a cursor produced by encode_cursor
+
+    Args:
+        cursor (str): opaque cursor
+
+    Raises:
+        ValueError: the cursor is malformed
+
+    Returns:
+        List[Any]: the encoded sort key values
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def get_page_size(request, default: int = DEFAULT_PAGE_SIZE) -> int:
+    """read the limit query param, bounded by MAX_PAGE_SIZE"""
+    try:
+        limit = int(request.query_params.get("limit", default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def paginate_by_keyset(
+    queryset: QuerySet,
+    cursor: Union[str, None],
+    page_size: int,
+    field: str = "created_at",
+) -> Tuple[list, Union[str, None]]:
+    """Paginate a queryset newest first on (field, id) without OFFSET
+
+    The filter on the cursor seeks straight to the next page through a
+    (..., field) index, so every page costs the same no matter how deep
+    the client has scrolled.
+
+    Args:
+        queryset (QuerySet): queryset to paginate
+        cursor (Union[str, None]): cursor returned with the previous page
+        page_size (int): number of rows per page
+        field (str, optional): datetime field to order by. Defaults to "created_at".
+
+    Raises:
+        ValueError: the cursor is malformed
+
+    Returns:
+        Tuple[list, Union[str, None]]: rows of the page and the next cursor
+    """
+    queryset = queryset.order_by(f"-{field}", "-id")
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            value, pk = datetime.fromisoformat(values[0]), int(values[1])
+        except (IndexError, TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+        queryset = queryset.filter(
+            Q(**{f"{field}__lt": value}) | Q(**{field: value, "id__lt": pk})
+        )
+    rows = list(queryset[: page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, field), last.pk])
+    return rows, next_cursor
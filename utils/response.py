@@ -1,4 +1,6 @@
+from django.http import JsonResponse
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
 
 def service_response(
@@ -24,3 +26,30 @@ def service_response(
         },
         status=status_code,
     )
+
+
+def json_response(
+    status: str = "success", data: dict = {}, message: str = "", status_code=200
+) -> JsonResponse:
+    """service_response for plain django views, async views cannot return a
+    DRF Response
+
+    Args:
+        status (str, optional): request status Defaults to "success".
+        data (dict, optional): response data. Defaults to None.
+        message (str, optional): response message. Defaults to None.
+        status (int, optional): response status code. Defaults to 200.
+
+    Returns:
+        JsonResponse: Http response, encoded like a DRF response
+    """
+    return JsonResponse(
+        {
+            "status": status,
+            "message": message,
+            "data": data,
+            "status_code": status_code,
+        },
+        status=status_code,
+        encoder=JSONEncoder,
+    )
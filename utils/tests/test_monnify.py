@@ -0,0 +1,407 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import pytest
+from asgiref.sync import async_to_sync
+from decimal import Decimal
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import RequestFactory
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.models import User
+from users.views import MonnifyTransferView
+from utils import monnify, monnify_async
+from utils.monnify_stub import stub_server
+
+
+@pytest.fixture(autouse=True)
+def clear_token():
+    cache.delete(monnify.TOKEN_CACHE_KEY)
+    cache.delete(monnify.REFRESH_LOCK_KEY)
+    monnify.get_breaker().reset()
+    yield
+    cache.delete(monnify.TOKEN_CACHE_KEY)
+    monnify.get_breaker().reset()
+
+
+def _login_counter(expires_in=3600, delay=0.0):
+    calls = []
+
+    def login():
+        calls.append(1)
+        time.sleep(delay)
+        return {"accessToken": f"token-{len(calls)}", "expiresIn": expires_in}
+
+    return login, calls
+
+
+def test_concurrent_workers_share_one_login():
+    login, calls = _login_counter(delay=0.2)
+    tokens = []
+    with patch("utils.monnify._login", side_effect=login):
+        threads = [
+            threading.Thread(target=lambda: tokens.append(monnify.get_access_token()))
+            for _ in range(16)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert monnify.get_access_token() == "token-1"
+
+    assert len(calls) == 1
+    assert tokens == ["token-1"] * 16
+
+
+def test_short_lived_token_is_not_cached_and_refresh_can_be_forced(settings):
+    settings.MONNIFY_TOKEN_REFRESH_MARGIN = 60
+    login, calls = _login_counter(expires_in=30)
+    with patch("utils.monnify._login", side_effect=login):
+        assert monnify.get_access_token() == "token-1"
+        assert monnify.get_access_token() == "token-2"
+
+    login, calls = _login_counter()
+    with patch("utils.monnify._login", side_effect=login):
+        monnify.get_access_token()
+        assert monnify.get_access_token(force_refresh=True) == "token-2"
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def stub(settings):
+    with stub_server() as stub:
+        settings.MONNIFY_BASE_URL = stub.base_url
+        monnify.reset_session()
+        yield stub
+    monnify.reset_session()
+
+
+def test_call_retries_once_with_a_fresh_token_on_401(stub):
+    cache.set(monnify.TOKEN_CACHE_KEY, "revoked")
+
+    transaction = monnify.init_transaction(_payment())
+
+    assert transaction.transaction_reference.startswith("MNFY|")
+    assert stub.logins == 1
+    assert cache.get(monnify.TOKEN_CACHE_KEY) in stub.tokens
+
+
+def _payment(amount="1500.00"):
+    return monnify.TransactionRequest(
+        amount=Decimal(amount),
+        customer_name="ada",
+        customer_email="ada@test.com",
+        payment_reference="REF1",
+        payment_description="Wallet Funding",
+        payment_methods=["CARD"],
+    )
+
+
+def test_client_reuses_pooled_connections(stub):
+    for _ in range(5):
+        transaction = monnify.init_transaction(_payment())
+        charge = monnify.charge_card(
+            transaction.transaction_reference,
+            monnify.Card("5061020000000000094", "3", "2050", "1234", "123"),
+        )
+        assert charge.successful
+    status = monnify.get_transaction(transaction.transaction_reference)
+
+    assert (status.paid, status.amount_paid) == (True, Decimal("1500.0"))
+    # eleven calls and one login over a single keep-alive connection
+    assert (stub.logins, stub.connections) == (1, 1)
+
+
+def test_slow_gateway_times_out_within_the_retry_budget(settings):
+    settings.MONNIFY_READ_TIMEOUT = 0.2
+    settings.MONNIFY_RETRY_BUDGET = 0.5
+    with stub_server(latency=1) as stub:
+        settings.MONNIFY_BASE_URL = stub.base_url
+        monnify.reset_session()
+        started = time.monotonic()
+        with pytest.raises(monnify.MonnifyError):
+            monnify.get_access_token()
+    assert time.monotonic() - started < 1
+    monnify.reset_session()
+
+
+@pytest.mark.django_db
+def test_transfer_view_uses_the_client(stub):
+    user = User.objects.create_user(
+        username="ada", password="12345", email="ada@test.com"
+    )
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    response = client.post("/api/v1/funding/transfer", {"amount": 2000}, format="json")
+
+    assert response.status_code == 200
+    assert response.data["data"]["account_number"] == "0000000000"
+    assert response.data["data"]["charges_fee"] == 10
+
+
+def _run_async(coroutine):
+    """runs a coroutine on a fresh loop, closing its gateway connections after"""
+
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await monnify_async.reset_client()
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def asgi(settings):
+    settings.MONNIFY_ASYNC = True
+
+
+def test_async_client_shares_a_bounded_pool(stub, settings, asgi):
+    settings.MONNIFY_POOL_SIZE = 4
+
+    async def fund():
+        transactions = await asyncio.gather(
+            *[monnify_async.init_transaction(_payment()) for _ in range(20)]
+        )
+        account = await monnify_async.init_bank_transfer(
+            transactions[0].transaction_reference, "035"
+        )
+        return transactions, account, monnify_async.get_client().connections_opened
+
+    transactions, account, opened = _run_async(fund())
+
+    assert len({t.transaction_reference for t in transactions}) == 20
+    assert account.amount == Decimal("1500.0")
+    # the sync login and at most the pool size of async connections
+    assert stub.logins == 1
+    assert opened <= 4
+
+
+def test_async_client_retries_once_with_a_fresh_token_on_401(stub, asgi):
+    cache.set(monnify.TOKEN_CACHE_KEY, "revoked")
+
+    transaction = _run_async(monnify_async.init_transaction(_payment()))
+    status = _run_async(
+        monnify_async.get_transaction(transaction.transaction_reference)
+    )
+
+    assert status.payment_status == "PENDING"
+    assert stub.logins == 1
+
+
+def test_async_client_times_out_within_the_retry_budget(settings, asgi):
+    settings.MONNIFY_READ_TIMEOUT = 0.2
+    settings.MONNIFY_RETRY_BUDGET = 0.5
+    cache.set(monnify.TOKEN_CACHE_KEY, "token")
+    with stub_server(latency=1) as stub:
+        settings.MONNIFY_BASE_URL = stub.base_url
+        started = time.monotonic()
+        with pytest.raises(monnify.MonnifyError):
+            _run_async(monnify_async.init_transaction(_payment()))
+    assert time.monotonic() - started < 1
+
+
+@pytest.mark.django_db
+def test_async_transfer_view_runs_under_wsgi(stub):
+    user = User.objects.create_user(
+        username="ada", password="12345", email="ada@test.com"
+    )
+    view = MonnifyTransferView.as_view()
+    factory = RequestFactory()
+
+    # a WSGI worker runs the async view on a loop of its own and the
+    # gateway calls on the sync client
+    response = async_to_sync(view)(
+        factory.post(
+            "/api/v1/funding/transfer",
+            {"amount": 2000},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}",
+        )
+    )
+    unauthenticated = async_to_sync(view)(
+        factory.post("/api/v1/funding/transfer", {"amount": 2000})
+    )
+
+    body = json.loads(response.content)
+    assert stub.connections == 1
+    assert response.status_code == 200
+    assert body["data"]["account_number"] == "0000000000"
+    assert body["data"]["charges_fee"] == 10
+    assert unauthenticated.status_code == 401
+
+
+def test_degraded_gateway_is_retried_with_backoff(stub, settings):
+    settings.MONNIFY_RETRY_BACKOFF = 0.01
+    stub.unavailable = 2
+
+    transaction = monnify.init_transaction(_payment())
+
+    assert transaction.transaction_reference.startswith("MNFY|")
+    # a 503 on the login and one on the init, each retried once
+    assert stub.requests == 4
+    assert monnify.get_breaker().metrics()["recent_failures"] == 2
+
+    stub.unavailable = 3
+    with pytest.raises(monnify.MonnifyError):
+        monnify.get_transaction(transaction.transaction_reference)
+    # out of retries after MONNIFY_MAX_RETRIES
+    assert stub.requests == 7
+
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_circuit_opens_fails_fast_and_closes_after_a_probe(settings):
+    settings.MONNIFY_BREAKER_FAILURES = 3
+    settings.MONNIFY_BREAKER_RESET = 0.2
+    settings.MONNIFY_MAX_RETRIES = 0
+    settings.MONNIFY_BASE_URL = f"http://127.0.0.1:{_closed_port()}"
+    monnify.reset_session()
+    breaker = monnify.get_breaker()
+    cache.set(monnify.TOKEN_CACHE_KEY, "token")
+
+    for _ in range(3):
+        with pytest.raises(monnify.MonnifyError) as error:
+            monnify.get_transaction("MNFY|1")
+        assert not error.value.delivered
+    with pytest.raises(monnify.GatewayUnavailable) as error:
+        monnify.get_transaction("MNFY|1")
+    assert error.value.status_code == 503
+    assert breaker.state() == "open"
+
+    time.sleep(0.25)
+    with stub_server() as stub:
+        settings.MONNIFY_BASE_URL = stub.base_url
+        stub.pay("MNFY|1", 1000)
+        cache.delete(monnify.TOKEN_CACHE_KEY)
+        assert monnify.get_transaction("MNFY|1").paid
+    monnify.reset_session()
+
+    metrics = breaker.metrics()
+    assert metrics["state"] == "closed"
+    assert metrics["rejected_calls"] == 1
+    assert metrics["transitions"] == {"closed": 1, "open": 1, "half_open": 1}
+
+
+def test_async_client_fails_fast_while_the_circuit_is_open(stub, asgi):
+    breaker = monnify.get_breaker()
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    requests = stub.requests
+
+    with pytest.raises(monnify.GatewayUnavailable):
+        _run_async(monnify_async.init_transaction(_payment()))
+
+    assert stub.requests == requests
+
+
+async def _keep_alive_server(drop):
+    """answers every request on a connection until `drop` says to close it
+
+    `drop(number)` of the request on the connection returns "idle" to close
+    after answering, "unanswered" to close after reading it without an answer.
+    """
+    received = []
+
+    async def serve(reader, writer):
+        number = 0
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                # the client closed the connection
+                return
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            number += 1
+            received.append(head.split(b" ")[1].decode())
+            action = drop(number)
+            if action != "unanswered":
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}")
+                await writer.drain()
+            if action:
+                writer.close()
+                return
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    return server, received
+
+
+@pytest.mark.parametrize(
+    "idempotent, drop, outcome, requests",
+    [
+        # the gateway may have processed the charge, it is not sent again
+        (False, "unanswered", "error", 2),
+        (True, "unanswered", "ok", 3),
+        # closed while idle, nothing was written on it
+        (False, "idle", "ok", 2),
+    ],
+)
+def test_async_client_resends_only_what_is_safe_on_a_dropped_connection(
+    idempotent, drop, outcome, requests
+):
+    async def scenario():
+        server, received = await _keep_alive_server(
+            lambda number: (
+                drop
+                if (drop == "idle" and number == 1)
+                or (drop == "unanswered" and number == 2)
+                else None
+            )
+        )
+        port = server.sockets[0].getsockname()[1]
+        client = monnify_async.AsyncMonnifyClient(f"http://127.0.0.1:{port}", 1, 1, 1)
+        try:
+            await client.request("get", "/first")
+            # lets the close of an idle connection reach the client
+            await asyncio.sleep(0.05)
+            try:
+                await client.request("post", "/charge", {}, idempotent=idempotent)
+                result = "ok"
+            except monnify.MonnifyError as e:
+                assert e.delivered
+                result = "error"
+            return result, received
+        finally:
+            await client.aclose()
+            server.close()
+            await server.wait_closed()
+
+    result, received = asyncio.run(scenario())
+
+    assert result == outcome
+    assert len(received) == requests
+
+
+@pytest.mark.django_db
+def test_funding_views_answer_503_while_the_circuit_is_open(stub):
+    user = User.objects.create_user(
+        username="ada", password="12345", email="ada@test.com"
+    )
+    admin = User.objects.create_superuser(
+        username="admin", password="12345", email="admin@test.com"
+    )
+    breaker = monnify.get_breaker()
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    response = client.post("/api/v1/funding/transfer", {"amount": 2000}, format="json")
+
+    assert response.status_code == 503
+    assert response.data["message"].startswith("Payment gateway unavailable")
+    assert 0 < int(response["Retry-After"]) <= 30
+    assert stub.requests == 0
+
+    client.force_authenticate(user=admin)
+    status = client.get("/api/v1/funding/gateway").data["data"]
+    assert (status["state"], status["rejected_calls"]) == ("open", 1)
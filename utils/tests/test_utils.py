@@ -1,6 +1,12 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from utils.utils import send_otp, send_reset_otp
+from utils.utils import (
+    RefGenerator,
+    decode_ref,
+    generate_order_ref,
+    send_otp,
+    send_reset_otp,
+)
 
 
 @pytest.mark.parametrize(
@@ -107,3 +113,30 @@ def test_send_reset_otp(email):
             message=message,
             user_email=email,
         )
+
+
+def test_generate_order_ref_is_unique_and_ordered():
+    refs = [generate_order_ref() for _ in range(10000)]
+    assert len(set(refs)) == len(refs)
+    assert refs == sorted(refs)
+    assert all(len(ref) == 13 for ref in refs)
+
+
+def test_ref_generator_encodes_node_id():
+    generator = RefGenerator(node_id=513)
+    ref = generator.next_ref()
+    assert (decode_ref(ref) >> 12) & 0x3FF == 513
+
+
+def test_ref_generator_survives_clock_going_backwards():
+    generator = RefGenerator(node_id=1)
+    with patch.object(RefGenerator, "_now", return_value=5000):
+        first = generator.next_id()
+    with patch.object(RefGenerator, "_now", return_value=4000):
+        second = generator.next_id()
+    assert second > first
+
+
+def test_ref_generator_rejects_invalid_node_id():
+    with pytest.raises(ValueError):
+        RefGenerator(node_id=1024)
@@ -1,6 +1,10 @@
 import random
+import threading
+import time
 import traceback
 import uuid
+from decimal import ROUND_HALF_UP, Decimal
+from django.conf import settings
 from utils.mails import sendmail
 import logging
 from typing import Union
@@ -8,6 +12,9 @@ import string
 
 logger = logging.getLogger(__name__)
 
+# smallest naira unit, wallet amounts are rounded to it
+KOBO = Decimal("0.01")
+
 
 def send_otp(email: Union[str, None], username: Union[str, None]) -> Union[str, None]:
     """
@@ -97,3 +104,132 @@ def generate_ref() -> str:
     """generate unique reference code"""
     code = "".join(random.choices(string.ascii_uppercase + string.digits, k=10))
     return code.upper()
+
+
+# Crockford base32 alphabet, it drops I, L, O and U so references are easy to
+# read out over the phone to support staff
+_REF_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_REF_LENGTH = 13
+# custom epoch (2024-01-01 00:00:00 UTC) in milliseconds
+_REF_EPOCH = 1704067200000
+_NODE_BITS = 10
+_SEQUENCE_BITS = 12
+_MAX_NODE = (1 << _NODE_BITS) - 1
+_MAX_SEQUENCE = (1 << _SEQUENCE_BITS) - 1
+
+
+class RefGenerator:
+    """Snowflake-style generator for time ordered order references.
+
+    Every id packs a millisecond timestamp, a node id and a per millisecond
+    sequence into a 63-bit integer which is encoded as 13 Crockford base32
+    characters. References generated by the same node are strictly
+    increasing and references from different nodes never collide.
+    """
+
+    def __init__(self, node_id: int) -> None:
+        if not 0 <= node_id <= _MAX_NODE:
+            raise ValueError(f"node_id must be between 0 and {_MAX_NODE}")
+        self.node_id = node_id
+        self._last_timestamp = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _now() -> int:
+        return int(time.time() * 1000) - _REF_EPOCH
+
+    def next_id(self) -> int:
+        """Returns the next id as an integer"""
+        with self._lock:
+            timestamp = self._now()
+            # never go backwards if the system clock is adjusted
+            if timestamp < self._last_timestamp:
+                timestamp = self._last_timestamp
+            if timestamp == self._last_timestamp:
+                self._sequence = (self._sequence + 1) & _MAX_SEQUENCE
+                if self._sequence == 0:
+                    # sequence exhausted for this millisecond, borrow the next one
+                    timestamp = self._last_timestamp + 1
+            else:
+                self._sequence = 0
+            self._last_timestamp = timestamp
+            return (
+                (timestamp << (_NODE_BITS + _SEQUENCE_BITS))
+                | (self.node_id << _SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    def next_ref(self) -> str:
+        """Returns the next id encoded as a fixed length reference"""
+        return encode_ref(self.next_id())
+
+
+def encode_ref(value: int) -> str:
+    """encode an integer id as a fixed length Crockford base32 reference"""
+    chars = []
+    for _ in range(_REF_LENGTH):
+        value, index = divmod(value, 32)
+        chars.append(_REF_ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+def decode_ref(ref: str) -> int:
+    """decode a reference produced by encode_ref back into its integer id"""
+    value = 0
+    for char in ref.upper():
+        value = value * 32 + _REF_ALPHABET.index(char)
+    return value
+
+
+def _default_node_id() -> int:
+    """resolve the node id from settings, falling back to a random one
+
+    Containerised replicas tend to share the same small process ids, so an
+    unset node is drawn from the OS random source instead. Random nodes can
+    still meet, checkout then retries with a fresh reference. Set
+    ORDER_REF_NODE_ID per worker to rule collisions out.
+    """
+    node_id = getattr(settings, "ORDER_REF_NODE_ID", None)
+    if node_id is None or node_id == "":
+        node_id = random.SystemRandom().randint(0, _MAX_NODE)
+        logger.warning(
+            f"ORDER_REF_NODE_ID is not set, generating order references as "
+            f"random node {node_id}"
+        )
+        return node_id
+    return int(node_id)
+
+
+_ref_generator: Union[RefGenerator, None] = None
+_ref_generator_lock = threading.Lock()
+
+
+def generate_order_ref() -> str:
+    """generate a unique, time ordered order reference"""
+    global _ref_generator
+    if _ref_generator is None:
+        with _ref_generator_lock:
+            if _ref_generator is None:
+                _ref_generator = RefGenerator(_default_node_id())
+    return _ref_generator.next_ref()
+
+
+def to_money(amount) -> Decimal:
+    """Converts an amount to a Decimal rounded to kobo
+
+    Floats go through their string form so 0.1 becomes 0.10, not the binary
+    approximation of it.
+
+    Args:
+        amount (Union[Decimal, float, int, str]): the amount
+
+    Raises:
+        InvalidOperation: the amount is not a number
+
+    Returns:
+        Decimal: the amount with two decimal places
+    """
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return amount.quantize(KOBO, rounding=ROUND_HALF_UP)